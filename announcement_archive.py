@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+生成した告知文・月全体の案内文の履歴
+
+一括生成・月全体の案内文を作るたびに、出力した内容を SQLite に追記します（書き換え・削除はしない）。
+- 本文は内容のハッシュで1回だけ保存し、同じ本文を何度生成しても増えない
+- 本文はテンプレート一式を辞書にして zlib で圧縮する（定型文の部分がほぼ辞書への参照になる）
+- 予定ID・投稿日・チャンネルで引けるので、過去の月をカレンダーを取り直さずに出力し直せる
+- as_of を渡すと「その時点で最後に生成した内容」を返す
+
+使い方:
+  python announcement_archive.py --from 2026-03-01 --to 2026-03-31 --out 3月.csv
+  python announcement_archive.py --event <予定ID>
+  python announcement_archive.py --from 2026-03-01 --to 2026-03-31 --as-of "2026-02-28 18:00"
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import config
+from bulk_export import BULK_CSV_HEADER, CANCELLED_MESSAGE, SKIPPED_MESSAGE, row_key, rows_to_csv
+
+KIND_ANNOUNCEMENT = "announcement"
+KIND_OVERVIEW = "overview"
+OVERVIEW_VARIANT = "月全体"
+
+# zlib の辞書は後ろの 32KB までしか使われない
+_ZDICT_MAX_BYTES = 32 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dictionaries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dict_hash TEXT NOT NULL UNIQUE,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bodies (
+    body_hash TEXT PRIMARY KEY,
+    dict_id INTEGER,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    post_date TEXT NOT NULL,
+    post_time TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    body_hash TEXT NOT NULL,
+    archived_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_key ON entries (kind, scope, event_id, variant, id);
+CREATE INDEX IF NOT EXISTS idx_entries_event ON entries (event_id, archived_at);
+CREATE INDEX IF NOT EXISTS idx_entries_date ON entries (post_date);
+CREATE INDEX IF NOT EXISTS idx_entries_channel ON entries (channel, post_date);
+"""
+
+_ENTRY_COLUMNS = "e.id, e.kind, e.scope, e.event_id, e.variant, e.post_date, e.post_time, e.channel, e.body_hash, e.archived_at"
+
+
+def _sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def resolve_post_date(md: str, ref: datetime) -> str:
+    """
+    一括生成の「M/D」を、基準日時に一番近い年の日付（YYYY-MM-DD）にする。
+    12月に作った1月の予定は翌年になる。読めない値はそのまま返す。
+    """
+    try:
+        m, d = (int(p) for p in str(md).strip().split("/")[:2])
+        candidates = []
+        for year in (ref.year - 1, ref.year, ref.year + 1):
+            try:
+                candidates.append(date(year, m, d))
+            except ValueError:
+                continue
+    except ValueError:
+        return str(md)
+    if not candidates:
+        return str(md)
+    return min(candidates, key=lambda c: abs((c - ref.date()).days)).isoformat()
+
+
+def _month_key(month_str: str, ref: datetime) -> str:
+    """月全体の案内文の「N月」を YYYY-MM にする（基準日時に一番近い年）"""
+    try:
+        month = int(str(month_str).strip().rstrip("月"))
+    except ValueError:
+        return str(month_str)
+    return resolve_post_date(f"{month}/1", ref)[:7]
+
+
+def _format_date(iso: str) -> str:
+    """YYYY-MM-DD を一括生成の「M/D」に戻す"""
+    try:
+        d = date.fromisoformat(iso)
+    except ValueError:
+        return iso
+    return f"{d.month}/{d.day}"
+
+
+class AnnouncementArchive:
+    """
+    生成した告知文の履歴（SQLite・追記のみ）。
+    scope（カレンダーID・貼り付け・.ics など）× 予定ID × 段階ごとに、内容が変わったときだけ1行増やす。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or config.ANNOUNCEMENT_ARCHIVE_PATH
+        self._write_lock = threading.Lock()
+        # 辞書は追記のみなので、読み込んだものは覚えておく
+        self._dicts: Dict[int, bytes] = {}
+        self._dict_ids: Dict[str, int] = {}
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    # --- 圧縮 ---
+
+    def _dictionary_id(self, conn: sqlite3.Connection, dictionary_texts: Iterable[str]) -> Optional[Tuple[int, bytes]]:
+        """
+        テンプレート一式から作った圧縮用辞書の (番号, 中身)（同じ内容の辞書は1回だけ保存する）。
+        新しく保存した番号は取り消されることがあるので、覚えるのはトランザクションが確定してから（_remember_dictionary）。
+        """
+        data = "\n".join(sorted(dictionary_texts)).encode("utf-8")[-_ZDICT_MAX_BYTES:]
+        if not data:
+            return None
+        dict_hash = _sha1(data)
+        dict_id = self._dict_ids.get(dict_hash)
+        if dict_id is None:
+            conn.execute("INSERT OR IGNORE INTO dictionaries (dict_hash, data) VALUES (?, ?)", (dict_hash, data))
+            dict_id = conn.execute("SELECT id FROM dictionaries WHERE dict_hash = ?", (dict_hash,)).fetchone()[0]
+        return dict_id, data
+
+    def _remember_dictionary(self, dictionary: Optional[Tuple[int, bytes]]) -> None:
+        if dictionary is not None:
+            dict_id, data = dictionary
+            self._dict_ids[_sha1(data)] = dict_id
+            self._dicts[dict_id] = data
+
+    def _dictionary(self, conn: sqlite3.Connection, dict_id: int) -> bytes:
+        data = self._dicts.get(dict_id)
+        if data is None:
+            data = self._dicts[dict_id] = conn.execute(
+                "SELECT data FROM dictionaries WHERE id = ?", (dict_id,)
+            ).fetchone()[0]
+        return data
+
+    def _store_body(self, conn: sqlite3.Connection, text: str, dictionary: Optional[Tuple[int, bytes]]) -> str:
+        raw = text.encode("utf-8")
+        body_hash = _sha1(raw)
+        if conn.execute("SELECT 1 FROM bodies WHERE body_hash = ?", (body_hash,)).fetchone() is None:
+            dict_id = None
+            if dictionary is not None:
+                dict_id, data = dictionary
+                comp = zlib.compressobj(9, zdict=data)
+            else:
+                comp = zlib.compressobj(9)
+            conn.execute(
+                "INSERT INTO bodies VALUES (?, ?, ?)", (body_hash, dict_id, comp.compress(raw) + comp.flush())
+            )
+        return body_hash
+
+    def _load_body(self, conn: sqlite3.Connection, body_hash: str) -> str:
+        dict_id, data = conn.execute("SELECT dict_id, data FROM bodies WHERE body_hash = ?", (body_hash,)).fetchone()
+        if dict_id is None:
+            return zlib.decompress(data).decode("utf-8")
+        decomp = zlib.decompressobj(zdict=self._dictionary(conn, dict_id))
+        return (decomp.decompress(data) + decomp.flush()).decode("utf-8")
+
+    # --- 追記 ---
+
+    def record_rows(self, scope: str, rows: List[Dict[str, Any]], dictionary_texts: Iterable[str] = (),
+                    archived_at: float = None) -> int:
+        """
+        一括生成の行を追記する。スキップ・取消の行は記録しない。
+        前回記録した内容（本文・投稿日時・チャンネル）と同じ行は増やさない。戻り値は追記した行数。
+        予定の識別子（_id）のない行は、同じ枠に投稿する別の予定と見分けられないので ValueError（何も記録しない）。
+        dictionary_texts には生成に使ったテンプレートの本文を渡す（圧縮の辞書になる）。
+        """
+        archived_at = time.time() if archived_at is None else archived_at
+        ref = datetime.fromtimestamp(archived_at)
+        items = []
+        for r in rows:
+            message = r.get("メッセージ", "")
+            if not message or message in (SKIPPED_MESSAGE, CANCELLED_MESSAGE):
+                continue
+            event_id, variant = row_key(r)
+            items.append((
+                event_id, variant, resolve_post_date(r.get("日付", ""), ref),
+                r.get("時間", ""), r.get("チャンネル名", ""), message,
+            ))
+        return self._append(KIND_ANNOUNCEMENT, scope, items, dictionary_texts, archived_at)
+
+    def record_overview(self, scope: str, month_str: str, text: str, archived_at: float = None) -> int:
+        """月全体の案内文を追記する（予定IDの代わりに YYYY-MM、投稿日はその月の1日）"""
+        archived_at = time.time() if archived_at is None else archived_at
+        month = _month_key(month_str, datetime.fromtimestamp(archived_at))
+        item = (month, OVERVIEW_VARIANT, f"{month}-01" if len(month) == 7 else month, "", "", text)
+        return self._append(KIND_OVERVIEW, scope, [item], (), archived_at)
+
+    def _append(self, kind: str, scope: str, items: List[tuple], dictionary_texts: Iterable[str],
+                archived_at: float) -> int:
+        if not items:
+            return 0
+        with self._write_lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            latest = {
+                (event_id, variant): rest
+                for event_id, variant, *rest in conn.execute(
+                    "SELECT event_id, variant, post_date, post_time, channel, body_hash FROM entries "
+                    "WHERE id IN (SELECT MAX(id) FROM entries WHERE kind = ? AND scope = ? GROUP BY event_id, variant)",
+                    (kind, scope),
+                )
+            }
+            dictionary = self._dictionary_id(conn, dictionary_texts)
+            new_entries = []
+            for event_id, variant, post_date, post_time, channel, text in items:
+                body_hash = _sha1(text.encode("utf-8"))
+                if latest.get((event_id, variant)) == [post_date, post_time, channel, body_hash]:
+                    continue
+                self._store_body(conn, text, dictionary)
+                new_entries.append(
+                    (kind, scope, event_id, variant, post_date, post_time, channel, body_hash, archived_at)
+                )
+                latest[(event_id, variant)] = [post_date, post_time, channel, body_hash]
+            conn.executemany(
+                "INSERT INTO entries (kind, scope, event_id, variant, post_date, post_time, channel, body_hash, "
+                "archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                new_entries,
+            )
+        self._remember_dictionary(dictionary)
+        return len(new_entries)
+
+    # --- 検索 ---
+
+    def rows(self, date_from: str = None, date_to: str = None, channel: str = None, scope: str = None,
+             event_id: str = None, as_of: float = None, kind: str = KIND_ANNOUNCEMENT) -> List[Dict[str, Any]]:
+        """
+        各予定・段階の「as_of 時点で最後に記録した内容」を、一括生成の行（A〜D列＋内部用キー）で返す。
+        投稿日（YYYY-MM-DD）・チャンネル・予定IDでの絞り込みは最後の内容に対して行う（日付が移った予定は移った先で出る）。
+        """
+        as_of = time.time() if as_of is None else as_of
+        key_filters, key_params = ["kind = ?", "archived_at <= ?"], [kind, as_of]
+        for clause, value in (("scope = ?", scope), ("event_id = ?", event_id)):
+            if value is not None:
+                key_filters.append(clause)
+                key_params.append(value)
+        row_filters, row_params = [], []
+        for clause, value in (("post_date >= ?", date_from), ("post_date <= ?", date_to), ("channel = ?", channel)):
+            if value is not None:
+                row_filters.append(clause)
+                row_params.append(value)
+        if row_filters:
+            # 期間・チャンネルに一度でも入ったことのある予定だけを対象にして、最後の内容を探す
+            key_filters.append(
+                "(scope, event_id, variant) IN (SELECT scope, event_id, variant FROM entries WHERE kind = ? AND "
+                + " AND ".join(row_filters) + ")"
+            )
+            key_params += [kind] + row_params
+        sql = (
+            f"SELECT {_ENTRY_COLUMNS} FROM entries e WHERE e.id IN ("
+            f"SELECT MAX(id) FROM entries WHERE {' AND '.join(key_filters)} GROUP BY scope, event_id, variant)"
+        )
+        for clause in row_filters:
+            sql += f" AND e.{clause}"
+        params = key_params + row_params
+        sql += " ORDER BY e.post_date, e.post_time, e.id"
+        with self._connect() as conn:
+            return [self._to_row(conn, r) for r in conn.execute(sql, params).fetchall()]
+
+    def history(self, event_id: str, variant: str = None) -> List[Dict[str, Any]]:
+        """1つの予定について記録したすべての内容（古い順）"""
+        sql = f"SELECT {_ENTRY_COLUMNS} FROM entries e WHERE e.event_id = ?"
+        params: List[Any] = [event_id]
+        if variant is not None:
+            sql += " AND e.variant = ?"
+            params.append(variant)
+        with self._connect() as conn:
+            return [self._to_row(conn, r) for r in conn.execute(sql + " ORDER BY e.id", params).fetchall()]
+
+    def _to_row(self, conn: sqlite3.Connection, r: tuple) -> Dict[str, Any]:
+        _, kind, scope, event_id, variant, post_date, post_time, channel, body_hash, archived_at = r
+        return {
+            "メッセージ": self._load_body(conn, body_hash),
+            "日付": _format_date(post_date),
+            "時間": post_time,
+            "チャンネル名": channel,
+            "_id": event_id,
+            "_variant": variant,
+            "_kind": kind,
+            "_scope": scope,
+            "_post_date": post_date,
+            "_archived_at": archived_at,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """記録の件数と、本文の元の大きさ・保存している大きさ（バイト）"""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            bodies, stored = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM bodies").fetchone()
+            dict_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM dictionaries").fetchone()[0]
+            raw = sum(len(self._load_body(conn, h).encode("utf-8")) for (h,) in conn.execute("SELECT body_hash FROM bodies"))
+        return {"entries": entries, "bodies": bodies, "raw_bytes": raw, "stored_bytes": stored, "dictionary_bytes": dict_bytes}
+
+
+def _parse_as_of(value: str) -> float:
+    """「YYYY-MM-DD」「YYYY-MM-DD HH:MM」を時刻（秒）にする。日付だけならその日の終わり"""
+    if len(value.strip()) == 10:
+        return datetime.fromisoformat(value.strip()).timestamp() + 24 * 3600 - 1
+    return datetime.fromisoformat(value.strip()).timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="生成した告知文の履歴を出力する")
+    parser.add_argument("--from", dest="date_from", help="投稿日の開始（YYYY-MM-DD）")
+    parser.add_argument("--to", dest="date_to", help="投稿日の終わり（YYYY-MM-DD）")
+    parser.add_argument("--channel", help="チャンネル名で絞り込む")
+    parser.add_argument("--scope", help="カレンダーIDなど（記録したときの scope）で絞り込む")
+    parser.add_argument("--event", help="予定IDの履歴をすべて出す")
+    parser.add_argument("--as-of", dest="as_of", help="この時点で最後に生成した内容を出す（YYYY-MM-DD [HH:MM]）")
+    parser.add_argument("--overview", action="store_true", help="月全体の案内文を出す")
+    parser.add_argument("--stats", action="store_true", help="件数と保存サイズを表示する")
+    parser.add_argument("--path", help=f"履歴のファイル（既定: {config.ANNOUNCEMENT_ARCHIVE_PATH}）")
+    parser.add_argument("--out", help="出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    archive = AnnouncementArchive(args.path)
+    if args.stats:
+        s = archive.stats()
+        print(f"記録 {s['entries']}件・本文 {s['bodies']}件："
+              f"{s['raw_bytes']:,} バイト → {s['stored_bytes']:,} バイト（辞書 {s['dictionary_bytes']:,} バイト）")
+        return
+    if args.event:
+        rows = archive.history(args.event)
+    else:
+        rows = archive.rows(
+            args.date_from, args.date_to, args.channel, args.scope,
+            as_of=_parse_as_of(args.as_of) if args.as_of else None,
+            kind=KIND_OVERVIEW if args.overview else KIND_ANNOUNCEMENT,
+        )
+    out = open(args.out, "w", encoding="utf-8-sig", newline="") if args.out else sys.stdout
+    try:
+        if args.overview:
+            out.write("\n\n".join(r["メッセージ"] for r in rows) + "\n")
+        else:
+            out.write(rows_to_csv(rows, BULK_CSV_HEADER))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{len(rows)}件", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
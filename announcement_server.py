@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+告知文生成のHTTPサービス
+
+Discord bot やスプレッドシートのスクリプトから、画面を介さずに告知文を生成するための小さなHTTPサーバーです。
+標準ライブラリの asyncio だけで動き、テンプレートと生成器はプロセス内で保持し続けます。
+入力チェック・生成はスレッドで行うので、大きな一括生成の途中でも他の接続の応答は止まりません。
+
+エンドポイント（本文・応答は JSON。予定は画面と同じ event_data 形式）:
+- POST /generate  {"event": {...}, "templates_override": {...}}  → {"valid", "errors", "announcement"}
+- POST /validate  {"events": [...]}                              → {"results": [{"valid", "errors"}, ...]}
+- POST /bulk      {"events": [...]}                              → 1行1JSONの JSONL をチャンク転送で順次返す
+- POST /overview  {"events": [...], "month_str": "3月"}          → {"overview"}
+- GET  /health, GET /stats
+
+使い方:
+    python announcement_server.py --port 8787
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import config
+from bulk_export import build_bulk_row, event_keys, expand_variants
+from event_table import EventTable
+from generate_announcement import AnnouncementGenerator, render_cache_stats
+from monthly_overview import build_monthly_overview, guess_month_str
+from pregen_worker import templates_key
+
+_ENDPOINTS = ("/health", "/stats", "/generate", "/validate", "/bulk", "/overview")
+# 件数を数えるときの、どのエンドポイントでもないパスの名前（任意のパスで集計が増え続けないように）
+_OTHER_PATH = "(other)"
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    """応答ステータス付きのエラー（本文は {"error": message}）"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class AnnouncementService:
+    """エンドポイントの処理本体。上書きテンプレートごとの生成器を保持して使い回す"""
+
+    def __init__(self, max_generators: int = None):
+        self.max_generators = max_generators or config.ANNOUNCEMENT_SERVER_MAX_GENERATORS
+        self._generators: "OrderedDict[str, AnnouncementGenerator]" = OrderedDict()
+        # 生成器の表は複数のスレッドから使う
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests: Dict[str, int] = {}
+        self.latencies = deque(maxlen=1000)
+        # 起動時に既定テンプレートを読み込んでおく
+        self.generator_for(None)
+
+    def generator_for(self, templates_override: Optional[Dict[str, str]]) -> AnnouncementGenerator:
+        key = templates_key(templates_override)
+        with self._lock:
+            generator = self._generators.get(key)
+            if generator is None:
+                generator = AnnouncementGenerator(templates_override=templates_override or {})
+                self._generators[key] = generator
+                while len(self._generators) > self.max_generators:
+                    self._generators.popitem(last=False)
+            else:
+                self._generators.move_to_end(key)
+            return generator
+
+    def generate(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        event = _require_dict(body, "event")
+        generator = self.generator_for(body.get("templates_override"))
+        event = dict(event)
+        is_valid, errors = generator.validate_event_data(event)
+        announcement = generator.generate(event) if is_valid else None
+        return {"valid": is_valid, "errors": errors, "announcement": announcement}
+
+    def validate(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        events = _require_list(body, "events")
+        generator = self.generator_for(body.get("templates_override"))
+        ok, failures = generator.validate_many(events)
+        return {"results": [{"valid": v, "errors": failures.get(i, [])} for i, v in enumerate(ok)]}
+
+    def bulk_rows(self, body: Dict[str, Any]):
+        """一括生成の行を1行ずつ返すジェネレーター（入力チェックは先に全行まとめて行う）"""
+        events = _require_list(body, "events")
+        generator = self.generator_for(body.get("templates_override"))
+        expanded = [
+            (event_id, variant, ev_row)
+            for ed, event_id in zip(events, event_keys(events))
+            for variant, ev_row in expand_variants(ed)
+        ]
+        valid, _ = generator.validate_many([ev_row for _, _, ev_row in expanded])
+
+        def rows():
+            for (event_id, variant, ev_row), is_valid in zip(expanded, valid):
+                row = build_bulk_row(generator, ev_row, is_valid)
+                row["_id"] = event_id
+                row["_variant"] = variant
+                yield row
+        return rows()
+
+    def overview(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        events = _require_list(body, "events")
+        month_str = body.get("month_str") or guess_month_str(events)
+        return {"overview": build_monthly_overview(EventTable.from_event_data(events), month_str)}
+
+    def record(self, path: str, latency: float) -> None:
+        path = path if path in _ENDPOINTS else _OTHER_PATH
+        self.requests[path] = self.requests.get(path, 0) + 1
+        self.latencies.append(latency)
+
+    def stats(self) -> Dict[str, Any]:
+        lat = sorted(self.latencies)
+        p = (lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] if lat else None)
+        return {
+            "uptime_sec": round(time.time() - self.started_at, 1),
+            "requests": dict(self.requests),
+            "latency_p50": p(0.5),
+            "latency_p95": p(0.95),
+            "generators": len(self._generators),
+            "render_cache": render_cache_stats(),
+        }
+
+
+def _require_dict(body: Dict[str, Any], key: str) -> Dict[str, Any]:
+    value = body.get(key)
+    if not isinstance(value, dict):
+        raise HttpError(400, f"'{key}' にはオブジェクトを指定してください")
+    return value
+
+
+def _require_list(body: Dict[str, Any], key: str) -> list:
+    value = body.get(key)
+    if not isinstance(value, list) or not all(isinstance(v, dict) for v in value):
+        raise HttpError(400, f"'{key}' にはオブジェクトの配列を指定してください")
+    return value
+
+
+def _json_bytes(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class AnnouncementServer:
+    """asyncio の HTTP/1.1 サーバー（keep-alive・チャンク転送対応の最小実装）"""
+
+    def __init__(self, service: AnnouncementService = None, token: str = None):
+        self.service = service or AnnouncementService()
+        self.token = config.ANNOUNCEMENT_SERVER_TOKEN if token is None else token
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = None, port: int = None) -> Tuple[str, int]:
+        host = host or config.ANNOUNCEMENT_SERVER_HOST
+        port = config.ANNOUNCEMENT_SERVER_PORT if port is None else port
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self) -> None:
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self._read_request(reader), timeout=config.ANNOUNCEMENT_SERVER_KEEPALIVE_SEC
+                    )
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                keep_alive = await self._dispatch(request, writer)
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            await self._send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").strip().split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "リクエスト行が不正です")
+        headers: Dict[str, str] = {}
+        while True:
+            h = await reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = h.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "Content-Length が不正です")
+        if length > config.ANNOUNCEMENT_SERVER_MAX_BODY_BYTES:
+            raise HttpError(413, "本文が大きすぎます")
+        body = await reader.readexactly(length) if length else b""
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return {"method": method, "path": target.split("?", 1)[0], "headers": headers, "body": body, "keep_alive": keep_alive}
+
+    async def _dispatch(self, request: Dict[str, Any], writer: asyncio.StreamWriter) -> bool:
+        started = time.perf_counter()
+        method, path, keep_alive = request["method"], request["path"], request["keep_alive"]
+        try:
+            if self.token and path != "/health":
+                if request["headers"].get("authorization", "") != f"Bearer {self.token}":
+                    raise HttpError(401, "認証が必要です")
+            if path in ("/health", "/stats"):
+                if method != "GET":
+                    raise HttpError(405, "GET のみ対応しています")
+                payload = {"status": "ok"} if path == "/health" else self.service.stats()
+                await self._send_json(writer, 200, payload, keep_alive)
+            elif path in _ENDPOINTS:
+                if method != "POST":
+                    raise HttpError(405, "POST のみ対応しています")
+                try:
+                    body = json.loads(request["body"].decode("utf-8") or "{}")
+                except (UnicodeDecodeError, ValueError):
+                    raise HttpError(400, "本文が JSON ではありません")
+                if not isinstance(body, dict):
+                    raise HttpError(400, "本文は JSON オブジェクトにしてください")
+                loop = asyncio.get_running_loop()
+                handler = getattr(self.service, "bulk_rows" if path == "/bulk" else path.lstrip("/"))
+                result = await loop.run_in_executor(None, handler, body)
+                if path == "/bulk":
+                    # 応答を書き始めたあとの失敗は 500 を返せないので、_send_jsonl が接続を切る
+                    keep_alive = await self._send_jsonl(writer, result, keep_alive)
+                else:
+                    await self._send_json(writer, 200, result, keep_alive)
+            else:
+                raise HttpError(404, "エンドポイントがありません")
+        except HttpError as e:
+            await self._send_json(writer, e.status, {"error": str(e)}, keep_alive)
+        except Exception as e:
+            await self._send_json(writer, 500, {"error": f"生成に失敗しました: {e}"}, keep_alive=False)
+            keep_alive = False
+        self.service.record(path, time.perf_counter() - started)
+        return keep_alive
+
+    def _write_head(self, writer: asyncio.StreamWriter, status: int, headers: Dict[str, str], keep_alive: bool) -> None:
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}"]
+        headers = {**headers, "Connection": "keep-alive" if keep_alive else "close"}
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool) -> None:
+        body = _json_bytes(payload)
+        self._write_head(writer, status, {
+            "Content-Type": "application/json; charset=utf-8",
+            "Content-Length": str(len(body)),
+        }, keep_alive)
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_jsonl(self, writer: asyncio.StreamWriter, rows: Iterator[Dict[str, Any]], keep_alive: bool,
+                          chunk_rows: int = 20) -> bool:
+        """
+        1行1JSONをチャンク転送で送る。chunk_rows 行ずつスレッドで生成して送り出す。
+        途中で生成に失敗したら終わりのチャンクを送らずに接続を切る（受け手は本文が途中で切れたと分かる）。
+        戻り値は接続を続けてよいか。
+        """
+        self._write_head(writer, 200, {
+            "Content-Type": "application/x-ndjson; charset=utf-8",
+            "Transfer-Encoding": "chunked",
+        }, keep_alive)
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                chunk = await loop.run_in_executor(None, _take_json_lines, rows, chunk_rows)
+            except Exception:
+                await writer.drain()
+                return False
+            if not chunk:
+                break
+            _write_chunk(writer, chunk)
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return keep_alive
+
+
+def _take_json_lines(rows: Iterator[Dict[str, Any]], n: int) -> bytes:
+    """rows から最大 n 行を取り出して1行1JSONのバイト列にする（残りがなければ空）"""
+    lines: List[bytes] = []
+    for row in rows:
+        lines.append(_json_bytes(row) + b"\n")
+        if len(lines) >= n:
+            break
+    return b"".join(lines)
+
+
+def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+    writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+
+async def _main(host: str, port: int) -> None:
+    server = AnnouncementServer()
+    bound_host, bound_port = await server.start(host, port)
+    print(f"announcement server: http://{bound_host}:{bound_port}/")
+    await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="告知文生成のHTTPサービス")
+    parser.add_argument("--host", default=config.ANNOUNCEMENT_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.ANNOUNCEMENT_SERVER_PORT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
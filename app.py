@@ -6,16 +6,42 @@ Discordオンラインイベント配信文章 自動生成ツール - Web版
     streamlit run app.py
 """
 
+import asyncio
 import streamlit as st
 import sys
 import os
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from parse_calendar import parse_event_name
+from parse_calendar import parse_event_name, iter_calendar_events
 from generate_announcement import AnnouncementGenerator
-from monthly_overview import build_monthly_overview
-from config import CALENDAR_EXCLUDE_TITLES
+from monthly_overview import build_monthly_overview, guess_month_str
+from bulk_export import (
+    BULK_CSV_HEADER,
+    DELTA_CSV_HEADER,
+    ExportLedger,
+    build_bulk_rows,
+    build_delta_rows,
+    changed_rows,
+    diff_rows,
+    filter_row_indices,
+    paginate,
+    preview_table,
+    rows_to_csv,
+)
+from event_table import EventTable
+from event_search import EventSearchIndex
+from event_registry import get_registry
+from ics_import import load_ics_events, month_window
+from template_store import EMPTY_SNAPSHOT, TemplateSnapshot, TemplateStore
+from announcement_archive import AnnouncementArchive
+from sheet_push import SheetPushError, make_backend, push_rows
+from pipeline import PageConverter, run_bulk_pipeline
+from config import (
+    CALENDAR_EXCLUDE_TITLES, CALENDAR_EXPAND_RECURRING_LOCALLY, TEMPLATES_CSV_PATH,
+    SHEET_PUSH_LOCAL_PATH, SHEET_PUSH_SPREADSHEET_ID, PIPELINE_PAGE_SIZE,
+)
 
 # Googleカレンダー連携（オプション）
 try:
@@ -24,15 +50,32 @@ try:
         get_authorization_url,
         exchange_code_for_credentials,
         credentials_to_dict,
-        dict_to_credentials,
-        refresh_credentials_if_needed,
+        credentials_account_key,
         fetch_calendar_list,
         fetch_upcoming_events,
-        api_event_to_event_data,
+        fetch_events_batch,
+        convert_api_events,
+        iter_event_pages,
     )
 except ImportError:
     GOOGLE_API_AVAILABLE = False
 
+try:
+    from token_manager import get_token_manager, TokenRefreshError
+    from calendar_requests import get_stats as get_api_stats
+except ImportError:
+    GOOGLE_API_AVAILABLE = False
+
+try:
+    from event_cache import EventCache
+except ImportError:
+    EventCache = None
+
+try:
+    from pregen_worker import get_worker, stop_worker
+except ImportError:
+    get_worker = None
+
 
 st.set_page_config(
     page_title="Discord告知文生成ツール",
@@ -44,328 +87,464 @@ st.title("📢 Discord告知文 自動生成ツール")
 st.caption("SnsClubオンラインイベント用の告知文章を生成します")
 
 
-def _get_channel_name(event_type: str) -> str:
-    """イベント種別からチャンネル名を返す"""
-    if not event_type:
-        return "交流会のお知らせ"
-    if "万垢生限定オン会" in event_type or "万垢" in event_type:
-        return "万垢お知らせチャンネル"
-    if "ジャンル特化グルコン" in event_type:
-        return "ジャンル特化グルコンのお知らせ"
-    if "講師対談" in event_type or "生徒対談" in event_type or "オン会" in event_type:
-        return "交流会のお知らせ"
-    return "交流会のお知らせ"
+# フラグメント：ボタンなどを押したとき、その部分だけを再実行する。
+# Streamlit 1.37 未満は experimental_fragment、それもない版（1.33 未満）では画面全体を再実行する
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda fn: fn)
+
+
+def _set_editing_template(event_type) -> None:
+    """テンプレート編集の開閉（ボタンの on_click。押した部分の再実行の前に反映される）"""
+    st.session_state["editing_template"] = event_type
 
 
-def _get_post_date_time(event_type: str, event_date: str, event_time: str):
+@st.cache_resource(max_entries=16)
+def _cached_generator(snapshot_id: int, templates_stamp, _overrides) -> AnnouncementGenerator:
     """
-    事前告知＝前日18:00固定、まもなく開始＝当日開始5分前 を返す。
-    戻り値: (日付文字列 "M/D", 時間文字列 "HH:MM")
+    テンプレートの版ごとの生成器（全セッション・再実行で共有）。templates_stamp はテンプレートCSVの更新時刻。
+    版の中身は変わらないので、キーは版番号だけ（_overrides はキーに含めない）
     """
-    from datetime import datetime, timedelta
-    year = datetime.now().year
-    post_date_str, post_time_str = str(event_date), str(event_time)
+    return AnnouncementGenerator(templates_override=dict(_overrides))
+
+
+@st.cache_resource
+def _get_template_store():
+    """追加・編集したテンプレートの置き場（全セッション共有）。使えない環境では None"""
     try:
-        parts = str(event_date).strip().split("/")
-        if len(parts) >= 2:
-            m, d = int(parts[0]), int(parts[1])
-        else:
-            return (event_date, "18:00" if "事前告知" in str(event_type) else event_time)
-        if "事前告知" in str(event_type):
-            event_dt = datetime(year, m, d)
-            prev = event_dt - timedelta(days=1)
-            post_date_str = f"{prev.month}/{prev.day}"
-            post_time_str = "18:00"
-        elif "間もなく開始" in str(event_type) or "まもなく" in str(event_type):
-            post_date_str = f"{m}/{d}"
-            t = str(event_time).strip()
-            if ":" in t:
-                parts_t = t.split(":")
-                h = int(parts_t[0])
-                mi = int(parts_t[1]) if len(parts_t) > 1 else 0
-                t_dt = datetime(year, m, d, h, mi) - timedelta(minutes=5)
-                post_time_str = f"{t_dt.hour:02d}:{t_dt.minute:02d}"
-            else:
-                post_time_str = t
-        else:
-            post_date_str = f"{m}/{d}"
-            post_time_str = "18:00" if "事前告知" in str(event_type) else str(event_time)
+        return TemplateStore()
     except Exception:
-        post_date_str = event_date
-        post_time_str = "18:00" if "事前告知" in str(event_type) else event_time
-    return (post_date_str, post_time_str)
+        return None
 
 
-def _handle_oauth_callback():
-    q = st.query_params
-    code = q.get("code")
-    if code and isinstance(code, list):
-        code = code[0]
-    if not code:
+def _templates_snapshot() -> TemplateSnapshot:
+    """最新のテンプレートの版（置き場が使えなければ上書きなし）"""
+    store = _get_template_store()
+    if store is None:
+        return EMPTY_SNAPSHOT
+    try:
+        return store.latest()
+    except Exception:
+        return EMPTY_SNAPSHOT
+
+
+def _templates_stamp():
+    try:
+        return os.stat(TEMPLATES_CSV_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _generator(snapshot: TemplateSnapshot = None) -> AnnouncementGenerator:
+    """テンプレートの版での生成器（省略時は最新の版。EMPTY_SNAPSHOT なら標準のテンプレートだけ）"""
+    if snapshot is None:
+        snapshot = _templates_snapshot()
+    return _cached_generator(snapshot.id, _templates_stamp(), snapshot.overrides)
+
+
+@st.cache_resource
+def _get_event_cache():
+    """予定の永続キャッシュ（全セッション共有）。使えない環境では None"""
+    if EventCache is None:
+        return None
+    try:
+        return EventCache()
+    except Exception:
+        return None
+
+
+@st.cache_resource
+def _get_export_ledger():
+    """一括生成で前回出力した行の記録（全セッション共有）。使えない環境では None"""
+    try:
+        return ExportLedger()
+    except Exception:
+        return None
+
+
+@st.cache_resource
+def _get_announcement_archive():
+    """生成した告知文の履歴（全セッション共有）。使えない環境では None"""
+    try:
+        return AnnouncementArchive()
+    except Exception:
+        return None
+
+
+def _archive_rows(scope: str, rows: list) -> None:
+    """一括生成の行を履歴に追記する（履歴に書けなくても生成結果の表示は続ける）"""
+    archive = _get_announcement_archive()
+    if archive is None:
         return
-    # 既に連携済みでURLにcodeだけ残っている場合：交換せずそのまま表示（rerunしない＝セッション維持）
-    if "google_credentials" in st.session_state:
+    try:
+        archive.record_rows(scope, rows, _generator().templates.values())
+    except Exception:
+        pass
+
+
+def _make_fetch_fn(creds_dict: dict):
+    """
+    事前生成ワーカー用：カレンダーIDから1ヶ月分の予定を取得する関数（トークンは共有の管理から取る）。
+    「予定を取得」と同じく全ページをたどる（250件を超えるカレンダーでも事前生成の結果が欠けない）。
+    """
+    def _fetch(calendar_id: str):
+        creds = get_token_manager().get(creds_dict)
+        if CALENDAR_EXPAND_RECURRING_LOCALLY:
+            # 元予定・例外の取得は中で全ページをたどる
+            return fetch_upcoming_events(
+                creds, calendar_id=calendar_id, max_results=250, days_ahead=31, expand_recurring_locally=True,
+            )
+        return [ev for page in iter_event_pages(creds, calendar_id, 250, 31) for ev in page]
+    return _fetch
+
+
+def _make_batch_fetch_fn(creds_dict: dict):
+    """事前生成ワーカー用：複数カレンダーの予定をHTTPバッチ1往復で取得する関数（手元で繰り返しを展開する場合は使わない）"""
+    if CALENDAR_EXPAND_RECURRING_LOCALLY:
+        return None
+
+    def _fetch_many(calendar_ids):
+        creds = get_token_manager().get(creds_dict)
+        result = fetch_events_batch(creds, calendar_ids, max_results=250, days_ahead=31)
+        if result["errors"]:
+            # 1件でも失敗したら同期全体を失敗扱いにする（古い結果を残す）
+            raise next(iter(result["errors"].values()))
+        return result["events"]
+    return _fetch_many
+
+
+def _sync_credentials_to_session(creds_dict: dict) -> None:
+    """共有のトークンが更新されていたらセッションの辞書も最新にする"""
+    latest = get_token_manager().credentials_dict(creds_dict)
+    if latest is not None and latest != creds_dict:
+        st.session_state["google_credentials"] = latest
+
+
+def _pregenerated(pregen, calendar_id: str, events_meta: dict):
+    """事前生成済みの結果が、表示中の予定・テンプレートと同じかそれより新しければ返す"""
+    if pregen is None:
+        return None
+    ready = pregen.ready_for([calendar_id], dict(_templates_snapshot().overrides))
+    if ready is None or ready["synced_at"] < events_meta.get("synced_at", 0):
+        return None
+    return ready
+
+
+BULK_PAGE_SIZES = [20, 50, 100]
+BULK_CSV_LABEL = "📥 CSVをダウンロード（A=メッセージ, B=日付, C=時間, D=チャンネル名）"
+
+
+def _store_bulk_result(key: str, rows: list, header: list = None, file_name: str = "告知文一覧.csv",
+                       label: str = BULK_CSV_LABEL, on_click=None, args=None, scope: str = None) -> None:
+    """一括生成の結果をセッションに保存する（表示はページごと。CSVはここで1回だけ作る）"""
+    header = header or BULK_CSV_HEADER
+    _archive_rows(scope or key, rows)
+    st.session_state[key] = {
+        "rows": rows,
+        "header": header,
+        "csv": rows_to_csv(rows, header).encode("utf-8-sig"),
+        "file_name": file_name,
+        "label": label,
+        "on_click": on_click,
+        "args": args,
+        "scope": scope,
+    }
+    st.session_state[f"{key}_page"] = 1
+
+
+def _render_bulk_result(key: str, scope: str = None) -> None:
+    """保存済みの一括生成結果を、絞り込み・ページ送り付きで表示する（画面に送るのは表示中のページだけ）"""
+    result = st.session_state.get(key)
+    if not result or (scope is not None and result.get("scope") != scope):
+        return
+    rows, header = result["rows"], result["header"]
+    channels = sorted({r.get("チャンネル名", "") for r in rows if r.get("チャンネル名", "")})
+    dates = sorted({r.get("日付", "") for r in rows if r.get("日付", "")}, key=_date_sort_key)
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        channel = st.selectbox("チャンネルで絞り込み", ["すべて"] + channels, key=f"{key}_channel")
+    with col2:
+        post_date = st.selectbox("投稿日で絞り込み", ["すべて"] + dates, key=f"{key}_date")
+    with col3:
+        page_size = st.selectbox("表示件数", BULK_PAGE_SIZES, key=f"{key}_page_size")
+    indices = filter_row_indices(
+        rows,
+        channel=None if channel == "すべて" else channel,
+        post_date=None if post_date == "すべて" else post_date,
+    )
+    page_count = max(1, -(-len(indices) // page_size))
+    # 絞り込み・表示件数を変えてページ数が減ったら範囲内に戻す
+    if st.session_state.get(f"{key}_page", 1) > page_count:
+        st.session_state[f"{key}_page"] = page_count
+    page = st.number_input(
+        f"ページ（全{page_count}ページ・{len(indices)}件）", min_value=1, max_value=page_count, step=1,
+        key=f"{key}_page",
+    )
+    page_indices, page, _ = paginate(indices, int(page), page_size)
+    st.dataframe(preview_table(rows, page_indices, header), use_container_width=True, hide_index=True)
+    if page_indices:
+        shown = st.selectbox(
+            "全文を表示する行",
+            [None] + page_indices,
+            format_func=lambda i: "（選択してください）" if i is None else f"No.{i + 1}　{rows[i].get('日付', '')} {rows[i].get('時間', '')}　{rows[i].get('チャンネル名', '')}",
+            key=f"{key}_expand",
+        )
+        if shown is not None:
+            st.text_area("メッセージ全文（コピーしてDiscordに貼り付けてください）", rows[shown].get("メッセージ", ""), height=300)
+    st.download_button(
+        result["label"],
+        result["csv"],
+        file_name=result["file_name"],
+        mime="text/csv; charset=utf-8",
+        key=f"{key}_download",
+        on_click=result["on_click"],
+        args=result["args"],
+    )
+    _sheet_push_button(key, result)
+
+
+def _sheet_push_button(key: str, result: dict) -> None:
+    """スプレッドシートに送るボタン（送り先を設定しているときだけ）。送ったらダウンロードと同じく出力の記録を更新する"""
+    creds_dict = st.session_state.get("google_credentials") if GOOGLE_API_AVAILABLE else None
+    if not ((SHEET_PUSH_SPREADSHEET_ID and creds_dict) or SHEET_PUSH_LOCAL_PATH):
+        return
+    if not st.button("📤 スプレッドシートに送る（同じ予定の行は上書き）", key=f"{key}_push"):
         return
-    redirect_uri = os.environ.get("REDIRECT_URI") or (
-        st.secrets.get("REDIRECT_URI") if hasattr(st, "secrets") else None
-    ) or "http://localhost:8501"
     try:
-        creds = exchange_code_for_credentials(redirect_uri, code)
+        creds = get_token_manager().get(creds_dict) if creds_dict else None
+        backend = make_backend(creds, credentials_account_key(creds_dict) if creds_dict else "default")
+        with st.spinner("スプレッドシートに送っています..."):
+            counts = push_rows(backend, result["rows"])
+    except SheetPushError as e:
+        st.error(f"{e}（編集の権限がない場合は、もう一度Googleカレンダーと連携してください）")
+        return
     except Exception as e:
-        st.session_state["oauth_error"] = str(e)
+        st.error(f"エラー: {e}")
         return
-    if creds:
-        st.session_state["google_credentials"] = credentials_to_dict(creds)
-        st.session_state["oauth_just_completed"] = True
-        if "oauth_error" in st.session_state:
-            del st.session_state["oauth_error"]
-        # rerunしない＝このまま描画を続けて「連携済み」を表示（Streamlit Cloudでrerunするとセッションが消えて空白になるため）
-    else:
-        st.session_state["oauth_error"] = "トークンの取得に失敗しました。もう一度「Googleカレンダーと連携する」からやり直してください。"
+    if result["on_click"] is not None:
+        result["on_click"](*(result["args"] or ()))
+    st.success(
+        f"追加 {counts['appended']}件・更新 {counts['updated']}件・変更なし {counts['unchanged']}件を送りました"
+        f"（{counts['calls']}回の呼び出し）。"
+    )
 
-if GOOGLE_API_AVAILABLE:
-    _handle_oauth_callback()
 
-tab_names = ["🔗 Googleカレンダーと連携", "✏️ 手動入力", "📝 テンプレート管理"]
-if not GOOGLE_API_AVAILABLE:
-    tab_names = ["✏️ 手動入力", "📝 テンプレート管理"]
+def _event_search_index(events_list: list, events_meta: dict) -> EventSearchIndex:
+    """予定一覧の検索インデックス。取得（同期）ごとに1回だけ作ってセッションに保存する"""
+    version = (events_meta.get("calendar_id"), events_meta.get("synced_at"), len(events_list), id(events_list))
+    cached = st.session_state.get("calendar_events_index")
+    if cached is None or cached[0] != version:
+        cached = (version, EventSearchIndex(events_list))
+        st.session_state["calendar_events_index"] = cached
+    return cached[1]
 
-tabs = st.tabs(tab_names)
-tab_idx = 0
 
-if "custom_templates" not in st.session_state:
-    st.session_state["custom_templates"] = {}
+def _date_sort_key(date_str: str) -> tuple:
+    try:
+        m, d = (int(p) for p in date_str.split("/")[:2])
+        return (m, d)
+    except ValueError:
+        return (99, 99)
+
+
+@_fragment
+def _event_pick_section(events_list: list, events_meta: dict) -> None:
+    """取得した予定から1件選んで告知文を生成する"""
+    search_index = _event_search_index(events_list, events_meta)
+    query = st.text_input(
+        "予定を検索（講師名・ジャンル・タイトル・日付）",
+        key="event_search_query",
+        placeholder="例: はるパパ / スポット / 3/4（空白区切りで絞り込み）",
+    )
+    matches = search_index.search(query)
+    if query:
+        st.caption(f"{len(search_index)}件中 {len(matches)}件")
+    selected = st.selectbox(
+        "告知文を生成する予定を選んでください",
+        matches,
+        format_func=lambda i: search_index.labels[i],
+    )
+    if selected is None:
+        st.info("検索に一致する予定がありません。")
+    elif st.button("📝 この予定で告知文を生成", type="primary"):
+        ed = events_list[selected].copy()
+        for k in ("_id", "_raw_summary", "_raw_description"):
+            ed.pop(k, None)
+        try:
+            generator = _generator()
+            is_valid, errors = generator.validate_event_data(ed)
+            if not is_valid:
+                st.warning("入力情報に不備があります（手動入力タブで補完してください）")
+                for err in errors:
+                    st.write(f"• {err}")
+            else:
+                announcement = generator.generate(ed)
+                if announcement:
+                    st.success("告知文を生成しました！")
+                    st.text_area(
+                        "生成された告知文（コピーしてDiscordに貼り付けてください）",
+                        announcement,
+                        height=400,
+                        key="announcement_output_linked",
+                    )
+                    st.caption("💡 上のテキストを選択して Ctrl+C（Mac: Cmd+C）でコピーできます")
+                else:
+                    st.error("告知文の生成に失敗しました")
+        except Exception as e:
+            st.error(f"エラー: {e}")
 
-if GOOGLE_API_AVAILABLE:
-    with tabs[tab_idx]:
-        redirect_uri = os.environ.get("REDIRECT_URI") or (
-            st.secrets.get("REDIRECT_URI") if hasattr(st, "secrets") else None
-        ) or "http://localhost:8501"
-        auth_url = get_authorization_url(redirect_uri)
 
-        if "oauth_error" in st.session_state:
-            st.error(st.session_state["oauth_error"])
-            if st.button("エラーを消す"):
-                del st.session_state["oauth_error"]
-                st.rerun()
-        if "google_credentials" not in st.session_state:
-            st.markdown("**Googleカレンダーと連携して、予定を自動で取り込みます**")
-            if auth_url:
-                # 同じタブで開く（許可後にこのタブに戻り、連携済みが表示されるようにする）
-                st.markdown(
-                    f'<a href="{auth_url}" style="display:inline-block;padding:0.5rem 1rem;'
-                    'background:#FF4B4B;color:white;text-decoration:none;border-radius:0.5rem;font-weight:500;">'
-                    '🔗 Googleカレンダーと連携する</a>',
-                    unsafe_allow_html=True,
+def _fetch_and_generate(creds, calendar_id: str, event_cache) -> None:
+    """
+    1ヶ月分の予定をページごとに取得しながら、変換・一括生成まで進める。
+    最初のページの告知文は後のページの取得中に表示する。作った行は一括生成のボタンで使い回すためにセッションに置くだけで、
+    一括生成の結果・履歴・出力の記録には書かない（手元で繰り返しを展開する取得と同じく、取得だけでは何も残さない）。
+    """
+    progress = st.empty()
+    first_rows = st.empty()
+    convert = PageConverter(parse_event_name, CALENDAR_EXCLUDE_TITLES, event_cache, calendar_id)
+    pages = iter_event_pages(creds, calendar_id, PIPELINE_PAGE_SIZE, 31)
+    snapshot = _templates_snapshot()
+    events, rows = [], []
+
+    async def _run() -> None:
+        async for batch in run_bulk_pipeline(pages, _generator(snapshot), convert):
+            if not rows and batch["rows"]:
+                first_rows.dataframe(
+                    preview_table(batch["rows"], range(min(len(batch["rows"]), 10)), BULK_CSV_HEADER),
+                    use_container_width=True, hide_index=True,
                 )
-                st.caption("クリックしてGoogleでログインし、許可するとこのページに戻り「連携済み」と表示されます。")
+            events.extend(batch["events"])
+            rows.extend(batch["rows"])
+            progress.caption(f"⏳ 予定 {len(events)}件を取得・告知文 {len(rows)}件を生成しました（続きを取得中）")
+
+    try:
+        asyncio.run(_run())
+    finally:
+        progress.empty()
+        first_rows.empty()
+    if event_cache is not None:
+        event_cache.record_sync(calendar_id, convert.ids)
+    synced_at = time.time()
+    st.session_state["calendar_events"] = events
+    st.session_state["calendar_events_meta"] = {
+        "calendar_id": calendar_id,
+        "synced_at": synced_at,
+        "from_cache": False,
+    }
+    st.session_state["calendar_fetched_rows"] = {
+        "calendar_id": calendar_id,
+        "synced_at": synced_at,
+        "snapshot_id": snapshot.id,
+        "rows": rows,
+    }
+
+
+def _fetched_rows(calendar_id: str):
+    """予定の取得時に作った一括生成の行が、表示中の予定・今のテンプレートのものなら返す"""
+    fetched = st.session_state.get("calendar_fetched_rows")
+    meta = st.session_state.get("calendar_events_meta", {})
+    if (
+        fetched is None
+        or fetched["calendar_id"] != calendar_id
+        or fetched["synced_at"] != meta.get("synced_at")
+        or fetched["snapshot_id"] != _templates_snapshot().id
+    ):
+        return None
+    return fetched["rows"]
+
+
+@_fragment
+def _calendar_bulk_section(events_list: list, pregen, calendar_id: str, ledger_scope: str) -> None:
+    """
+    取得した1ヶ月分の一括生成（全件・前回からの差分）。
+    取得日時はフラグメントの再実行でも最新を使うよう、引数ではなくセッションから読む。
+    """
+    st.markdown("**1ヶ月分を一括生成してスプレッドシート用に出力**")
+    export_ledger = _get_export_ledger()
+    delta_only = export_ledger is not None and st.checkbox(
+        "前回ダウンロードしたCSVからの差分だけを出力する（追加・変更・取消）",
+        key="bulk_delta_only",
+        help="E列に変更の種類が入ります。取消の行は前回の投稿日時・チャンネルで出力します。",
+    )
+    if st.button("📋 1ヶ月分の告知文を一括生成", type="primary", key="btn_bulk"):
+        ready = _pregenerated(pregen, calendar_id, st.session_state.get("calendar_events_meta", {}))
+        ready_rows = ready["rows"] if ready is not None else _fetched_rows(calendar_id)
+        if delta_only:
+            previous = export_ledger.entries(ledger_scope)
+            if ready_rows is not None:
+                delta = diff_rows(ready_rows, previous)
             else:
-                st.info("Google連携を使うには、管理者がGoogle CloudでOAuth設定を行う必要があります。")
+                delta = build_delta_rows(events_list, _generator(), previous)
+            rows = changed_rows(delta)
+            if rows:
+                st.success(f"前回から{len(rows)}件の変更があります。")
+                _store_bulk_result(
+                    "bulk_result", rows, DELTA_CSV_HEADER, file_name="告知文一覧_差分.csv",
+                    label="📥 差分のCSVをダウンロード（A=メッセージ, B=日付, C=時間, D=チャンネル名, E=変更）",
+                    on_click=export_ledger.apply, args=(ledger_scope, delta), scope=ledger_scope,
+                )
+            else:
+                st.session_state.pop("bulk_result", None)
+                st.info("前回ダウンロードしたCSVから変更はありません。")
         else:
-            creds_dict = st.session_state["google_credentials"]
-            creds = dict_to_credentials(creds_dict)
-            if creds is None:
-                del st.session_state["google_credentials"]
-                st.rerun()
-
-            if st.session_state.get("oauth_just_completed"):
-                st.success("✅ 連携が完了しました！「予定を取得」でカレンダーから予定を取り込めます。")
-                st.session_state["oauth_just_completed"] = False
+            rows = ready_rows if ready_rows is not None else build_bulk_rows(events_list, _generator())
+            if rows:
+                st.success(f"{len(rows)}件の告知文を生成しました。")
+                _store_bulk_result(
+                    "bulk_result", rows,
+                    on_click=export_ledger.replace if export_ledger is not None else None,
+                    args=(ledger_scope, rows) if export_ledger is not None else None,
+                    scope=ledger_scope,
+                )
             else:
-                st.success("Googleカレンダーと連携済みです")
-            if st.button("🔓 連携を解除"):
-                del st.session_state["google_credentials"]
-                if "calendar_events" in st.session_state:
-                    del st.session_state["calendar_events"]
-                if "calendar_list" in st.session_state:
-                    del st.session_state["calendar_list"]
-                st.rerun()
+                st.session_state.pop("bulk_result", None)
+                st.warning("生成できる予定がありませんでした。")
+    _render_bulk_result("bulk_result", scope=ledger_scope)
+    if st.session_state.get("bulk_result", {}).get("scope") == ledger_scope:
+        st.caption("💡 事前告知＝前日18:00・まもなく開始＝開始5分前。A列=メッセージ, B列=日付(投稿日), C列=時間(投稿時間), D列=チャンネル名。")
+
+
+@_fragment
+def _overview_section(events_list: list, pregen, calendar_id: str) -> None:
+    """月全体の案内文（取得日時は _calendar_bulk_section と同じくセッションから読む）"""
+    st.markdown("**月全体の案内文を生成**")
+    if st.button("📅 月全体の案内文を生成", type="primary", key="btn_monthly"):
+        try:
+            ready = _pregenerated(pregen, calendar_id, st.session_state.get("calendar_events_meta", {}))
+            if ready is not None:
+                overview = ready["overview"]
+            else:
+                overview = build_monthly_overview(EventTable.from_event_data(events_list), guess_month_str(events_list))
+            archive = _get_announcement_archive()
+            if archive is not None:
+                try:
+                    archive.record_overview(calendar_id, guess_month_str(events_list), overview)
+                except Exception:
+                    pass
+            st.success("月全体の案内文を生成しました！")
+            st.text_area(
+                "月全体の案内文（コピーしてDiscordに貼り付けてください）",
+                overview,
+                height=500,
+                key="monthly_overview_output",
+            )
+            st.caption("💡 特別講義→講師対談→生徒対談→ジャンル特化グルコン（ジャンルごと・日付順）")
+        except Exception as e:
+            st.error(f"エラー: {e}")
 
-            # カレンダー一覧を取得（初回のみ）
-            if "calendar_list" not in st.session_state:
-                with st.spinner("カレンダー一覧を取得しています..."):
-                    try:
-                        creds, updated = refresh_credentials_if_needed(creds)
-                        if updated is not None:
-                            st.session_state["google_credentials"] = updated
-                        cal_list = fetch_calendar_list(creds)
-                        st.session_state["calendar_list"] = cal_list if cal_list else [{"id": "primary", "summary": "メイン"}]
-                    except Exception:
-                        st.session_state["calendar_list"] = [{"id": "primary", "summary": "メイン"}]
-
-            cal_list = st.session_state.get("calendar_list", [{"id": "primary", "summary": "メイン"}])
-            cal_options = [f"{c.get('summary', '')} ({c.get('id', '')})" for c in cal_list]
-            cal_ids = [c.get("id", "primary") for c in cal_list]
-            cal_idx = st.selectbox("取得するカレンダーを選択", range(len(cal_list)), format_func=lambda i: cal_options[i])
-            selected_calendar_id = cal_ids[cal_idx] if cal_ids else "primary"
-
-            if st.button("📅 予定を取得（1ヶ月分）"):
-                with st.spinner("1ヶ月分の予定を取得しています..."):
-                    try:
-                        creds, updated = refresh_credentials_if_needed(creds)
-                        if updated is not None:
-                            st.session_state["google_credentials"] = updated
-                        events = fetch_upcoming_events(
-                            creds,
-                            calendar_id=selected_calendar_id,
-                            max_results=250,
-                            days_ahead=31,
-                        )
-                        event_data_list = []
-                        for ev in events:
-                            summary = (ev.get("summary") or "").strip()
-                            if not summary:
-                                continue
-                            if any(exc in summary for exc in CALENDAR_EXCLUDE_TITLES):
-                                continue
-                            ed = api_event_to_event_data(ev, parse_event_name)
-                            ed["_id"] = ev.get("id", "")
-                            event_data_list.append(ed)
-                        st.session_state["calendar_events"] = event_data_list
-                    except Exception as e:
-                        st.error(f"予定の取得に失敗しました: {e}")
-
-            if "calendar_events" in st.session_state and st.session_state["calendar_events"]:
-                events_list = st.session_state["calendar_events"]
-                options = [
-                    f"{ed.get('date', '')} {ed.get('time', '')}｜{ed.get('_raw_summary', '')[:40]}"
-                    for ed in events_list
-                ]
-                selected = st.selectbox("告知文を生成する予定を選んでください", range(len(options)), format_func=lambda i: options[i])
-                if st.button("📝 この予定で告知文を生成", type="primary"):
-                    ed = events_list[selected].copy()
-                    for k in ("_id", "_raw_summary", "_raw_description"):
-                        ed.pop(k, None)
-                    try:
-                        generator = AnnouncementGenerator(templates_override=st.session_state.get("custom_templates", {}))
-                        is_valid, errors = generator.validate_event_data(ed)
-                        if not is_valid:
-                            st.warning("入力情報に不備があります（手動入力タブで補完してください）")
-                            for err in errors:
-                                st.write(f"• {err}")
-                        else:
-                            announcement = generator.generate(ed)
-                            if announcement:
-                                st.success("告知文を生成しました！")
-                                st.text_area(
-                                    "生成された告知文（コピーしてDiscordに貼り付けてください）",
-                                    announcement,
-                                    height=400,
-                                    key="announcement_output_linked",
-                                )
-                                st.caption("💡 上のテキストを選択して Ctrl+C（Mac: Cmd+C）でコピーできます")
-                            else:
-                                st.error("告知文の生成に失敗しました")
-                    except Exception as e:
-                        st.error(f"エラー: {e}")
-
-                st.divider()
-                st.markdown("**1ヶ月分を一括生成してスプレッドシート用に出力**")
-                if st.button("📋 1ヶ月分の告知文を一括生成", type="primary", key="btn_bulk"):
-                    generator = AnnouncementGenerator(templates_override=st.session_state.get("custom_templates", {}))
-                    rows = []
-                    for ed in events_list:
-                        ev_copy = ed.copy()
-                        for k in ("_id", "_raw_summary", "_raw_description"):
-                            ev_copy.pop(k, None)
-                        event_type = ev_copy.get("event_type", "")
-                        # 1件の予定につき「事前告知」と「まもなく開始」の2行を出力（全日程に適用）
-                        for is_soon in (False, True):
-                            if is_soon:
-                                if "（事前告知）" not in event_type:
-                                    continue
-                                ev_row = ev_copy.copy()
-                                # 全角括弧で統一（事前告知→間もなく開始）
-                                ev_row["event_type"] = event_type.replace("（事前告知）", "（間もなく開始）")
-                            else:
-                                ev_row = ev_copy
-                            row_type = ev_row.get("event_type", "")
-                            post_date, post_time = _get_post_date_time(
-                                row_type, ev_row.get("date", ""), ev_row.get("time", "")
-                            )
-                            channel_name = _get_channel_name(row_type)
-                            is_valid = generator.validate_event_data(ev_row)[0]
-                            if is_valid:
-                                ann = generator.generate(ev_row) or ""
-                                msg = (ann or "").replace("\r", "\n")
-                                rows.append({
-                                    "メッセージ": msg,
-                                    "日付": post_date,
-                                    "時間": post_time,
-                                    "チャンネル名": channel_name,
-                                })
-                            else:
-                                rows.append({
-                                    "メッセージ": "(テンプレートに合わないためスキップ)",
-                                    "日付": post_date,
-                                    "時間": "",
-                                    "チャンネル名": "",
-                                })
-                    if rows:
-                        import io
-                        import csv as csv_module
-                        st.success(f"{len(rows)}件の告知文を生成しました。")
-                        st.dataframe(rows, use_container_width=True, height=400, column_config={"メッセージ": st.column_config.TextColumn("メッセージ", width="large")})
-                        buf = io.StringIO()
-                        w = csv_module.writer(buf)
-                        w.writerow(["メッセージ", "日付", "時間", "チャンネル名"])
-                        for r in rows:
-                            w.writerow([r["メッセージ"], r["日付"], r["時間"], r["チャンネル名"]])
-                        csv_str = buf.getvalue()
-                        st.download_button(
-                            "📥 CSVをダウンロード（A=メッセージ, B=日付, C=時間, D=チャンネル名）",
-                            csv_str.encode("utf-8-sig"),
-                            file_name="告知文一覧.csv",
-                            mime="text/csv; charset=utf-8",
-                            key="dl_bulk_csv",
-                        )
-                        st.caption("💡 事前告知＝前日18:00・まもなく開始＝開始5分前。A列=メッセージ, B列=日付(投稿日), C列=時間(投稿時間), D列=チャンネル名。")
-                    else:
-                        st.warning("生成できる予定がありませんでした。")
-
-                st.divider()
-                st.markdown("**月全体の案内文を生成**")
-                if st.button("📅 月全体の案内文を生成", type="primary", key="btn_monthly"):
-                    ev_clean = [ed.copy() for ed in events_list]
-                    for ed in ev_clean:
-                        for k in ("_id", "_raw_summary", "_raw_description"):
-                            ed.pop(k, None)
-                    try:
-                        from datetime import datetime as dt
-                        if ev_clean and ev_clean[0].get("date"):
-                            parts = str(ev_clean[0]["date"]).strip().split("/")
-                            month_str = f"{int(parts[0])}月" if parts else f"{dt.now().month}月"
-                        else:
-                            month_str = f"{dt.now().month}月"
-                        overview = build_monthly_overview(ev_clean, month_str)
-                        st.success("月全体の案内文を生成しました！")
-                        st.text_area(
-                            "月全体の案内文（コピーしてDiscordに貼り付けてください）",
-                            overview,
-                            height=500,
-                            key="monthly_overview_output",
-                        )
-                        st.caption("💡 特別講義→講師対談→生徒対談→ジャンル特化グルコン（ジャンルごと・日付順）")
-                    except Exception as e:
-                        st.error(f"エラー: {e}")
-    tab_idx += 1
 
-with tabs[tab_idx]:
+@_fragment
+def _manual_entry_section() -> None:
+    """イベント情報を手で入力して1件生成する"""
     st.markdown("**イベント情報を手動で入力**")
-    _gen = AnnouncementGenerator(templates_override=st.session_state.get("custom_templates", {}))
-    _event_type_options = sorted(_gen.templates.keys()) or [
-                "ジャンル特化グルコン（事前告知）", "ジャンル特化グルコン（間もなく開始）",
-                "万垢生限定オン会（事前告知）", "万垢生限定オン会（間もなく開始）",
-                "生徒対談（事前告知）", "生徒対談（間もなく開始）",
-                "講師対談（事前告知）", "講師対談（間もなく開始）",
-                "オン会（事前告知）", "オン会（間もなく開始）",
-            ]
+    snapshot = _templates_snapshot()
+    custom = snapshot.overrides
+    event_type_options = sorted(_generator(snapshot).templates.keys()) or get_registry().event_types()
     col1, col2 = st.columns(2)
     with col1:
         manual_event_type = st.selectbox(
             "イベント種別",
-            _event_type_options,
-            format_func=lambda x: x + " ※追加" if x in st.session_state.get("custom_templates", {}) else x,
+            event_type_options,
+            format_func=lambda x: x + " ※追加" if x in custom else x,
         )
         manual_date = st.text_input("開催日", placeholder="例: 1/31")
         manual_time = st.text_input("開始時間", placeholder="例: 12:00")
@@ -374,13 +553,123 @@ with tabs[tab_idx]:
         manual_teacher = st.text_input("講師名", placeholder="例: アカウント名")
         manual_instagram = st.text_input("Instagramリンク", placeholder="https://www.instagram.com/...")
 
-tab_idx += 1
-with tabs[tab_idx]:
+    if not st.button("📝 告知文を生成", type="primary", key="btn_generate"):
+        return
+    if not manual_date or not manual_time:
+        st.warning("開催日と開始時間は必須です")
+        return
+    event_data = {
+        "event_type": manual_event_type,
+        "date": manual_date,
+        "time": manual_time,
+    }
+    if manual_genre:
+        event_data["genre"] = manual_genre
+    if manual_teacher:
+        event_data["teacher_name"] = manual_teacher
+    if manual_instagram:
+        event_data["instagram_url"] = manual_instagram
+    try:
+        generator = _generator(snapshot)
+        is_valid, errors = generator.validate_event_data(event_data)
+        if not is_valid:
+            st.warning("入力情報に不備があります")
+            for err in errors:
+                st.write(f"• {err}")
+        else:
+            announcement = generator.generate(event_data)
+            if announcement:
+                st.success("告知文を生成しました！")
+                st.text_area(
+                    "生成された告知文（コピーしてDiscordに貼り付けてください）",
+                    announcement,
+                    height=400,
+                    key="announcement_output",
+                )
+                st.caption("💡 上のテキストを選択して Ctrl+C（Mac: Cmd+C）でコピーできます")
+            else:
+                st.error("告知文の生成に失敗しました")
+    except Exception as e:
+        st.error(f"エラー: {e}")
+        import traceback
+        st.code(traceback.format_exc())
+
+
+@_fragment
+def _paste_bulk_section() -> None:
+    """貼り付けたテキスト・テキストファイルの予定から一括生成"""
+    st.caption("Googleカレンダーの予定をまとめてコピーして貼り付けるか、テキストファイルを選んでください。予定名（【〜】）ごとに1件として読み取ります。")
+    pasted_text = st.text_area("予定のテキスト", height=200, key="bulk_paste_text")
+    pasted_file = st.file_uploader("テキストファイル（.txt）", type=["txt"], key="bulk_paste_file")
+    if st.button("📋 貼り付けた予定で一括生成", key="btn_bulk_paste"):
+        import io
+        source = io.TextIOWrapper(pasted_file, encoding="utf-8-sig") if pasted_file else pasted_text
+        pasted_events = list(iter_calendar_events(source))
+        if pasted_events:
+            paste_rows = build_bulk_rows(pasted_events, _generator())
+            st.success(f"{len(pasted_events)}件の予定から{len(paste_rows)}件の告知文を生成しました。")
+            _store_bulk_result("paste_bulk_result", paste_rows, scope="paste")
+        else:
+            st.session_state.pop("paste_bulk_result", None)
+            st.warning("予定名（【〜】）を含む予定が見つかりませんでした。")
+    _render_bulk_result("paste_bulk_result")
+
+
+@_fragment
+def _ics_bulk_section() -> None:
+    """.ics ファイルの予定から一括生成"""
+    st.caption("Googleカレンダーの「エクスポート」で書き出した .ics ファイルを選んでください。Google連携なしで、期間内の予定から告知文を作ります。繰り返し予定も開催日ごとに展開します。")
+    ics_file = st.file_uploader("iCalendarファイル（.ics）", type=["ics"], key="ics_file")
+    col1, col2 = st.columns(2)
+    with col1:
+        ics_from = st.date_input("期間の開始日", key="ics_from")
+    with col2:
+        ics_days = st.number_input("日数", min_value=1, max_value=366, value=31, key="ics_days")
+    if st.button("📂 ファイルの予定で一括生成", key="btn_bulk_ics", disabled=ics_file is None):
+        ics_stats = {}
+        ics_events = load_ics_events(
+            ics_file, *month_window(ics_from, int(ics_days)), CALENDAR_EXCLUDE_TITLES, stats=ics_stats
+        )
+        if ics_events:
+            ics_rows = build_bulk_rows(ics_events, _generator())
+            st.success(
+                f"{ics_stats['vevents']}件の予定のうち、期間内の{len(ics_events)}件から{len(ics_rows)}件の告知文を生成しました。"
+            )
+            _store_bulk_result("ics_bulk_result", ics_rows, scope="ics")
+        else:
+            st.session_state.pop("ics_bulk_result", None)
+            st.warning("期間内の予定が見つかりませんでした。")
+        if ics_stats.get("unexpanded"):
+            st.warning(
+                f"展開できない繰り返し予定が{ics_stats['unexpanded']}件あり、その開催は含まれていません"
+                "（Googleカレンダーと連携して取得してください）。"
+            )
+    _render_bulk_result("ics_bulk_result")
+
+
+def _publish_templates(changes: dict, note: str) -> bool:
+    """テンプレートの変更を新しい版として保存する（全セッションに反映される）"""
+    store = _get_template_store()
+    if store is None:
+        st.error("テンプレートの保存先（cache フォルダ）が使えないため、保存できません。")
+        return False
+    store.publish(changes, note)
+    return True
+
+
+@_fragment
+def _template_management_section() -> None:
+    """
+    テンプレートの一覧・編集・追加。
+    編集を開く・閉じるはこの部分だけ再実行し、保存・削除・追加は他のタブの生成にも効くので画面全体を再実行する。
+    """
     st.markdown("**📝 テンプレートの追加・編集**")
-    st.caption("現在のテンプレートを一覧表示し、編集できます。追加・編集した内容はこのセッション中のみ有効です。永続化する場合は「CSVでダウンロード」して templates/templates.csv に反映してください。")
-    custom = st.session_state.get("custom_templates", {})
-    base_gen = AnnouncementGenerator()
-    all_templates = {**base_gen.templates, **custom}
+    st.caption("現在のテンプレートを一覧表示し、編集できます。追加・編集した内容は新しい版として保存され、すべてのセッションで使われます。標準のテンプレートにする場合は「CSVでダウンロード」して templates/templates.csv に反映してください。")
+    snapshot = _templates_snapshot()
+    custom = snapshot.overrides
+    all_templates = _generator(snapshot).templates
+    if snapshot.id:
+        st.caption(f"版{snapshot.id}（{time.strftime('%m/%d %H:%M', time.localtime(snapshot.created_at))}・{snapshot.note}）")
 
     st.subheader("現在使用中のテンプレート一覧")
     if "editing_template" not in st.session_state:
@@ -396,46 +685,51 @@ with tabs[tab_idx]:
                     col1, col2, _ = st.columns([1, 1, 2])
                     with col1:
                         if st.button("保存", key=f"save_edit_{i}"):
-                            custom[event_type] = new_body
-                            st.session_state["custom_templates"] = custom
-                            st.session_state["editing_template"] = None
-                            st.rerun()
+                            if _publish_templates({event_type: new_body}, f"{event_type} を編集"):
+                                st.session_state["editing_template"] = None
+                                st.rerun()
                     with col2:
-                        if st.button("キャンセル", key=f"cancel_edit_{i}"):
-                            st.session_state["editing_template"] = None
-                            st.rerun()
+                        st.button("キャンセル", key=f"cancel_edit_{i}", on_click=_set_editing_template, args=(None,))
                     if is_custom:
                         if st.button("このテンプレートを削除", key=f"del_edit_{i}"):
-                            del custom[event_type]
-                            st.session_state["custom_templates"] = custom
-                            st.session_state["editing_template"] = None
-                            st.rerun()
+                            if _publish_templates({event_type: None}, f"{event_type} を削除"):
+                                st.session_state["editing_template"] = None
+                                st.rerun()
                 else:
                     st.text_area("本文", body[:500] + ("..." if len(body) > 500 else ""), height=120, key=f"preview_{i}", disabled=True)
-                    if st.button("編集", key=f"btn_edit_{i}"):
-                        st.session_state["editing_template"] = event_type
-                        st.rerun()
+                    st.button("編集", key=f"btn_edit_{i}", on_click=_set_editing_template, args=(event_type,))
                     if is_custom:
                         if st.button("デフォルトに戻す", key=f"reset_{i}"):
-                            del custom[event_type]
-                            st.session_state["custom_templates"] = custom
-                            st.rerun()
+                            if _publish_templates({event_type: None}, f"{event_type} をデフォルトに戻す"):
+                                st.rerun()
     else:
         st.info("テンプレートがありません。下の「テンプレートを追加」で追加してください。")
 
     st.subheader("テンプレートを追加")
     with st.form("add_template_form", clear_on_submit=True):
-        new_event_type = st.text_input("イベント種別名", placeholder="例: 特別講義（事前告知）")
+        new_event_type = st.text_input("イベント種別名", placeholder="例: 勉強会（事前告知）")
         new_template = st.text_area("テンプレート本文", placeholder="@everyone\n\n## 明日{{date}}の{{time}}より特別講義が開催されます...\n\n利用可能な変数: {{date}}, {{time}}, {{teacher_name}}, {{instagram_url}}, {{zoom_url}}, {{genre}} など", height=200)
         if st.form_submit_button("追加"):
             if new_event_type and new_template:
-                custom[new_event_type.strip()] = new_template.strip()
-                st.session_state["custom_templates"] = custom
-                st.success(f"「{new_event_type.strip()}」を追加しました。")
-                st.rerun()
+                if _publish_templates({new_event_type.strip(): new_template.strip()}, f"{new_event_type.strip()} を追加"):
+                    st.success(f"「{new_event_type.strip()}」を追加しました。")
+                    st.rerun()
             else:
                 st.warning("イベント種別名とテンプレート本文を入力してください。")
 
+    store = _get_template_store()
+    history = store.history() if store is not None else []
+    if len(history) > 1:
+        st.subheader("版の履歴")
+        labels = {
+            snap.id: f"版{snap.id}（{time.strftime('%m/%d %H:%M', time.localtime(snap.created_at))}・{snap.note}）"
+            for snap in history[1:]
+        }
+        restore_id = st.selectbox("戻す版", list(labels), format_func=labels.get, key="template_restore_id")
+        if st.button("この版に戻す", key="btn_template_restore"):
+            store.restore(restore_id)
+            st.rerun()
+
     st.subheader("CSVでダウンロード")
     if all_templates:
         import io
@@ -449,47 +743,213 @@ with tabs[tab_idx]:
         st.download_button("現在のテンプレート一式をCSVでダウンロード", csv_bytes, file_name="templates.csv", mime="text/csv; charset=utf-8", key="dl_templates_csv")
         st.caption("ダウンロードしたCSVを templates/templates.csv に置き換えると、次回以降もその内容がデフォルトになります。")
 
-if st.button("📝 告知文を生成", type="primary", key="btn_generate"):
-    event_data = {
-        "event_type": manual_event_type,
-        "date": manual_date,
-        "time": manual_time,
-    }
-    if manual_genre:
-        event_data["genre"] = manual_genre
-    if manual_teacher:
-        event_data["teacher_name"] = manual_teacher
-    if manual_instagram:
-        event_data["instagram_url"] = manual_instagram
-    if not manual_date or not manual_time:
-        st.warning("開催日と開始時間は必須です")
-        event_data = None
 
-    if event_data:
+def _linked_calendar_section(creds, creds_dict: dict) -> None:
+    """連携済みのときのカレンダー選択・予定の取得・生成（トークンが使えるときだけ呼ぶ）"""
+    # カレンダー一覧を取得（初回のみ）
+    if "calendar_list" not in st.session_state:
+        with st.spinner("カレンダー一覧を取得しています..."):
+            try:
+                cal_list = fetch_calendar_list(creds)
+                st.session_state["calendar_list"] = cal_list if cal_list else [{"id": "primary", "summary": "メイン"}]
+            except Exception:
+                st.session_state["calendar_list"] = [{"id": "primary", "summary": "メイン"}]
+
+    cal_list = st.session_state.get("calendar_list", [{"id": "primary", "summary": "メイン"}])
+    cal_options = [f"{c.get('summary', '')} ({c.get('id', '')})" for c in cal_list]
+    cal_ids = [c.get("id", "primary") for c in cal_list]
+    cal_idx = st.selectbox("取得するカレンダーを選択", range(len(cal_list)), format_func=lambda i: cal_options[i])
+    selected_calendar_id = cal_ids[cal_idx] if cal_ids else "primary"
+
+    # 前回取得分をキャッシュから即表示し、裏で最新の予定に更新する
+    event_cache = _get_event_cache()
+    events_meta = st.session_state.get("calendar_events_meta", {})
+    if event_cache is not None:
+        synced_at = event_cache.last_synced_at(selected_calendar_id)
+        if synced_at is not None and (
+            events_meta.get("calendar_id") != selected_calendar_id
+            or events_meta.get("synced_at", 0) < synced_at
+        ):
+            cached_events = event_cache.load_events(selected_calendar_id)
+            if cached_events is not None:
+                st.session_state["calendar_events"] = cached_events
+                events_meta = {"calendar_id": selected_calendar_id, "synced_at": synced_at, "from_cache": True}
+                st.session_state["calendar_events_meta"] = events_meta
+    # 事前生成ワーカー：定期的にカレンダーを同期し、一括生成・月全体の案内文を先に作っておく
+    pregen = None
+    if get_worker is not None:
+        pregen = get_worker(
+            credentials_account_key(creds_dict),
+            _make_fetch_fn(creds_dict),
+            [selected_calendar_id],
+            dict(_templates_snapshot().overrides),
+            event_cache=event_cache,
+            batch_fetch_fn=_make_batch_fetch_fn(creds_dict),
+        )
+    if events_meta.get("from_cache") and events_meta.get("calendar_id") == selected_calendar_id:
+        synced_str = time.strftime("%m/%d %H:%M", time.localtime(events_meta.get("synced_at", 0)))
+        st.caption(f"💾 保存済みの予定を表示しています（最終同期: {synced_str}）。最新の予定は裏で取得中です。")
+
+    ledger_scope = f"{credentials_account_key(creds_dict)}:{selected_calendar_id}"
+    if st.button("📅 予定を取得（1ヶ月分）"):
         try:
-            generator = AnnouncementGenerator(templates_override=st.session_state.get("custom_templates", {}))
-            is_valid, errors = generator.validate_event_data(event_data)
-            if not is_valid:
-                st.warning("入力情報に不備があります")
-                for err in errors:
-                    st.write(f"• {err}")
-            else:
-                announcement = generator.generate(event_data)
-                if announcement:
-                    st.success("告知文を生成しました！")
-                    st.text_area(
-                        "生成された告知文（コピーしてDiscordに貼り付けてください）",
-                        announcement,
-                        height=400,
-                        key="announcement_output",
+            if CALENDAR_EXPAND_RECURRING_LOCALLY:
+                # 繰り返しの元予定と例外がそろってから展開するので、ページごとには流さない
+                with st.spinner("1ヶ月分の予定を取得しています..."):
+                    events = fetch_upcoming_events(
+                        creds,
+                        calendar_id=selected_calendar_id,
+                        max_results=250,
+                        days_ahead=31,
+                        expand_recurring_locally=True,
                     )
-                    st.caption("💡 上のテキストを選択して Ctrl+C（Mac: Cmd+C）でコピーできます")
-                else:
-                    st.error("告知文の生成に失敗しました")
+                    if event_cache is not None:
+                        event_data_list = event_cache.convert_events(
+                            selected_calendar_id, events, parse_event_name, CALENDAR_EXCLUDE_TITLES
+                        )
+                    else:
+                        event_data_list = convert_api_events(events, parse_event_name, CALENDAR_EXCLUDE_TITLES)
+                    st.session_state["calendar_events"] = event_data_list
+                    st.session_state["calendar_events_meta"] = {
+                        "calendar_id": selected_calendar_id,
+                        "synced_at": time.time(),
+                        "from_cache": False,
+                    }
+            else:
+                _fetch_and_generate(creds, selected_calendar_id, event_cache)
         except Exception as e:
-            st.error(f"エラー: {e}")
-            import traceback
-            st.code(traceback.format_exc())
+            st.error(f"予定の取得に失敗しました: {e}")
+    api_stats = get_api_stats(credentials_account_key(creds_dict))
+    if api_stats["calls"]:
+        st.caption(
+            f"API呼び出し: {api_stats['calls']}回（再試行 {api_stats['retries']}回・失敗 {api_stats['failures']}回・"
+            f"消費クォータ {api_stats['quota_units']}）"
+        )
+
+    if "calendar_events" in st.session_state and st.session_state["calendar_events"]:
+        events_list = st.session_state["calendar_events"]
+        # 各部分はフラグメント。ボタンを押してもその部分だけが再実行される
+        _event_pick_section(events_list, st.session_state.get("calendar_events_meta", {}))
+        st.divider()
+        _calendar_bulk_section(events_list, pregen, selected_calendar_id, ledger_scope)
+        st.divider()
+        _overview_section(events_list, pregen, selected_calendar_id)
+
+
+def _handle_oauth_callback():
+    q = st.query_params
+    code = q.get("code")
+    if code and isinstance(code, list):
+        code = code[0]
+    if not code:
+        return
+    # 既に連携済みでURLにcodeだけ残っている場合：交換せずそのまま表示（rerunしない＝セッション維持）
+    if "google_credentials" in st.session_state:
+        return
+    redirect_uri = os.environ.get("REDIRECT_URI") or (
+        st.secrets.get("REDIRECT_URI") if hasattr(st, "secrets") else None
+    ) or "http://localhost:8501"
+    try:
+        creds = exchange_code_for_credentials(redirect_uri, code)
+    except Exception as e:
+        st.session_state["oauth_error"] = str(e)
+        return
+    if creds:
+        st.session_state["google_credentials"] = credentials_to_dict(creds)
+        st.session_state["oauth_just_completed"] = True
+        if "oauth_error" in st.session_state:
+            del st.session_state["oauth_error"]
+        # rerunしない＝このまま描画を続けて「連携済み」を表示（Streamlit Cloudでrerunするとセッションが消えて空白になるため）
+    else:
+        st.session_state["oauth_error"] = "トークンの取得に失敗しました。もう一度「Googleカレンダーと連携する」からやり直してください。"
+
+if GOOGLE_API_AVAILABLE:
+    _handle_oauth_callback()
+
+tab_names = ["🔗 Googleカレンダーと連携", "✏️ 手動入力", "📝 テンプレート管理"]
+if not GOOGLE_API_AVAILABLE:
+    tab_names = ["✏️ 手動入力", "📝 テンプレート管理"]
+
+tabs = st.tabs(tab_names)
+tab_idx = 0
+
+if GOOGLE_API_AVAILABLE:
+    with tabs[tab_idx]:
+        redirect_uri = os.environ.get("REDIRECT_URI") or (
+            st.secrets.get("REDIRECT_URI") if hasattr(st, "secrets") else None
+        ) or "http://localhost:8501"
+        auth_url = get_authorization_url(redirect_uri)
+
+        if "oauth_error" in st.session_state:
+            st.error(st.session_state["oauth_error"])
+            if st.button("エラーを消す"):
+                del st.session_state["oauth_error"]
+                st.rerun()
+        if "google_credentials" not in st.session_state:
+            st.markdown("**Googleカレンダーと連携して、予定を自動で取り込みます**")
+            if auth_url:
+                # 同じタブで開く（許可後にこのタブに戻り、連携済みが表示されるようにする）
+                st.markdown(
+                    f'<a href="{auth_url}" style="display:inline-block;padding:0.5rem 1rem;'
+                    'background:#FF4B4B;color:white;text-decoration:none;border-radius:0.5rem;font-weight:500;">'
+                    '🔗 Googleカレンダーと連携する</a>',
+                    unsafe_allow_html=True,
+                )
+                st.caption("クリックしてGoogleでログインし、許可するとこのページに戻り「連携済み」と表示されます。")
+            else:
+                st.info("Google連携を使うには、管理者がGoogle CloudでOAuth設定を行う必要があります。")
+        else:
+            creds_dict = st.session_state["google_credentials"]
+            token_manager = get_token_manager()
+            try:
+                creds = token_manager.get(creds_dict)
+            except TokenRefreshError as e:
+                st.error(f"{e}　「連携を解除」してから、もう一度連携してください。")
+                creds = None
+            else:
+                if creds is None:
+                    del st.session_state["google_credentials"]
+                    st.rerun()
+                _sync_credentials_to_session(creds_dict)
+                refresh_error = token_manager.last_error(creds_dict)
+                if refresh_error:
+                    st.warning(refresh_error)
+
+            if creds is not None:
+                if st.session_state.get("oauth_just_completed"):
+                    st.success("✅ 連携が完了しました！「予定を取得」でカレンダーから予定を取り込めます。")
+                    st.session_state["oauth_just_completed"] = False
+                else:
+                    st.success("Googleカレンダーと連携済みです")
+            if st.button("🔓 連携を解除"):
+                if get_worker is not None:
+                    stop_worker(credentials_account_key(creds_dict))
+                token_manager.forget(creds_dict)
+                del st.session_state["google_credentials"]
+                if "calendar_events" in st.session_state:
+                    del st.session_state["calendar_events"]
+                if "calendar_list" in st.session_state:
+                    del st.session_state["calendar_list"]
+                st.session_state.pop("calendar_events_meta", None)
+                st.session_state.pop("calendar_fetched_rows", None)
+                st.session_state.pop("calendar_events_index", None)
+                st.rerun()
+
+            # トークンが使えないときは、再連携するまでカレンダーの取得・事前生成を始めない
+            if creds is not None:
+                _linked_calendar_section(creds, creds_dict)
+    tab_idx += 1
+
+with tabs[tab_idx]:
+    _manual_entry_section()
+    with st.expander("📋 複数の予定をまとめて貼り付けて一括生成"):
+        _paste_bulk_section()
+    with st.expander("📂 iCalendarファイル（.ics）から一括生成"):
+        _ics_bulk_section()
+
+tab_idx += 1
+with tabs[tab_idx]:
+    _template_management_section()
 
 st.divider()
 st.markdown("""
@@ -499,6 +959,7 @@ st.markdown("""
 - 生徒対談（事前告知 / 間もなく開始）
 - 講師対談（事前告知 / 間もなく開始）
 - オン会（事前告知 / 間もなく開始）
+- 特別講義（事前告知 / 間もなく開始）
 - 月全体の案内文（Googleカレンダー連携タブで「月全体の案内文を生成」）
-- **テンプレート管理**タブで特別講義など新しい種別を追加できます
+- **テンプレート管理**タブで新しい種別を追加できます（タイトルの判定・チャンネル・必須項目は templates/event_types.json に追加）
 """)
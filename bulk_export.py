@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+1ヶ月分の告知文を一括生成してスプレッドシート用の行にするモジュール
+
+1件の予定につき「事前告知」と「間もなく開始」の2行を出力します。
+A=メッセージ, B=日付(投稿日), C=時間(投稿時間), D=チャンネル名
+差分出力では、前回出力した内容（ExportLedger）と比べて追加・変更・取消の行だけを出し、E列に変更の種類を入れます。
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Iterable, Tuple
+
+import config
+from event_registry import get_registry
+
+# CSVの列（A〜D）
+BULK_CSV_HEADER = ["メッセージ", "日付", "時間", "チャンネル名"]
+
+# 差分出力の列（E=変更の種類）
+CHANGE_COLUMN = "変更"
+DELTA_CSV_HEADER = BULK_CSV_HEADER + [CHANGE_COLUMN]
+CHANGE_ADDED = "追加"
+CHANGE_UPDATED = "変更"
+CHANGE_CANCELLED = "取消"
+CANCELLED_MESSAGE = "(予定がなくなったため取消)"
+
+# event_data の内部用キー（生成前に取り除く）
+INTERNAL_KEYS = ("_id", "_raw_summary", "_raw_description")
+
+SKIPPED_MESSAGE = "(テンプレートに合わないためスキップ)"
+
+
+def get_channel_name(event_type: str) -> str:
+    """イベント種別からチャンネル名を返す（templates/event_types.json の channel）"""
+    return get_registry().channel(event_type or "")
+
+
+def get_post_date_time(event_type: str, event_date: str, event_time: str):
+    """
+    事前告知＝前日18:00固定、まもなく開始＝当日開始5分前 を返す。
+    戻り値: (日付文字列 "M/D", 時間文字列 "HH:MM")
+    """
+    year = datetime.now().year
+    post_date_str, post_time_str = str(event_date), str(event_time)
+    try:
+        parts = str(event_date).strip().split("/")
+        if len(parts) >= 2:
+            m, d = int(parts[0]), int(parts[1])
+        else:
+            return (event_date, "18:00" if "事前告知" in str(event_type) else event_time)
+        if "事前告知" in str(event_type):
+            event_dt = datetime(year, m, d)
+            prev = event_dt - timedelta(days=1)
+            post_date_str = f"{prev.month}/{prev.day}"
+            post_time_str = "18:00"
+        elif "間もなく開始" in str(event_type) or "まもなく" in str(event_type):
+            post_date_str = f"{m}/{d}"
+            t = str(event_time).strip()
+            if ":" in t:
+                parts_t = t.split(":")
+                h = int(parts_t[0])
+                mi = int(parts_t[1]) if len(parts_t) > 1 else 0
+                t_dt = datetime(year, m, d, h, mi) - timedelta(minutes=5)
+                post_time_str = f"{t_dt.hour:02d}:{t_dt.minute:02d}"
+            else:
+                post_time_str = t
+        else:
+            post_date_str = f"{m}/{d}"
+            post_time_str = "18:00" if "事前告知" in str(event_type) else str(event_time)
+    except Exception:
+        post_date_str = event_date
+        post_time_str = "18:00" if "事前告知" in str(event_type) else event_time
+    return (post_date_str, post_time_str)
+
+
+def strip_internal_keys(event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """内部用キーを除いたコピーを返す"""
+    ev = event_data.copy()
+    for k in INTERNAL_KEYS:
+        ev.pop(k, None)
+    return ev
+
+
+def _variant_of(event_type: str) -> str:
+    return get_registry().variant_of(event_type) or "その他"
+
+
+def expand_variants(event_data: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    1件の予定を (variant, 行用event_data) に展開する。
+    事前告知の予定は「間もなく開始」の行も作る（全角括弧で統一）。
+    """
+    ev_copy = strip_internal_keys(event_data)
+    event_type = ev_copy.get("event_type", "")
+    variants = [(_variant_of(event_type), ev_copy)]
+    for variant, follow_up_type in get_registry().follow_up_types(event_type):
+        ev_row = ev_copy.copy()
+        ev_row["event_type"] = follow_up_type
+        variants.append((variant, ev_row))
+    return variants
+
+
+def event_key(event_data: Dict[str, Any]) -> str:
+    """
+    予定の識別子。予定ID（_id）があればそれを使う。
+    予定IDのない予定（貼り付け・.ics など）は、予定そのものの日付・開始時刻と、予定名から読んだ種別・講師名・ジャンルで作る。
+    投稿日時（前日18:00 など）にずらす前の値なので、同じ枠に投稿する別の予定とは重ならない。
+    """
+    if event_data.get("_id"):
+        return str(event_data["_id"])
+    return " ".join(
+        str(event_data.get(k, "")).strip() for k in ("date", "time", "event_type", "teacher_name", "genre")
+    ).strip()
+
+
+def event_keys(events: Iterable[Dict[str, Any]]) -> List[str]:
+    """予定ごとの event_key。同じ識別子の予定が2件以上あれば、2件目から「#2」「#3」…を付けて区別する"""
+    keys, seen = [], {}
+    for ed in events:
+        key = event_key(ed)
+        seen[key] = seen.get(key, 0) + 1
+        keys.append(key if seen[key] == 1 else f"{key} #{seen[key]}")
+    return keys
+
+
+def row_key(row: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    一括生成の行の (予定の識別子, 段階)。
+    識別子のない行（ダウンロードしたCSVなど、投稿日時しか分からない行）は、別の予定と見分けられないので ValueError。
+    """
+    event_id = row.get("_id", "")
+    if not event_id:
+        raise ValueError(
+            f"予定IDのない行は予定を見分けられません（{row.get('日付', '')} {row.get('時間', '')} {row.get('チャンネル名', '')}）"
+        )
+    return str(event_id), str(row.get("_variant", ""))
+
+
+def build_bulk_row(generator, ev_row: Dict[str, Any], is_valid: bool = None) -> Dict[str, str]:
+    """
+    1行分（メッセージ・投稿日・投稿時間・チャンネル名）を生成する。
+    is_valid を渡した場合は入力チェックを省略する（まとめてチェック済みのとき）。
+    """
+    row_type = ev_row.get("event_type", "")
+    post_date, post_time = get_post_date_time(row_type, ev_row.get("date", ""), ev_row.get("time", ""))
+    if is_valid is None:
+        is_valid = generator.validate_event_data(ev_row)[0]
+    if is_valid:
+        ann = generator.generate(ev_row) or ""
+        return {
+            "メッセージ": ann.replace("\r", "\n"),
+            "日付": post_date,
+            "時間": post_time,
+            "チャンネル名": get_channel_name(row_type),
+        }
+    return {
+        "メッセージ": SKIPPED_MESSAGE,
+        "日付": post_date,
+        "時間": "",
+        "チャンネル名": "",
+    }
+
+
+def build_bulk_rows(events: Iterable[Dict[str, Any]], generator) -> List[Dict[str, str]]:
+    """
+    予定一覧から一括生成の行を作る。
+    各行には内部用に _id（予定の識別子。event_keys を参照）と _variant（事前告知/間もなく開始）を付ける。
+    """
+    events = list(events)
+    expanded = [
+        (key, variant, ev_row)
+        for ed, key in zip(events, event_keys(events))
+        for variant, ev_row in expand_variants(ed)
+    ]
+    # 入力チェックは全行まとめて（種別ごとの必須項目表で）行う
+    valid, _ = generator.validate_many([ev_row for _, _, ev_row in expanded])
+    rows = []
+    for (event_id, variant, ev_row), is_valid in zip(expanded, valid):
+        row = build_bulk_row(generator, ev_row, is_valid)
+        row["_id"] = event_id
+        row["_variant"] = variant
+        rows.append(row)
+    return rows
+
+
+def _hash_json(obj: Any) -> str:
+    payload = json.dumps(obj, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def row_fingerprint(row: Dict[str, Any]) -> str:
+    """出力した内容（メッセージ・投稿日時・チャンネル）の指紋"""
+    return _hash_json([row.get(col, "") for col in BULK_CSV_HEADER])
+
+
+def input_fingerprint(generator, ev_row: Dict[str, Any]) -> str:
+    """生成に使う入力（予定の内容・その種別のテンプレート・固定Zoom情報）の指紋。同じなら出力も同じ"""
+    row_type = ev_row.get("event_type", "").strip()
+    return _hash_json([
+        ev_row,
+        generator.template_version(row_type),
+        config.FIXED_ZOOM_INFO.get(row_type),
+    ])
+
+
+def _cancelled_rows(previous: Dict[Tuple[str, str], tuple], seen: set) -> List[Dict[str, Any]]:
+    rows = []
+    for (event_id, variant), entry in previous.items():
+        if (event_id, variant) in seen:
+            continue
+        _, _, post_date, post_time, channel = entry
+        rows.append({
+            "メッセージ": CANCELLED_MESSAGE,
+            "日付": post_date,
+            "時間": post_time,
+            "チャンネル名": channel,
+            CHANGE_COLUMN: CHANGE_CANCELLED,
+            "_id": event_id,
+            "_variant": variant,
+        })
+    return rows
+
+
+def build_delta_rows(
+    events: Iterable[Dict[str, Any]],
+    generator,
+    previous: Dict[Tuple[str, str], tuple],
+) -> List[Dict[str, Any]]:
+    """
+    前回出力した内容（ExportLedger.entries の戻り値）と比べ、追加・変更・取消の行だけを返す。
+    入力の指紋が前回と同じ行は生成しない。生成しても出力が前回と同じ行は出さない。
+    各行には E列（変更の種類）と内部用の _id・_variant・_input_fp を付ける。
+    """
+    expanded = []
+    seen = set()
+    events = list(events)
+    for ed, event_id in zip(events, event_keys(events)):
+        for variant, ev_row in expand_variants(ed):
+            key = (event_id, variant)
+            seen.add(key)
+            fp = input_fingerprint(generator, ev_row)
+            prev = previous.get(key)
+            if prev is not None and prev[0] == fp:
+                continue
+            expanded.append((key, fp, ev_row))
+    valid, _ = generator.validate_many([ev_row for _, _, ev_row in expanded])
+    rows = []
+    for (key, fp, ev_row), is_valid in zip(expanded, valid):
+        row = build_bulk_row(generator, ev_row, is_valid)
+        row["_id"], row["_variant"] = key
+        row["_input_fp"] = fp
+        prev = previous.get(key)
+        if prev is not None and prev[1] == row_fingerprint(row):
+            # 出力は同じ（入力の指紋だけ変わった）。記録の更新用に残し、出力からは外す
+            row[CHANGE_COLUMN] = ""
+        else:
+            row[CHANGE_COLUMN] = CHANGE_ADDED if prev is None else CHANGE_UPDATED
+        rows.append(row)
+    return rows + _cancelled_rows(previous, seen)
+
+
+def diff_rows(rows: List[Dict[str, Any]], previous: Dict[Tuple[str, str], tuple]) -> List[Dict[str, Any]]:
+    """生成済みの行（事前生成の結果など）を前回出力した内容と比べ、追加・変更・取消の行だけを返す"""
+    out = []
+    seen = set()
+    for row in rows:
+        key = (row.get("_id", ""), row.get("_variant", ""))
+        seen.add(key)
+        prev = previous.get(key)
+        if prev is not None and prev[1] == row_fingerprint(row):
+            continue
+        out.append({**row, CHANGE_COLUMN: CHANGE_ADDED if prev is None else CHANGE_UPDATED})
+    return out + _cancelled_rows(previous, seen)
+
+
+def changed_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """差分の行のうち、実際に出力するもの（変更の種類があるもの）"""
+    return [r for r in rows if r.get(CHANGE_COLUMN)]
+
+
+_LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exported_rows (
+    scope TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    input_fp TEXT,
+    output_fp TEXT NOT NULL,
+    post_date TEXT NOT NULL,
+    post_time TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    exported_at REAL NOT NULL,
+    PRIMARY KEY (scope, event_id, variant)
+);
+"""
+
+
+class ExportLedger:
+    """
+    前回出力した行の記録（SQLite）。scope（連携アカウント・カレンダーなど）ごとに、
+    (予定ID, variant) -> (入力の指紋, 出力の指紋, 投稿日, 投稿時間, チャンネル名) を持つ。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or config.EXPORT_LEDGER_PATH
+        self._write_lock = threading.Lock()
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_LEDGER_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def entries(self, scope: str) -> Dict[Tuple[str, str], tuple]:
+        with self._connect() as conn:
+            return {
+                (event_id, variant): (input_fp, output_fp, post_date, post_time, channel)
+                for event_id, variant, input_fp, output_fp, post_date, post_time, channel in conn.execute(
+                    "SELECT event_id, variant, input_fp, output_fp, post_date, post_time, channel "
+                    "FROM exported_rows WHERE scope = ?",
+                    (scope,),
+                )
+            }
+
+    def replace(self, scope: str, rows: List[Dict[str, Any]]) -> None:
+        """全件出力したときに呼ぶ。scope の記録を rows で置き換える"""
+        with self._write_lock, self._connect() as conn:
+            conn.execute("DELETE FROM exported_rows WHERE scope = ?", (scope,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO exported_rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._record(scope, r) for r in rows],
+            )
+
+    def apply(self, scope: str, delta: List[Dict[str, Any]]) -> None:
+        """差分を出力したときに呼ぶ。追加・変更（と出力が同じだった行）を記録し、取消の行を消す"""
+        with self._write_lock, self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM exported_rows WHERE scope = ? AND event_id = ? AND variant = ?",
+                [(scope, r.get("_id", ""), r.get("_variant", "")) for r in delta
+                 if r.get(CHANGE_COLUMN) == CHANGE_CANCELLED],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO exported_rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._record(scope, r) for r in delta if r.get(CHANGE_COLUMN) != CHANGE_CANCELLED],
+            )
+
+    def clear(self, scope: str = None) -> None:
+        with self._write_lock, self._connect() as conn:
+            if scope is None:
+                conn.execute("DELETE FROM exported_rows")
+            else:
+                conn.execute("DELETE FROM exported_rows WHERE scope = ?", (scope,))
+
+    @staticmethod
+    def _record(scope: str, row: Dict[str, Any]) -> tuple:
+        return (
+            scope, row.get("_id", ""), row.get("_variant", ""), row.get("_input_fp"),
+            row_fingerprint(row), row.get("日付", ""), row.get("時間", ""), row.get("チャンネル名", ""),
+            time.time(),
+        )
+
+
+def preview_message(message: str, limit: int = 60) -> str:
+    """一覧表示用に、改行を詰めて先頭 limit 文字だけにしたメッセージ"""
+    text = " ".join(line.strip() for line in str(message).splitlines() if line.strip())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def filter_row_indices(rows: List[Dict[str, Any]], channel: str = None, post_date: str = None) -> List[int]:
+    """チャンネル名・投稿日で絞り込んだ行の番号（None は絞り込まない）"""
+    return [
+        i for i, r in enumerate(rows)
+        if (channel is None or r.get("チャンネル名", "") == channel)
+        and (post_date is None or r.get("日付", "") == post_date)
+    ]
+
+
+def paginate(items: List[Any], page: int, page_size: int) -> Tuple[List[Any], int, int]:
+    """page（1始まり）のページ分を返す。戻り値: (ページの要素, 範囲内に直したページ番号, ページ数)"""
+    page_size = max(1, page_size)
+    page_count = max(1, -(-len(items) // page_size))
+    page = min(max(1, page), page_count)
+    start = (page - 1) * page_size
+    return items[start:start + page_size], page, page_count
+
+
+def preview_table(
+    rows: List[Dict[str, Any]],
+    indices: List[int],
+    header: List[str] = None,
+    limit: int = 60,
+) -> List[Dict[str, Any]]:
+    """指定した行だけを、番号付き・メッセージを短くした表示用の行にする"""
+    header = header or BULK_CSV_HEADER
+    out = []
+    for i in indices:
+        r = rows[i]
+        item = {"No.": i + 1}
+        for col in header:
+            value = r.get(col, "")
+            item[col] = preview_message(value, limit) if col == "メッセージ" else value
+        out.append(item)
+    return out
+
+
+def visible_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """表示・出力用に内部用キーを除いた行を返す"""
+    return [{k: v for k, v in r.items() if not k.startswith("_")} for r in rows]
+
+
+def rows_to_csv(rows: List[Dict[str, Any]], header: List[str] = None) -> str:
+    """行をCSV文字列にする（列は BULK_CSV_HEADER の順）"""
+    header = header or BULK_CSV_HEADER
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(header)
+    for r in rows:
+        w.writerow([r.get(col, "") for col in header])
+    return buf.getvalue()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+GoogleカレンダーAPI呼び出しの実行レイヤー
+
+- 429 / 403 rateLimitExceeded / 5xx・通信エラーは指数バックオフ（ジッター付き）で再試行
+- アカウントごとのトークンバケットで呼び出し回数を平準化（複数オペレーターが同じプロジェクトを使っても上限を超えない）
+- 失敗が続いたアカウントはサーキットブレーカーで一定時間呼び出しを止める
+- 呼び出し回数・再試行・失敗・レイテンシ・消費クォータを記録
+- HTTPバッチ（複数の呼び出しを1往復にまとめる）は呼び出しごとに結果・エラーを振り分け、失敗した分だけ再送
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import config
+
+try:
+    from googleapiclient.errors import HttpError
+except ImportError:
+    class HttpError(Exception):
+        """googleapiclient がない環境用のダミー"""
+
+
+# 再試行するHTTPステータス
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# 403 のうち再試行する理由（短時間の呼び出し過多）
+RETRYABLE_403_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class CalendarApiError(Exception):
+    """カレンダーAPIの呼び出しに失敗した（再試行しても回復しなかった）"""
+
+
+class CircuitOpenError(CalendarApiError):
+    """失敗が続いたため、このアカウントからの呼び出しを一時停止している"""
+
+
+class RequestBudgetExceeded(CalendarApiError):
+    """呼び出し枠（トークンバケット）が空き、待ち時間の上限を超えた"""
+
+
+class TokenBucket:
+    """rate_per_sec で補充される容量 capacity のトークンバケット"""
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0, max_wait: float = None) -> bool:
+        """
+        トークンを取得する。足りなければ補充を待ち、max_wait を超えるなら False。
+        容量を超える cost（大きなバッチ）は満タンになった時点で取得し、超過分は後の呼び出しが待つ。
+        """
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        need = min(cost, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= need:
+                    self._tokens -= cost
+                    return True
+                wait = (need - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """連続 failure_threshold 回の失敗で開き、reset_timeout 秒後に1回だけ試す（半開）"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # 半開：次の1回で成功すれば閉じ、失敗すればまた開く
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+
+class RequestStats:
+    """アカウントごとの呼び出し統計"""
+
+    def __init__(self, latency_window: int = 500):
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.quota_units = 0
+        self.latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float = None, retried: bool = False, failed: bool = False, cost: int = 0) -> None:
+        with self._lock:
+            if latency is not None:
+                self.calls += 1
+                self.latencies.append(latency)
+            if retried:
+                self.retries += 1
+            if failed:
+                self.failures += 1
+            self.quota_units += cost
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self.latencies)
+        p = (lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] if lat else None)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "quota_units": self.quota_units,
+            "latency_p50": p(0.5),
+            "latency_p95": p(0.95),
+        }
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_stats: Dict[str, RequestStats] = {}
+_registry_lock = threading.Lock()
+
+
+def _for_account(account_key: str):
+    with _registry_lock:
+        if account_key not in _buckets:
+            _buckets[account_key] = TokenBucket(config.CALENDAR_API_RATE_PER_SEC, config.CALENDAR_API_BURST)
+            _breakers[account_key] = CircuitBreaker(
+                config.CALENDAR_API_CIRCUIT_THRESHOLD, config.CALENDAR_API_CIRCUIT_RESET_SEC
+            )
+            _stats[account_key] = RequestStats()
+        return _buckets[account_key], _breakers[account_key], _stats[account_key]
+
+
+def _error_reason(error: Exception) -> str:
+    """HttpError の本文から error.errors[0].reason を取り出す"""
+    content = getattr(error, "content", b"") or b""
+    try:
+        body = json.loads(content.decode("utf-8") if isinstance(content, bytes) else content)
+        errors = body.get("error", {}).get("errors", [])
+        if errors:
+            return errors[0].get("reason", "")
+    except (ValueError, AttributeError):
+        pass
+    return ""
+
+
+def is_retryable(error: Exception) -> bool:
+    """再試行してよいエラーか"""
+    if isinstance(error, HttpError):
+        status = getattr(getattr(error, "resp", None), "status", None)
+        try:
+            status = int(status)
+        except (TypeError, ValueError):
+            return False
+        if status in RETRYABLE_STATUSES:
+            return True
+        return status == 403 and _error_reason(error) in RETRYABLE_403_REASONS
+    return isinstance(error, (socket.timeout, ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt: int) -> float:
+    """attempt 回目（0始まり）の再試行までの待ち時間（フルジッター付き指数バックオフ）"""
+    ceiling = min(config.CALENDAR_API_BACKOFF_MAX_SEC, config.CALENDAR_API_BACKOFF_BASE_SEC * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def execute(request, account_key: str = "default", cost: int = 1):
+    """
+    googleapiclient の HttpRequest を実行する（再試行・呼び出し枠・サーキットブレーカー付き）。
+    再試行しても失敗した場合、HttpError はそのまま、通信エラーは CalendarApiError として送出する。
+    """
+    bucket, breaker, stats = _for_account(account_key)
+    if not breaker.allow():
+        raise CircuitOpenError("GoogleカレンダーAPIへの呼び出しに失敗が続いたため、しばらく停止しています。少し待ってからやり直してください。")
+    max_retries = config.CALENDAR_API_MAX_RETRIES
+    for attempt in range(max_retries + 1):
+        if not bucket.acquire(cost, max_wait=config.CALENDAR_API_MAX_WAIT_SEC):
+            raise RequestBudgetExceeded("GoogleカレンダーAPIの呼び出しが混み合っています。少し待ってからやり直してください。")
+        started = time.monotonic()
+        try:
+            # num_retries は使わず、ここで再試行を管理する
+            response = request.execute()
+        except Exception as e:
+            stats.record(latency=time.monotonic() - started, cost=cost)
+            if is_retryable(e) and attempt < max_retries:
+                stats.record(retried=True)
+                time.sleep(backoff_delay(attempt))
+                continue
+            stats.record(failed=True)
+            if is_retryable(e):
+                breaker.record_failure()
+            if isinstance(e, HttpError):
+                raise
+            if is_retryable(e):
+                raise CalendarApiError(f"GoogleカレンダーAPIに接続できませんでした: {e}") from e
+            raise
+        stats.record(latency=time.monotonic() - started, cost=cost)
+        breaker.record_success()
+        return response
+
+
+def execute_batch(
+    new_batch: Callable[[], Any],
+    requests: Dict[str, Any],
+    account_key: str = "default",
+    max_calls: int = None,
+) -> Dict[str, Tuple[Any, Optional[Exception]]]:
+    """
+    複数の HttpRequest を HTTPバッチで実行し、{キー: (レスポンス, エラー)} を返す。
+    new_batch() は空の BatchHttpRequest を作る関数。max_calls 件ごとに1往復にまとめる。
+    バッチ全体の失敗（通信エラー・認証エラーなど）は execute() と同じく再試行・送出し、
+    個々の呼び出しの 429 / 5xx は、その呼び出しだけを次のバッチで再送する。
+    """
+    _, _, stats = _for_account(account_key)
+    max_calls = max_calls or config.CALENDAR_API_BATCH_MAX_CALLS
+    max_retries = config.CALENDAR_API_MAX_RETRIES
+    results: Dict[str, Tuple[Any, Optional[Exception]]] = {}
+    pending = dict(requests)
+    for attempt in range(max_retries + 1):
+        retry: Dict[str, Any] = {}
+
+        def callback(request_id, response, exception, _attempt=attempt, _pending=pending, _retry=retry):
+            if exception is not None and is_retryable(exception) and _attempt < max_retries:
+                _retry[request_id] = _pending[request_id]
+                stats.record(retried=True)
+                return
+            if exception is not None:
+                stats.record(failed=True)
+            results[request_id] = (response, exception)
+
+        keys = list(pending)
+        for i in range(0, len(keys), max_calls):
+            chunk = keys[i:i + max_calls]
+            batch = new_batch()
+            for key in chunk:
+                batch.add(pending[key], callback=callback, request_id=key)
+            # クォータは中の呼び出し1件ごとに消費される
+            execute(batch, account_key, cost=len(chunk))
+        if not retry:
+            break
+        time.sleep(backoff_delay(attempt))
+        pending = retry
+    return results
+
+
+def get_stats(account_key: str = None) -> Dict[str, Any]:
+    """呼び出し統計。account_key を省略すると全アカウント分"""
+    with _registry_lock:
+        items = dict(_stats)
+    if account_key is not None:
+        s = items.get(account_key)
+        return s.snapshot() if s else RequestStats().snapshot()
+    return {k: s.snapshot() for k, s in items.items()}
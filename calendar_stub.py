@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+GoogleカレンダーAPI（v3）のローカルスタブ
+
+本物のAPIに接続せずに、予定取得・HTTPバッチ・再試行の動作を確認するためのHTTPサーバーです。
+次の呼び出しに応答します（認証ヘッダーは確認しません）。
+
+- GET  /calendar/v3/users/me/calendarList
+- GET  /calendar/v3/calendars/{calendarId}/events（timeMin / timeMax / maxResults / pageToken）
+- GET  /calendar/v3/calendars/{calendarId}/events/{eventId}/instances
+- POST /batch/calendar/v3（multipart/mixed のHTTPバッチ。中の呼び出しごとに上のいずれかとして処理）
+
+使い方:
+    python calendar_stub.py --port 8765
+    CALENDAR_API_ROOT_URL=http://127.0.0.1:8765/ streamlit run app.py
+
+fail_every=N を指定すると N 回に1回 429 rateLimitExceeded を返します（バッチ内の呼び出しも1回と数える）。
+"""
+
+import argparse
+import gzip
+import json
+import re
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+_CALENDAR_LIST_PATH = "/calendar/v3/users/me/calendarList"
+_EVENTS_RE = re.compile(r"^/calendar/v3/calendars/([^/]+)/events$")
+_INSTANCES_RE = re.compile(r"^/calendar/v3/calendars/([^/]+)/events/([^/]+)/instances$")
+_BATCH_PATH = "/batch/calendar/v3"
+
+_REASONS = {400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+# サンプル予定のタイトル（parse_event_name が解釈できる形式）
+_SAMPLE_TITLES = (
+    "【ジャンル特化グルコン】カナノ⌇埼玉グルメ＆カフェ（スポット）",
+    "【講師対談】はるパパ⌇親子で楽しむ0歳カラダあそび",
+    "【生徒対談】ぽぽ⌇看護師・発酵料理士アドバイザー",
+    "【オン会】（美容）",
+    "【万垢生限定オン会】",
+    "週報提出",
+)
+
+
+def sample_events(days: int = 31, per_day: int = 2, start: datetime = None) -> List[Dict]:
+    """今日から days 日分、1日 per_day 件のサンプル予定（events.list の items 形式）"""
+    tz = timezone(timedelta(hours=9))
+    base = (start or datetime.now(tz)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if base.tzinfo is None:
+        base = base.replace(tzinfo=tz)
+    items = []
+    n = 0
+    for day in range(days):
+        for slot in range(per_day):
+            title = _SAMPLE_TITLES[n % len(_SAMPLE_TITLES)]
+            at = base + timedelta(days=day, hours=20 + slot)
+            items.append({
+                "id": f"stub{n:05d}",
+                "etag": f'"{n}-1"',
+                "summary": title,
+                "description": f"Instagram https://www.instagram.com/stub_user_{n % 7}/",
+                "start": {"dateTime": at.isoformat(), "timeZone": "Asia/Tokyo"},
+            })
+            n += 1
+    return items
+
+
+def _parse_time(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _event_start(event: Dict) -> Optional[datetime]:
+    start = event.get("start", {})
+    if "dateTime" in start:
+        return _parse_time(start["dateTime"])
+    if "date" in start:
+        return datetime.strptime(start["date"], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return None
+
+
+class CalendarStub:
+    """予定データと呼び出し回数を持つスタブ本体（HTTPサーバーとは独立して呼び出せる）"""
+
+    def __init__(self, calendars: Dict[str, Dict] = None, fail_every: int = 0):
+        # {calendarId: {"summary": 表示名, "items": [予定]}}
+        self.calendars = calendars if calendars is not None else {
+            "primary": {"summary": "メイン", "items": sample_events()},
+        }
+        self.fail_every = fail_every
+        self._lock = threading.Lock()
+        self.stats = {"http_requests": 0, "batch_requests": 0, "calls": 0, "failures": 0}
+
+    @classmethod
+    def from_fixture(cls, path: str, fail_every: int = 0) -> "CalendarStub":
+        """{"calendarId": {"summary": ..., "items": [...]}} 形式のJSONから作る"""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), fail_every=fail_every)
+
+    def handle(self, method: str, target: str) -> Tuple[int, Dict]:
+        """1件の呼び出しを処理して (ステータス, 本文) を返す"""
+        with self._lock:
+            self.stats["calls"] += 1
+            injected = self.fail_every and self.stats["calls"] % self.fail_every == 0
+            if injected:
+                self.stats["failures"] += 1
+        if injected:
+            return 429, _error_body(429, "rateLimitExceeded", "Rate Limit Exceeded")
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = url.path
+        if method != "GET":
+            return 400, _error_body(400, "badRequest", f"unsupported method {method}")
+        if path == _CALENDAR_LIST_PATH:
+            items = [{"id": cid, "summary": cal.get("summary", cid)} for cid, cal in self.calendars.items()]
+            return 200, {"kind": "calendar#calendarList", "items": items}
+        m = _EVENTS_RE.match(path)
+        if m:
+            return self._list_events(unquote(m.group(1)), query)
+        m = _INSTANCES_RE.match(path)
+        if m:
+            return self._list_events(unquote(m.group(1)), query, recurring_id=unquote(m.group(2)))
+        return 404, _error_body(404, "notFound", "Not Found")
+
+    def _list_events(self, calendar_id: str, query: Dict[str, str], recurring_id: str = None) -> Tuple[int, Dict]:
+        cal = self.calendars.get(calendar_id)
+        if cal is None:
+            return 404, _error_body(404, "notFound", "Not Found")
+        time_min = _parse_time(query.get("timeMin", ""))
+        time_max = _parse_time(query.get("timeMax", ""))
+        items = []
+        for ev in cal.get("items", []):
+            if recurring_id is not None and ev.get("recurringEventId") != recurring_id:
+                continue
+            start = _event_start(ev)
+            if start is not None and time_min is not None and start < time_min:
+                continue
+            if start is not None and time_max is not None and start >= time_max:
+                continue
+            items.append(ev)
+        if query.get("orderBy") == "startTime":
+            items.sort(key=lambda ev: _event_start(ev) or datetime.max.replace(tzinfo=timezone.utc))
+        offset = int(query.get("pageToken") or 0)
+        limit = max(1, min(int(query.get("maxResults") or 250), 2500))
+        body = {"kind": "calendar#events", "items": items[offset:offset + limit]}
+        if offset + limit < len(items):
+            body["nextPageToken"] = str(offset + limit)
+        return 200, body
+
+    def handle_batch(self, content_type: str, payload: bytes) -> Tuple[str, bytes]:
+        """multipart/mixed のバッチを処理し、(Content-Type, 本文) を返す"""
+        with self._lock:
+            self.stats["batch_requests"] += 1
+        m = re.search(r'boundary="?([^";]+)"?', content_type or "")
+        if not m:
+            raise ValueError("boundary がありません")
+        boundary = m.group(1)
+        out_boundary = "batch_" + uuid.uuid4().hex
+        parts = []
+        for part in _split_multipart(payload, boundary):
+            headers, body = _split_head(part)
+            content_id = headers.get("content-id", "")
+            request_line = body.split(b"\r\n", 1)[0].decode("utf-8") if b"\r\n" in body else body.decode("utf-8")
+            method, target = request_line.split(" ")[:2]
+            status, result = self.handle(method, target)
+            response_id = content_id
+            if content_id.startswith("<") and content_id.endswith(">"):
+                response_id = f"<response-{content_id[1:-1]}>"
+            inner = json.dumps(result, ensure_ascii=False).encode("utf-8")
+            parts.append(
+                f"--{out_boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: {response_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(inner)}\r\n\r\n".encode("utf-8") + inner + b"\r\n"
+            )
+        body = b"".join(parts) + f"--{out_boundary}--\r\n".encode("utf-8")
+        return f"multipart/mixed; boundary={out_boundary}", body
+
+
+def _error_body(status: int, reason: str, message: str) -> Dict:
+    return {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+
+
+def _split_multipart(payload: bytes, boundary: str) -> List[bytes]:
+    """multipart 本文を各パート（ヘッダー＋本文）に分ける"""
+    delimiter = b"--" + boundary.encode("utf-8")
+    parts = []
+    for chunk in payload.split(delimiter)[1:]:
+        if chunk.startswith(b"--"):
+            break
+        parts.append(chunk.strip(b"\r\n"))
+    return parts
+
+
+def _split_head(data: bytes) -> Tuple[Dict[str, str], bytes]:
+    data = data.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+    head, _, body = data.partition(b"\r\n\r\n")
+    headers = {}
+    for line in head.decode("utf-8").split("\r\n"):
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    return headers, body
+
+
+def _make_handler(stub: CalendarStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):  # noqa: A002 - 基底クラスの引数名に合わせる
+            pass
+
+        def _send(self, status: int, content_type: str, body: bytes) -> None:
+            if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                body = gzip.compress(body)
+                encoding = "gzip"
+            else:
+                encoding = None
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with stub._lock:
+                stub.stats["http_requests"] += 1
+            status, result = stub.handle("GET", self.path)
+            self._send(status, "application/json; charset=UTF-8", json.dumps(result, ensure_ascii=False).encode("utf-8"))
+
+        def do_POST(self):
+            with stub._lock:
+                stub.stats["http_requests"] += 1
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = self.rfile.read(length)
+            if urlsplit(self.path).path != _BATCH_PATH:
+                self._send(404, "application/json", json.dumps(_error_body(404, "notFound", "Not Found")).encode("utf-8"))
+                return
+            try:
+                content_type, body = stub.handle_batch(self.headers.get("Content-Type", ""), payload)
+            except ValueError as e:
+                self._send(400, "application/json", json.dumps(_error_body(400, "badRequest", str(e))).encode("utf-8"))
+                return
+            self._send(200, content_type, body)
+
+    return Handler
+
+
+def serve(stub: CalendarStub, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """スタブをバックグラウンドスレッドで起動する。接続先は f"http://{host}:{server.server_port}/" """
+    server = ThreadingHTTPServer((host, port), _make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="calendar-stub", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="GoogleカレンダーAPIのローカルスタブ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixture", help="カレンダーと予定のJSON（省略時はサンプル予定）")
+    parser.add_argument("--calendars", type=int, default=1, help="サンプルのカレンダー数")
+    parser.add_argument("--days", type=int, default=31)
+    parser.add_argument("--per-day", type=int, default=2)
+    parser.add_argument("--fail-every", type=int, default=0, help="N回に1回 429 を返す")
+    args = parser.parse_args()
+    if args.fixture:
+        stub = CalendarStub.from_fixture(args.fixture, fail_every=args.fail_every)
+    else:
+        calendars = {
+            ("primary" if i == 0 else f"stub-{i}@example.com"): {
+                "summary": "メイン" if i == 0 else f"サブ{i}",
+                "items": sample_events(args.days, args.per_day),
+            }
+            for i in range(args.calendars)
+        }
+        stub = CalendarStub(calendars, fail_every=args.fail_every)
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(stub))
+    print(f"calendar stub: http://{args.host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
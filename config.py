@@ -5,6 +5,8 @@
 
 import os
 
+import event_registry
+
 # テンプレートファイルのパス（config.py と同じディレクトリ基準で絶対パスにし、どこから実行しても読み込めるようにする）
 _CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATES_CSV_PATH = os.path.join(_CONFIG_DIR, "templates", "templates.csv")
@@ -12,67 +14,93 @@ TEMPLATES_CSV_PATH = os.path.join(_CONFIG_DIR, "templates", "templates.csv")
 # 出力ディレクトリ
 OUTPUT_DIR = "output"
 
+# キャッシュディレクトリ（再起動・別セッションでも残るローカル保存先）
+CACHE_DIR = os.path.join(_CONFIG_DIR, "cache")
+
+# 取得済み予定の永続キャッシュ（SQLite）。件数上限を超えたら参照が古い順に削除
+EVENT_CACHE_PATH = os.path.join(CACHE_DIR, "events.sqlite3")
+EVENT_CACHE_MAX_ENTRIES = 5000
+
+# 一括生成で前回出力した行の記録（差分出力用）
+EXPORT_LEDGER_PATH = os.path.join(CACHE_DIR, "export_ledger.sqlite3")
+
+# テンプレート管理で追加・編集したテンプレートの置き場（全セッション共通・版ごとに保存）
+TEMPLATE_STORE_PATH = os.path.join(CACHE_DIR, "templates.sqlite3")
+
+# 生成した告知文・月全体の案内文の履歴（追記のみ。本文は内容ごとに1回だけ圧縮して保存）
+ANNOUNCEMENT_ARCHIVE_PATH = os.path.join(CACHE_DIR, "announcement_archive.sqlite3")
+
+# 生成済み告知文のキャッシュ（テンプレート＋差し込む値が同じなら再生成しない）。件数上限を超えたら古い順に捨てる
+RENDER_CACHE_MAX_ENTRIES = 2048
+
+# 繰り返し予定をサーバーで展開せず、元予定と例外だけ取得して手元で展開する
+# （毎週のグルコンなど、説明文を開催ごとにダウンロード・解析しなくて済む）
+CALENDAR_EXPAND_RECURRING_LOCALLY = False
+
+# 事前生成ワーカーがカレンダーを同期する間隔（秒）
+PREGEN_INTERVAL_SEC = 300
+# 事前生成ワーカーを、この周期数のあいだどのセッションからも使われなければ止める
+PREGEN_IDLE_INTERVALS = 3
+
+# OAuthトークンを期限切れの何秒前に更新するか・期限を確認する間隔（秒）
+TOKEN_REFRESH_LEAD_SEC = 300
+TOKEN_CHECK_INTERVAL_SEC = 60
+# 更新に失敗したトークンを裏で再試行する間隔の上限（秒。失敗するたびに確認間隔の倍々で空ける）
+TOKEN_RETRY_MAX_SEC = 3600
+
+# GoogleカレンダーAPIの呼び出し制御（アカウントごと）
+CALENDAR_API_RATE_PER_SEC = 5        # 1秒あたりの呼び出し枠の補充数
+CALENDAR_API_BURST = 10              # 一度に使える呼び出し枠
+CALENDAR_API_MAX_WAIT_SEC = 30       # 呼び出し枠の空きを待つ上限（秒）
+CALENDAR_API_MAX_RETRIES = 5         # 429/403 rateLimitExceeded/5xx の再試行回数
+CALENDAR_API_BACKOFF_BASE_SEC = 1.0  # 指数バックオフの初回上限（秒）
+CALENDAR_API_BACKOFF_MAX_SEC = 32.0  # 指数バックオフの上限（秒）
+CALENDAR_API_CIRCUIT_THRESHOLD = 3   # 再試行しても失敗した回数がこれに達したら一時停止
+CALENDAR_API_CIRCUIT_RESET_SEC = 60  # 一時停止してから再開を試すまで（秒）
+CALENDAR_API_BATCH_MAX_CALLS = 50    # HTTPバッチ1回にまとめる呼び出し数（APIの上限は50）
+# APIの接続先（末尾は /）。空なら Google。ローカルのスタブ（calendar_stub.py）で確認するときに指定する
+CALENDAR_API_ROOT_URL = os.environ.get("CALENDAR_API_ROOT_URL", "")
+
+# 取得しながら一括生成するパイプライン（pipeline.py）
+PIPELINE_PAGE_SIZE = 100   # カレンダーから1回に取得する予定数（小さいほど最初の行が早く出る）
+PIPELINE_QUEUE_SIZE = 2    # 段の間に溜めるページ数の上限（後段が詰まったら前段が待つ）
+
+# 告知文生成のHTTPサービス（announcement_server.py）
+ANNOUNCEMENT_SERVER_HOST = os.environ.get("ANNOUNCEMENT_SERVER_HOST", "127.0.0.1")
+ANNOUNCEMENT_SERVER_PORT = int(os.environ.get("ANNOUNCEMENT_SERVER_PORT", "8787"))
+# 設定すると Authorization: Bearer <トークン> がないリクエストを拒否する
+ANNOUNCEMENT_SERVER_TOKEN = os.environ.get("ANNOUNCEMENT_SERVER_TOKEN", "")
+ANNOUNCEMENT_SERVER_KEEPALIVE_SEC = 15          # keep-alive 接続を待つ上限（秒）
+ANNOUNCEMENT_SERVER_MAX_BODY_BYTES = 5 * 1024 * 1024
+ANNOUNCEMENT_SERVER_MAX_GENERATORS = 16         # 上書きテンプレートごとに保持する生成器の数
+
+# 一括生成の行をスプレッドシートに送る（sheet_push.py）。(予定ID, 段階) が同じ行は追加せずに上書きする
+# SHEET_PUSH_SPREADSHEET_ID を設定すると Google スプレッドシートへ送る（カレンダー連携のときに編集の権限も求める）。
+# SHEET_PUSH_LOCAL_PATH を設定すると、スプレッドシートの代わりにローカルのCSVへ送る（動作確認用）
+SHEET_PUSH_SPREADSHEET_ID = os.environ.get("SHEET_PUSH_SPREADSHEET_ID", "")
+SHEET_PUSH_SHEET_NAME = os.environ.get("SHEET_PUSH_SHEET_NAME", "告知文一覧")
+SHEET_PUSH_LOCAL_PATH = os.environ.get("SHEET_PUSH_LOCAL_PATH", "")
+SHEET_PUSH_MAX_ROWS = 500                 # 1回の追加・更新で送る行数の上限
+SHEET_PUSH_MAX_BYTES = 1024 * 1024        # 1回の追加・更新で送る内容の大きさの上限（バイト。APIの推奨は2MBまで）
+# Sheets APIの接続先（末尾は /）。空なら Google。ローカルのスタブで確認するときに指定する
+SHEETS_API_ROOT_URL = os.environ.get("SHEETS_API_ROOT_URL", "")
+
 # カレンダー取り込み時に除外する予定のタイトル（部分一致で除外）
 # 例: "週報提出" を含む予定は告知文生成・月全体案内の対象にしない
 CALENDAR_EXCLUDE_TITLES = ["週報提出"]
 
+# .ics の取り込みで、ファイルにタイムゾーン（X-WR-TIMEZONE）がないときに使うタイムゾーン
+ICS_DEFAULT_TIMEZONE = "Asia/Tokyo"
+
 # 日付フォーマット
 DATE_FORMAT = "%Y年%m月%d日"
 TIME_FORMAT = "%H:%M"
 
-# イベント種別ごとの固定Zoom情報
-FIXED_ZOOM_INFO = {
-    "ジャンル特化グルコン（事前告知）": {
-        "zoom_url": "https://us06web.zoom.us/j/86783391679?pwd=A7t1L99e5NHZBJOj5tMEPNHOUAyhh8.1",
-        "meeting_id": "867 8339 1679",
-        "passcode": "0000"
-    },
-    "ジャンル特化グルコン（間もなく開始）": {
-        "zoom_url": "https://us06web.zoom.us/j/86783391679?pwd=A7t1L99e5NHZBJOj5tMEPNHOUAyhh8.1",
-        "meeting_id": "867 8339 1679",
-        "passcode": "0000"
-    },
-    "万垢生限定オン会（事前告知）": {
-        "zoom_url": "https://us06web.zoom.us/j/82465129951?pwd=hGUx2VD6SwjqgHZOsAjTW8UYjq9K7a.1",
-        "meeting_id": "824 6512 9951",
-        "passcode": "311619"
-    },
-    "万垢生限定オン会（間もなく開始）": {
-        "zoom_url": "https://us06web.zoom.us/j/82465129951?pwd=hGUx2VD6SwjqgHZOsAjTW8UYjq9K7a.1",
-        "meeting_id": "824 6512 9951",
-        "passcode": "311619"
-    },
-    "生徒対談（事前告知）": {
-        "zoom_url": "https://us06web.zoom.us/j/84044741268?pwd=kkc7BHgUm82aaiNC3HxHGZVMSVF799.1",
-        "meeting_id": "840 4474 1268",
-        "passcode": "009706"
-    },
-    "生徒対談（間もなく開始）": {
-        "zoom_url": "https://us06web.zoom.us/j/84044741268?pwd=kkc7BHgUm82aaiNC3HxHGZVMSVF799.1",
-        "meeting_id": "840 4474 1268",
-        "passcode": "009706"
-    },
-    "講師対談（事前告知）": {
-        "zoom_url": "https://us06web.zoom.us/j/84044741268?pwd=kkc7BHgUm82aaiNC3HxHGZVMSVF799.1",
-        "meeting_id": "840 4474 1268",
-        "passcode": "009706"
-    },
-    "講師対談（間もなく開始）": {
-        "zoom_url": "https://us06web.zoom.us/j/84044741268?pwd=kkc7BHgUm82aaiNC3HxHGZVMSVF799.1",
-        "meeting_id": "840 4474 1268",
-        "passcode": "009706"
-    },
-    "オン会（事前告知）": {
-        "zoom_url": "https://us06web.zoom.us/j/81644840347?pwd=NdMeW9PWVXz4Wp2QqscIHvjecEUV6L.1",
-        "meeting_id": "816 4484 0347",
-        "passcode": "121550"
-    },
-    "オン会（間もなく開始）": {
-        "zoom_url": "https://us06web.zoom.us/j/81644840347?pwd=NdMeW9PWVXz4Wp2QqscIHvjecEUV6L.1",
-        "meeting_id": "816 4484 0347",
-        "passcode": "121550"
-    },
-}
+# イベント種別の定義（タイトルの判定・チャンネル・必須項目・固定Zoom・月全体の案内文の見出し）
+EVENT_TYPES_PATH = os.path.join(_CONFIG_DIR, "templates", "event_types.json")
+
+# イベント種別ごとの固定Zoom情報（event_types.json の zoom_rooms から作る）
+FIXED_ZOOM_INFO = event_registry.get_registry(EVENT_TYPES_PATH).fixed_zoom_info()
 
 # ジャンルと絵文字のマッピング
 GENRE_EMOJI_MAP = {
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+取得済み予定の永続キャッシュ
+
+GoogleカレンダーAPIの生データと変換後の event_data を SQLite に保存し、
+再起動・新しいセッションでも前回取得した1ヶ月分をすぐに表示できるようにします。
+キーは (カレンダーID, 予定ID)。etag とパーサーのバージョンが一致する予定は再変換しません。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Any
+
+import config
+from google_calendar_client import convert_api_event, is_excluded_event
+
+# 変換結果に影響するソース。いずれかが変わるとキャッシュ済みの event_data は作り直す
+_PARSER_SOURCES = (
+    "parse_calendar.py", "google_calendar_client.py", "recurrence.py", "config.py",
+    "event_registry.py", os.path.join("templates", "event_types.json"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    parser_version TEXT NOT NULL,
+    raw_json TEXT NOT NULL,
+    event_json TEXT NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_events_last_access ON events (last_access);
+CREATE TABLE IF NOT EXISTS calendar_sync (
+    calendar_id TEXT PRIMARY KEY,
+    event_ids TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+def compute_parser_version() -> str:
+    """変換ロジックのソースからバージョン文字列を作る（ファイル内容のハッシュ）"""
+    base = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha1()
+    for name in _PARSER_SOURCES:
+        path = os.path.join(base, name)
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except OSError:
+            h.update(name.encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _event_etag(api_event: Dict) -> str:
+    """etag がない予定（テスト用データなど）は内容のハッシュで代用"""
+    etag = api_event.get("etag")
+    if etag:
+        return str(etag)
+    payload = json.dumps(api_event, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class EventCache:
+    """予定の永続キャッシュ（SQLite）。スレッドごとに接続を開くのでバックグラウンド更新からも使える"""
+
+    def __init__(self, path: str = None, max_entries: int = None, parser_version: str = None):
+        self.path = path or config.EVENT_CACHE_PATH
+        self.max_entries = max_entries if max_entries is not None else config.EVENT_CACHE_MAX_ENTRIES
+        self.parser_version = parser_version or compute_parser_version()
+        self._write_lock = threading.Lock()
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def convert_events(
+        self,
+        calendar_id: str,
+        api_events: List[Dict],
+        parse_event_name_fn,
+        exclude_titles=None,
+    ) -> List[Dict[str, Any]]:
+        """
+        APIの予定一覧を event_data に変換してキャッシュに保存する。
+        etag・パーサーのバージョンが同じ予定はキャッシュ済みの変換結果を使う。
+        このカレンダーの「最新の一覧」も今回の並び順で置き換える。
+        """
+        ids: List[str] = []
+        event_data_list = self.convert_page(calendar_id, api_events, parse_event_name_fn, exclude_titles, ids_out=ids)
+        self.record_sync(calendar_id, ids)
+        return event_data_list
+
+    def convert_page(
+        self,
+        calendar_id: str,
+        api_events: List[Dict],
+        parse_event_name_fn,
+        exclude_titles=None,
+        series_memo: Optional[Dict] = None,
+        ids_out: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        convert_events の1ページ分（ページごとに取得しながら変換するとき用）。「最新の一覧」は置き換えないので、
+        全ページを変換したら ids_out に集めた予定IDで record_sync を呼ぶ。
+        """
+        now = time.time()
+        targets = [ev for ev in api_events if not is_excluded_event(ev, exclude_titles)]
+        ids = [str(ev.get("id", "")) for ev in targets]
+        if series_memo is None:
+            series_memo = {}
+        with self._write_lock, self._connect() as conn:
+            cached = self._fetch_rows(conn, calendar_id, ids)
+            event_data_list = []
+            upserts = []
+            for ev, event_id in zip(targets, ids):
+                etag = _event_etag(ev)
+                row = cached.get(event_id)
+                if row and row[0] == etag and row[1] == self.parser_version:
+                    ed = json.loads(row[2])
+                else:
+                    ed = convert_api_event(ev, parse_event_name_fn, series_memo)
+                    upserts.append((
+                        calendar_id, event_id, etag, self.parser_version,
+                        json.dumps(ev, ensure_ascii=False),
+                        json.dumps(ed, ensure_ascii=False),
+                        now,
+                    ))
+                event_data_list.append(ed)
+            conn.executemany(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", upserts
+            )
+            conn.executemany(
+                "UPDATE events SET last_access = ? WHERE calendar_id = ? AND event_id = ?",
+                [(now, calendar_id, i) for i in ids],
+            )
+        if ids_out is not None:
+            ids_out.extend(ids)
+        return event_data_list
+
+    def record_sync(self, calendar_id: str, ids: List[str]) -> None:
+        """このカレンダーの「最新の一覧」を ids の並び順で置き換え、件数上限を超えた分を消す"""
+        with self._write_lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO calendar_sync VALUES (?, ?, ?)",
+                (calendar_id, json.dumps(ids), time.time()),
+            )
+            self._evict(conn)
+
+    def load_events(self, calendar_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        前回同期したこのカレンダーの event_data を並び順どおりに返す。
+        同期履歴がない、またはパーサーが変わって使えない予定がある場合は None。
+        """
+        with self._connect() as conn:
+            sync = conn.execute(
+                "SELECT event_ids FROM calendar_sync WHERE calendar_id = ?", (calendar_id,)
+            ).fetchone()
+            if sync is None:
+                return None
+            ids = json.loads(sync[0])
+            rows = self._fetch_rows(conn, calendar_id, ids)
+        event_data_list = []
+        for event_id in ids:
+            row = rows.get(event_id)
+            if row is None or row[1] != self.parser_version:
+                return None
+            event_data_list.append(json.loads(row[2]))
+        return event_data_list
+
+    def last_synced_at(self, calendar_id: str) -> Optional[float]:
+        """最後に同期した時刻（UNIX秒）。未同期なら None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT synced_at FROM calendar_sync WHERE calendar_id = ?", (calendar_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def clear(self, calendar_id: str = None) -> None:
+        with self._write_lock, self._connect() as conn:
+            if calendar_id is None:
+                conn.execute("DELETE FROM events")
+                conn.execute("DELETE FROM calendar_sync")
+            else:
+                conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+                conn.execute("DELETE FROM calendar_sync WHERE calendar_id = ?", (calendar_id,))
+
+    def _fetch_rows(self, conn: sqlite3.Connection, calendar_id: str, ids: List[str]) -> Dict[str, tuple]:
+        """(etag, parser_version, event_json) を予定IDごとに返す"""
+        rows = {}
+        # SQLite のプレースホルダ上限を超えないよう分割して取得
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for event_id, etag, version, event_json in conn.execute(
+                f"SELECT event_id, etag, parser_version, event_json FROM events "
+                f"WHERE calendar_id = ? AND event_id IN ({placeholders})",
+                [calendar_id, *chunk],
+            ):
+                rows[event_id] = (etag, version, event_json)
+        return rows
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """件数上限を超えた分を、参照が古い順に削除する"""
+        if not self.max_entries or self.max_entries <= 0:
+            return
+        count = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM events WHERE rowid IN "
+                "(SELECT rowid FROM events ORDER BY last_access ASC LIMIT ?)",
+                (excess,),
+            )
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+イベント種別の定義（templates/event_types.json）
+
+種別ごとに次の内容をファイル1つで定義し、読み込み時に表へまとめます。
+- タイトルの判定パターン（上にある種別ほど優先）と講師名の取り出し方
+- 投稿チャンネル・講師名の要否・種別ごとの追加必須項目
+- 固定Zoom情報（部屋ごとに1回だけ書き、種別から参照する）
+- 月全体の案内文での見出し（section）
+
+タイトルの判定は全種別のパターンをまとめた1つの正規表現で行い、
+チャンネル・必須項目・見出し・固定Zoomは「イベント種別名 → 定義」の辞書を引くだけで決まります。
+新しい種別（特別講義など）は JSON に1件足せば、取り込み・一括生成・入力チェック・月全体の案内文まで通ります。
+カレンダーの予定は Zoom 情報を持たないので、固定Zoom（zoom）がない種別は "required" で Zoom 以外の必須項目を宣言してください。
+
+使い方:
+    python event_registry.py --check   # 各種別の【種別】タイトルの予定が一括生成でスキップされないか確認
+"""
+
+import argparse
+import json
+import re
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# タイトルの判定結果を覚えておく件数（超えたら全部捨てて覚え直す）
+TITLE_MEMO_MAX_ENTRIES = 4096
+# 定義にない種別名の判定結果・必須項目を覚えておく件数（種別名はHTTPサービスの入力からも来るので上限を設ける）
+TYPE_MEMO_MAX_ENTRIES = 4096
+
+
+class EventRegistryError(Exception):
+    """種別の定義ファイルが読めない・内容がおかしい"""
+
+
+class EventTypeSpec:
+    """1つのイベント種別名（種別×告知の段階）の定義"""
+
+    __slots__ = ("event_type", "kind", "variant", "announce", "channel", "teacher", "zoom", "overview", "required")
+
+    def __init__(self, event_type: str, kind: str, variant: str, announce: bool, channel: str,
+                 teacher: bool, zoom: Optional[Dict[str, str]], overview: Optional[str],
+                 required: Optional[Tuple[str, ...]]):
+        self.event_type = event_type
+        self.kind = kind
+        self.variant = variant
+        self.announce = announce
+        self.channel = channel
+        self.teacher = teacher
+        self.zoom = zoom
+        self.overview = overview
+        # 段階ごとの追加必須項目（None なら日付・講師名の既定）
+        self.required = required
+
+
+def make_event_type(kind: str, variant: str) -> str:
+    """種別と段階からイベント種別名を作る（例: 講師対談（事前告知））"""
+    return f"{kind}（{variant}）"
+
+
+class EventRegistry:
+    """イベント種別の定義を引く表"""
+
+    def __init__(self, data: Dict):
+        try:
+            self.variants: List[str] = [v["name"] for v in data["variants"]]
+            announce = [v["name"] for v in data["variants"] if v.get("announce")]
+            kinds = data["kinds"]
+            self.default_kind: str = data["default_kind"]
+            self.default_channel: str = data["default_channel"]
+            rooms: Dict[str, Dict[str, str]] = data.get("zoom_rooms", {})
+            self.sections: List[Dict] = list(data.get("overview_sections", []))
+            section_keys = {s["key"] for s in self.sections}
+        except (KeyError, TypeError) as e:
+            raise EventRegistryError(f"種別の定義に必要な項目がありません: {e}")
+        if len(announce) != 1:
+            raise EventRegistryError("事前告知にあたる段階（announce: true）を1つだけ指定してください")
+        self.announce_variant: str = announce[0]
+
+        self.kinds: List[str] = []
+        self.types: Dict[str, EventTypeSpec] = {}
+        self._teacher_res: Dict[str, List[re.Pattern]] = {}
+        self._type_keywords: List[Tuple[str, str]] = []
+        title_parts = []
+        for i, kind in enumerate(kinds):
+            name = kind.get("name")
+            if not name or not kind.get("title_patterns"):
+                raise EventRegistryError(f"{i + 1}件目の種別に name / title_patterns がありません")
+            zoom = kind.get("zoom")
+            if zoom is not None and zoom not in rooms:
+                raise EventRegistryError(f"{name}: 固定Zoom '{zoom}' が zoom_rooms にありません")
+            overview = kind.get("overview")
+            if overview is not None and overview not in section_keys:
+                raise EventRegistryError(f"{name}: 見出し '{overview}' が overview_sections にありません")
+            try:
+                self._teacher_res[name] = [re.compile(p) for p in kind.get("teacher_patterns", [])]
+                title_parts.append(f"(?=(?P<k{i}>{'|'.join(f'(?:{p})' for p in kind['title_patterns'])}))")
+                re.compile(title_parts[-1])
+            except re.error as e:
+                raise EventRegistryError(f"{name}: パターンが正しくありません（{e}）")
+            self.kinds.append(name)
+            self._type_keywords.extend((kw, name) for kw in kind.get("type_keywords", [name]))
+            required = kind.get("required", {})
+            for variant in self.variants:
+                event_type = make_event_type(name, variant)
+                self.types[event_type] = EventTypeSpec(
+                    event_type, name, variant, variant == self.announce_variant,
+                    kind.get("channel", self.default_channel), kind.get("teacher", True),
+                    dict(rooms[zoom]) if zoom is not None else None, overview,
+                    tuple(required[variant]) if variant in required else None,
+                )
+        if self.default_kind not in self.kinds:
+            raise EventRegistryError(f"default_kind '{self.default_kind}' が kinds にありません")
+        # 先読み（幅0）にして、重なっているパターンも取りこぼさずに全位置で調べる
+        self._title_re = re.compile("|".join(title_parts), re.S)
+        self._title_memo: Dict[str, str] = {}
+        # 定義にない種別名（テンプレート管理で追加したものなど）の判定結果
+        self._kind_memo: Dict[str, Optional[str]] = {}
+        self._required_memo: Dict[Tuple[str, bool], Tuple[str, ...]] = {}
+
+    # --- タイトルの判定 ---
+
+    def classify_title(self, title: str) -> str:
+        """
+        予定のタイトルから種別を決める（どのパターンにも合わなければ default_kind）。
+        繰り返し予定は同じタイトルが続くので、判定結果を覚えておく。
+        """
+        kind = self._title_memo.get(title)
+        if kind is not None:
+            return kind
+        best = len(self.kinds)
+        for m in self._title_re.finditer(title or ""):
+            best = min(best, int(m.lastgroup[1:]))
+            if best == 0:
+                break
+        kind = self.kinds[best] if best < len(self.kinds) else self.default_kind
+        if len(self._title_memo) >= TITLE_MEMO_MAX_ENTRIES:
+            self._title_memo.clear()
+        self._title_memo[title] = kind
+        return kind
+
+    def teacher_name(self, kind: str, title: str) -> Optional[str]:
+        """種別の講師名パターンでタイトルから講師名を取り出す（上のパターンから順に試す）"""
+        for pattern in self._teacher_res.get(kind, ()):
+            m = pattern.search(title or "")
+            if m:
+                return m.group(1).strip()
+        return None
+
+    # --- イベント種別名からの引き当て ---
+
+    def spec(self, event_type: str) -> Optional[EventTypeSpec]:
+        return self.types.get(event_type)
+
+    def kind_of(self, event_type: str) -> Optional[str]:
+        """
+        イベント種別名の種別。定義にない名前は type_keywords（既定は種別名）の部分一致で決め、結果を覚えておく。
+        """
+        spec = self.types.get(event_type)
+        if spec is not None:
+            return spec.kind
+        if event_type in self._kind_memo:
+            return self._kind_memo[event_type]
+        kind = next((k for kw, k in self._type_keywords if kw in event_type), None) if event_type else None
+        _remember(self._kind_memo, event_type, kind)
+        return kind
+
+    def variant_of(self, event_type: str) -> Optional[str]:
+        """イベント種別名の段階（事前告知・間もなく開始）。どれでもなければ None"""
+        spec = self.types.get(event_type)
+        if spec is not None:
+            return spec.variant
+        return next((v for v in self.variants if f"（{v}）" in (event_type or "")), None)
+
+    def follow_up_types(self, event_type: str) -> List[Tuple[str, str]]:
+        """事前告知のイベント種別名から、続く段階の (段階, イベント種別名) を返す"""
+        announce = f"（{self.announce_variant}）"
+        if announce not in (event_type or ""):
+            return []
+        return [
+            (v, event_type.replace(announce, f"（{v}）"))
+            for v in self.variants if v != self.announce_variant
+        ]
+
+    def channel(self, event_type: str) -> str:
+        """投稿チャンネル"""
+        spec = self.types.get(event_type)
+        if spec is not None:
+            return spec.channel
+        kind = self.kind_of(event_type)
+        if kind is None:
+            return self.default_channel
+        return self.types[make_event_type(kind, self.announce_variant)].channel
+
+    def overview_section(self, event_type: str) -> Optional[str]:
+        """月全体の案内文での見出しのキー（載せない種別は None）"""
+        spec = self.types.get(event_type)
+        if spec is not None:
+            return spec.overview
+        kind = self.kind_of(event_type)
+        return self.types[make_event_type(kind, self.announce_variant)].overview if kind else None
+
+    def required_fields(self, event_type: str, has_fixed_zoom: bool) -> Tuple[str, ...]:
+        """入力チェックの必須項目（種別名と固定Zoomの有無ごとに1回だけ組み立てる）"""
+        key = (event_type, has_fixed_zoom)
+        fields = self._required_memo.get(key)
+        if fields is None:
+            fields = self._compile_required(event_type, has_fixed_zoom)
+            _remember(self._required_memo, key, fields)
+        return fields
+
+    def _compile_required(self, event_type: str, has_fixed_zoom: bool) -> Tuple[str, ...]:
+        basic = ("time", "event_type") if has_fixed_zoom else ("time", "event_type", "zoom_url")
+        spec = self.types.get(event_type)
+        teacher = () if spec is not None and not spec.teacher else ("teacher_name",)
+        if spec is not None and spec.required is not None:
+            return basic + spec.required
+        if f"（{self.announce_variant}）" in event_type:
+            return basic + ("date",) + teacher + (() if has_fixed_zoom else ("meeting_id", "passcode"))
+        return basic + ("date",) + teacher
+
+    def fixed_zoom_info(self) -> Dict[str, Dict[str, str]]:
+        """固定Zoomがある種別の {イベント種別名: Zoom情報}"""
+        return {et: dict(spec.zoom) for et, spec in self.types.items() if spec.zoom is not None}
+
+    def event_types(self) -> List[str]:
+        """定義済みのイベント種別名（定義順）"""
+        return list(self.types)
+
+
+def _remember(memo: Dict, key, value) -> None:
+    """判定結果を覚える（TYPE_MEMO_MAX_ENTRIES を超えたら全部捨てて覚え直す）"""
+    if len(memo) >= TYPE_MEMO_MAX_ENTRIES:
+        memo.clear()
+    memo[key] = value
+
+
+def load_registry(path: str) -> EventRegistry:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise EventRegistryError(f"種別の定義を読み込めませんでした: {path}（{e}）")
+    return EventRegistry(data)
+
+
+_REGISTRIES: Dict[str, EventRegistry] = {}
+
+
+def get_registry(path: str = None) -> EventRegistry:
+    """種別の定義（パスごとにプロセスで1回だけ読み込む）"""
+    if path is None:
+        import config
+        path = config.EVENT_TYPES_PATH
+    registry = _REGISTRIES.get(path)
+    if registry is None:
+        registry = _REGISTRIES[path] = load_registry(path)
+    return registry
+
+
+def check_calendar_kinds(path: str = None) -> List[str]:
+    """
+    種別ごとに【種別】タイトルのカレンダー予定を1件作り、一括生成でスキップされる段階を返す（空なら問題なし）。
+    必須項目が固定Zoomもカレンダーも持たない項目（zoom_url など）になっている種別を見つける。
+    """
+    from bulk_export import SKIPPED_MESSAGE, build_bulk_rows
+    from generate_announcement import AnnouncementGenerator
+    from google_calendar_client import api_event_to_event_data
+    from parse_calendar import parse_event_name
+
+    registry = get_registry(path)
+    events = [
+        api_event_to_event_data({
+            "summary": f"【{kind}】確認用講師（スポット）",
+            "start": {"dateTime": "2026-01-10T20:00:00+09:00"},
+            "description": "https://www.instagram.com/check_kind/",
+        }, parse_event_name)
+        for kind in registry.kinds
+    ]
+    rows = build_bulk_rows(events, AnnouncementGenerator())
+    return [
+        make_event_type(registry.kind_of(ev["event_type"]), row["_variant"])
+        for ev, row in zip([ev for ev in events for _ in registry.variants], rows)
+        if row["メッセージ"] == SKIPPED_MESSAGE
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="イベント種別の定義を確認する")
+    parser.add_argument("--path", help="種別の定義ファイル（省略時は config.EVENT_TYPES_PATH）")
+    parser.add_argument("--check", action="store_true", help="カレンダーの予定が一括生成でスキップされる種別がないか確認する")
+    args = parser.parse_args()
+    try:
+        registry = get_registry(args.path)
+    except EventRegistryError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not args.check:
+        print("\n".join(registry.event_types()))
+        return
+    skipped = check_calendar_kinds(args.path)
+    if skipped:
+        print(f"スキップされます（必須項目を見直してください）: {', '.join(skipped)}")
+        sys.exit(1)
+    print(f"全{len(registry.kinds)}種別とも一括生成できます")
+
+
+if __name__ == "__main__":
+    main()
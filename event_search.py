@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+取得した予定の検索インデックス
+
+講師名・ジャンル・タイトル・日付・種別から、文字の2-gram（1文字の検索は1-gram）の転置インデックスを
+予定を取得したときに1回だけ作ります。検索は転置リストの積集合と部分一致の確認だけで行うので、
+数か月分・複数カレンダーの予定でもすぐに絞り込めます。選択肢の表示文字列も作成時にまとめて作ります。
+"""
+
+import unicodedata
+from typing import Any, Dict, List, Set
+
+# 検索対象の項目
+SEARCH_FIELDS = ("teacher_name", "genre", "_raw_summary", "date", "event_type")
+
+
+def normalize(text: str) -> str:
+    """全角・半角と大文字・小文字をそろえ、空白を除く"""
+    return "".join(unicodedata.normalize("NFKC", str(text or "")).lower().split())
+
+
+def _grams(text: str, n: int) -> Set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def event_label(ed: Dict[str, Any]) -> str:
+    """選択肢の表示文字列（日付 時間｜タイトル）"""
+    return f"{ed.get('date', '')} {ed.get('time', '')}｜{ed.get('_raw_summary', '')[:40]}"
+
+
+class EventSearchIndex:
+    """予定一覧の検索インデックス。予定の並び順（行番号）で結果を返す"""
+
+    def __init__(self, events: List[Dict[str, Any]]):
+        self.labels: List[str] = [event_label(ed) for ed in events]
+        # 項目の境目をまたいで一致しないよう、区切り文字を挟んで1つの文字列にする
+        self._texts: List[str] = [
+            "\x00".join(normalize(ed.get(f, "")) for f in SEARCH_FIELDS) for ed in events
+        ]
+        self._unigrams: Dict[str, List[int]] = {}
+        self._bigrams: Dict[str, List[int]] = {}
+        for i, text in enumerate(self._texts):
+            for g in _grams(text, 1):
+                self._unigrams.setdefault(g, []).append(i)
+            for g in _grams(text, 2):
+                if "\x00" not in g:
+                    self._bigrams.setdefault(g, []).append(i)
+        self._all = list(range(len(events)))
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def search(self, query: str) -> List[int]:
+        """
+        空白区切りの語をすべて含む予定の行番号（並び順）。空の検索はすべての行。
+        例: "はるパパ 3/4"、"スポット"、"講師対談"
+        """
+        terms = [normalize(t) for t in str(query or "").split()]
+        terms = [t for t in terms if t]
+        if not terms:
+            return self._all
+        candidates: Set[int] = None
+        # 絞り込みが強い（転置リストが短い）語から積集合をとる
+        for term in sorted(terms, key=self._estimate):
+            postings = self._postings(term)
+            candidates = postings if candidates is None else candidates & postings
+            if not candidates:
+                return []
+        # 2-gram がすべて含まれていても語として続いているとは限らないので、部分一致で確認する
+        return sorted(i for i in candidates if all(t in self._texts[i] for t in terms))
+
+    def _estimate(self, term: str) -> int:
+        if len(term) == 1:
+            return len(self._unigrams.get(term, ()))
+        return min(len(self._bigrams.get(g, ())) for g in _grams(term, 2))
+
+    def _postings(self, term: str) -> Set[int]:
+        if len(term) == 1:
+            return set(self._unigrams.get(term, ()))
+        grams = sorted(_grams(term, 2), key=lambda g: len(self._bigrams.get(g, ())))
+        result = set(self._bigrams.get(grams[0], ()))
+        for g in grams[1:]:
+            if not result:
+                break
+            result &= set(self._bigrams.get(g, ()))
+        return result
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+予定の列形式テーブル
+
+取得した予定を列（開始日時・イベント種別）で持ち、事前告知のみの絞り込みと日時順の並べ替えを
+行ごとの辞書を回さずに行います。月全体の案内文（monthly_overview）と事前生成ワーカーの入力に使います。
+種別の絞り込みはカテゴリ（種別名の一覧とコード）ごとに1回だけ判定します。
+NumPy があれば datetime64・コード配列で持ち、なければ同じ操作を純Pythonで行います（NumPy は必須ではありません）。
+"""
+
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from event_registry import get_registry
+
+
+def _start_from_strings(date_str: str, time_str: str, year: int) -> Optional[datetime]:
+    """event_data の date "2/24", time "21:00" から開始日時を作る"""
+    try:
+        m, d = (int(p) for p in str(date_str).strip().split("/")[:2])
+        hour, minute = 0, 0
+        t = str(time_str or "").strip()
+        if ":" in t:
+            hp = t.split(":")
+            hour, minute = int(hp[0]), int(hp[1])
+        return datetime(year, m, d, hour, minute)
+    except (ValueError, TypeError):
+        return None
+
+
+class _Categorical:
+    """カテゴリ列：値の一覧（categories）と行ごとのコード"""
+
+    def __init__(self, values: List[str]):
+        self.categories: List[str] = []
+        lookup: Dict[str, int] = {}
+        codes = []
+        for v in values:
+            code = lookup.get(v)
+            if code is None:
+                code = lookup[v] = len(self.categories)
+                self.categories.append(v)
+            codes.append(code)
+        self.codes = np.asarray(codes, dtype=np.int32) if NUMPY_AVAILABLE else codes
+
+    def take(self, indices) -> "_Categorical":
+        out = _Categorical.__new__(_Categorical)
+        out.categories = self.categories
+        out.codes = self.codes[indices] if NUMPY_AVAILABLE else [self.codes[i] for i in indices]
+        return out
+
+    def mask(self, predicate: Callable[[str], bool]):
+        """カテゴリごとに1回だけ predicate を評価し、行ごとの真偽を返す"""
+        hits = [predicate(c) for c in self.categories]
+        if NUMPY_AVAILABLE:
+            return np.asarray(hits, dtype=bool)[self.codes] if self.categories else np.zeros(0, dtype=bool)
+        return [hits[c] for c in self.codes]
+
+
+class EventTable:
+    """予定の列形式テーブル。操作は新しいテーブルを返す（元のテーブルは変更しない）"""
+
+    def __init__(self, records: List[Dict[str, Any]], starts: List[Optional[datetime]]):
+        self._records = records
+        n = len(records)
+        self.columns: Dict[str, Any] = {}
+        self.columns["event_type"] = _Categorical([str(r.get("event_type", "") or "").strip() for r in records])
+        if NUMPY_AVAILABLE:
+            self.columns["start"] = np.asarray(
+                [np.datetime64(s, "m") if s is not None else np.datetime64("NaT") for s in starts],
+                dtype="datetime64[m]",
+            ) if n else np.zeros(0, dtype="datetime64[m]")
+        else:
+            self.columns["start"] = list(starts)
+
+    # --- 作成 ---
+
+    @classmethod
+    def from_event_data(cls, events: List[Dict[str, Any]], year: int = None) -> "EventTable":
+        """event_data のリスト（セッション・キャッシュに保存済みのもの）から作る"""
+        year = year or datetime.now().year
+        records = list(events)
+        starts = [_start_from_strings(r.get("date", ""), r.get("time", ""), year) for r in records]
+        return cls(records, starts)
+
+    # --- 参照 ---
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._records)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """行ごとの event_data（build_monthly_overview にそのまま渡せる）"""
+        return list(self._records)
+
+    # --- 操作 ---
+
+    def take(self, indices) -> "EventTable":
+        out = EventTable.__new__(EventTable)
+        idx = list(indices)
+        out._records = [self._records[i] for i in idx]
+        out.columns = {}
+        for name, col in self.columns.items():
+            if isinstance(col, _Categorical):
+                out.columns[name] = col.take(np.asarray(idx, dtype=np.intp) if NUMPY_AVAILABLE else idx)
+            elif NUMPY_AVAILABLE:
+                out.columns[name] = col[np.asarray(idx, dtype=np.intp)]
+            else:
+                out.columns[name] = [col[i] for i in idx]
+        return out
+
+    def _where(self, mask) -> "EventTable":
+        if NUMPY_AVAILABLE:
+            return self.take(np.flatnonzero(mask))
+        return self.take(i for i, m in enumerate(mask) if m)
+
+    def announce_only(self) -> "EventTable":
+        """事前告知の予定だけにする（事前告知にあたる段階は templates/event_types.json の定義による）"""
+        announce = f"（{get_registry().announce_variant}）"
+        return self._where(self.columns["event_type"].mask(lambda et: announce in et))
+
+    def sort_by_start(self) -> "EventTable":
+        """開始日時順（安定ソート。日時がない予定は最後）"""
+        starts = self.columns["start"]
+        if NUMPY_AVAILABLE:
+            # NaT は argsort で末尾に並ぶ
+            return self.take(np.argsort(starts, kind="stable"))
+        order = sorted(range(len(starts)), key=lambda i: (starts[i] is None, starts[i] or datetime.max))
+        return self.take(order)
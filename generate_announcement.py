@@ -3,13 +3,18 @@
 
 import json
 import csv
+import hashlib
 import re
 import sys
 import os
 import argparse
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Sequence
 import config
+from event_registry import get_registry
+from template_pack import load_fresh_pack, render_segments, split_segments
 
 
 def _templates_candidate_paths() -> list:
@@ -28,11 +33,16 @@ def _templates_candidate_paths() -> list:
     return candidates
 
 
+# 読み込み回数（負荷試験で、再実行のたびの無駄な読み込みを数える）
+load_stats = {"generators": 0, "csv_parses": 0, "pack_hits": 0}
+
+
 def _load_templates_from_path(path: str) -> Dict[str, str]:
     """指定パスからテンプレートを読み込む。失敗時は空辞書"""
     templates = {}
     if not path or not os.path.exists(path):
         return templates
+    load_stats["csv_parses"] += 1
     try:
         with open(path, 'r', encoding='utf-8-sig') as f:  # utf-8-sig で BOM 対応
             reader = csv.DictReader(f)
@@ -46,25 +56,102 @@ def _load_templates_from_path(path: str) -> Dict[str, str]:
     return templates
 
 
+def _load_base_templates(path: str) -> tuple:
+    """
+    テンプレートを読み込み、(テンプレート, コンパイル済み {event_type: (本文, ハッシュ, セグメント)}) を返す。
+    最新のパック（templates.pack）があればそれを使い、なければCSVを読む。
+    読み込みの途中でパックは作らない（作るのは python template_pack.py のビルド手順だけ）。
+    """
+    if not path or not os.path.exists(path):
+        return {}, {}
+    pack = load_fresh_pack(path)
+    if pack is not None:
+        load_stats["pack_hits"] += 1
+        templates = pack["templates"]
+        compiled = {
+            et: (templates[et], pack["template_hashes"][et], pack["segments"][et]) for et in templates
+        }
+        return templates, compiled
+    return _load_templates_from_path(path), {}
+
+
+class RenderCache:
+    """
+    生成済み告知文のLRUキャッシュ。
+    キーは (テンプレート内容のハッシュ, 差し込む値のタプル) なので、テンプレートか値が変われば別のキーになる。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+# 全セッション・全 AnnouncementGenerator で共有（ボタンを押すたびに生成し直すので、インスタンスではなくモジュールに持つ）
+_RENDER_CACHE = RenderCache(config.RENDER_CACHE_MAX_ENTRIES)
+
+
+def render_cache_stats() -> Dict[str, int]:
+    """生成キャッシュのヒット・ミス・件数"""
+    return _RENDER_CACHE.stats()
+
+
 class AnnouncementGenerator:
     """告知文章生成クラス"""
     
     def __init__(self, templates_path: str = None, templates_override: Optional[Dict[str, str]] = None):
+        load_stats["generators"] += 1
         self.templates_path = templates_path
-        base = {}
+        base, compiled = {}, {}
         if templates_path:
-            base = _load_templates_from_path(templates_path)
+            base, compiled = _load_base_templates(templates_path)
         if not base:
             for path in _templates_candidate_paths():
-                base = _load_templates_from_path(path)
+                base, compiled = _load_base_templates(path)
                 if base:
                     self.templates_path = path
                     break
         override = templates_override or {}
         self.templates = {**base, **override}
+        # event_type -> (テンプレート, 内容のハッシュ, セグメント)。ハッシュは生成キャッシュのキーに使う
+        self._compiled: Dict[str, tuple] = compiled
     
-    def _replace_variables(self, template: str, event_data: Dict) -> str:
-        result = template
+    def _resolve_variables(self, event_data: Dict) -> tuple:
+        """
+        差し込む値を確定する（固定Zoom・時刻の和表記・ジャンル絵文字・講師名の補完）。
+        補完した値は event_data にも書き戻す。戻り値は SUPPORTED_VARIABLES 順の値のタプル。
+        """
         event_type = event_data.get('event_type', '').strip()
         if event_type in config.FIXED_ZOOM_INFO:
             fixed_info = config.FIXED_ZOOM_INFO[event_type]
@@ -87,40 +174,93 @@ class AnnouncementGenerator:
                 m = re.search(r'instagram\.com/([^/?\s]+)', event_data['instagram_url'], re.I)
                 if m:
                     event_data['teacher_name'] = m.group(1).strip()
-        for var in config.SUPPORTED_VARIABLES:
-            placeholder = f"{{{{{var}}}}}"
-            value = event_data.get(var, "")
-            result = result.replace(placeholder, str(value))
-        return result
-    
+        return tuple(str(event_data.get(var, "")) for var in config.SUPPORTED_VARIABLES)
+
+    @staticmethod
+    def _substitute(segments: tuple, values: tuple) -> str:
+        return render_segments(segments, dict(zip(config.SUPPORTED_VARIABLES, values)))
+
+    def _replace_variables(self, template: str, event_data: Dict) -> str:
+        return self._substitute(split_segments(template), self._resolve_variables(event_data))
+
+    def template_version(self, event_type: str) -> Optional[str]:
+        """その種別のテンプレート内容のハッシュ（テンプレートがなければ None）"""
+        if event_type not in self.templates:
+            return None
+        return self._compiled_template(event_type)[0]
+
+    def _compiled_template(self, event_type: str) -> tuple:
+        """(テンプレートのハッシュ, セグメント)。パックにない・上書きされたテンプレートはここで分割する"""
+        template = self.templates[event_type]
+        cached = self._compiled.get(event_type)
+        if cached is None or cached[0] is not template:
+            cached = (template, hashlib.sha1(template.encode('utf-8')).hexdigest(), split_segments(template))
+            self._compiled[event_type] = cached
+        return cached[1], cached[2]
+
     def generate(self, event_data: Dict) -> Optional[str]:
         event_type = event_data.get('event_type', '').strip()
         if not event_type or event_type not in self.templates:
             return None
-        return self._replace_variables(self.templates[event_type], event_data)
+        values = self._resolve_variables(event_data)
+        template_hash, segments = self._compiled_template(event_type)
+        key = (template_hash, values)
+        announcement = _RENDER_CACHE.get(key)
+        if announcement is None:
+            announcement = self._substitute(segments, values)
+            _RENDER_CACHE.put(key, announcement)
+        return announcement
     
     def validate_event_data(self, event_data: Dict) -> tuple[bool, list[str]]:
+        """1件の予定をチェックする。値が None の項目は validate_columns と同じく「項目なし」として扱う"""
         errors = []
-        event_type = event_data.get('event_type', '').strip()
-        has_fixed_zoom = event_type in config.FIXED_ZOOM_INFO
-        basic_required = ['time', 'event_type'] if has_fixed_zoom else ['time', 'event_type', 'zoom_url']
-        event_specific_required = {
-            'ジャンル特化グルコン（間もなく開始）': ['genre', 'teacher_name', 'instagram_url'],
-            '生徒対談（間もなく開始）': [], '講師対談（間もなく開始）': [],
-            'オン会（間もなく開始）': [], 'オン会（事前告知）': [],
-            '万垢生限定オン会（事前告知）': [], '万垢生限定オン会（間もなく開始）': [],
-        }
-        no_teacher_events = ['オン会（事前告知）', 'オン会（間もなく開始）', '万垢生限定オン会（事前告知）', '万垢生限定オン会（間もなく開始）']
-        if '（事前告知）' in event_type:
-            if has_fixed_zoom:
-                required_fields = basic_required + (['date'] if event_type in no_teacher_events else ['date', 'teacher_name'])
-            else:
-                required_fields = basic_required + (['date', 'meeting_id', 'passcode'] if event_type in no_teacher_events else ['date', 'teacher_name', 'meeting_id', 'passcode'])
-        elif event_type in event_specific_required:
-            required_fields = basic_required + event_specific_required[event_type]
-        else:
-            required_fields = basic_required + (['date'] if event_type in no_teacher_events else ['date', 'teacher_name'])
-        for field in required_fields:
-            if field not in event_data or not str(event_data[field]).strip():
-                errors.append(f"必須項目 '{field}' が不足しています")
+        event_type = str(event_data.get('event_type') or '').strip()
+        for field in required_fields_for(event_type):
+            value = event_data.get(field)
+            if value is None or not str(value).strip():
+                errors.append(_missing_message(field))
         return len(errors) == 0, errors
+
+    def validate_columns(self, columns: Dict[str, Sequence]) -> tuple[list[bool], Dict[int, list[str]]]:
+        """
+        列形式（{"event_type": [...], "date": [...], ...}）の予定をまとめてチェックする。
+        値が None のセルは「項目なし」として扱う。
+        戻り値: (行ごとの合否リスト, {行番号: エラー一覧})
+        """
+        n = len(columns.get('event_type', ()))
+        types = columns.get('event_type', ())
+        groups: Dict[str, list] = {}
+        for i in range(n):
+            groups.setdefault(str(types[i] or '').strip(), []).append(i)
+        failures: Dict[int, list[str]] = {}
+        for event_type, idxs in groups.items():
+            for field in required_fields_for(event_type):
+                col = columns.get(field)
+                message = _missing_message(field)
+                for i in idxs:
+                    value = None if col is None else col[i]
+                    if value is None or not str(value).strip():
+                        failures.setdefault(i, []).append(message)
+        ok = [i not in failures for i in range(n)]
+        return ok, {i: failures[i] for i in sorted(failures)}
+
+    def validate_many(self, events: Sequence[Dict]) -> tuple[list[bool], Dict[int, list[str]]]:
+        """予定（辞書）のリストをまとめてチェックする。結果は validate_columns と同じ形"""
+        return self.validate_columns(events_to_columns(events))
+
+
+def required_fields_for(event_type: str) -> tuple:
+    """イベント種別の必須項目（templates/event_types.json の定義と固定Zoomの有無から。結果は表にキャッシュ）"""
+    return get_registry().required_fields(event_type, event_type in config.FIXED_ZOOM_INFO)
+
+
+def _missing_message(field: str) -> str:
+    return f"必須項目 '{field}' が不足しています"
+
+
+def events_to_columns(events: Sequence[Dict]) -> Dict[str, list]:
+    """予定（辞書）のリストを列形式にする。ない項目は None"""
+    keys = set()
+    for ev in events:
+        keys.update(ev.keys())
+    return {k: [ev.get(k) if k in ev else None for ev in events] for k in keys} if events else {'event_type': []}
@@ -7,7 +7,7 @@ GoogleカレンダーAPI連携モジュール
 
 import re
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
 
 try:
     from google.oauth2.credentials import Credentials
@@ -20,7 +20,25 @@ except ImportError:
     GOOGLE_API_AVAILABLE = False
 
 
+import config
+from calendar_requests import CalendarApiError, execute as execute_request, execute_batch
+
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+# 一括生成の行をスプレッドシートに送る設定のときだけ、スプレッドシートの編集も求める
+SHEETS_SCOPE = "https://www.googleapis.com/auth/spreadsheets"
+if config.SHEET_PUSH_SPREADSHEET_ID:
+    SCOPES.append(SHEETS_SCOPE)
+
+# events.list で取得する予定の項目（api_event_to_event_data と キャッシュの etag が使うもの）
+# 参加者・会議情報・リマインダーなどは取得しない。後段で必要な項目は extra_fields で追加する
+EVENT_FIELDS = ("id", "etag", "summary", "description", "start")
+CALENDAR_LIST_FIELDS = "items(id,summary)"
+# 繰り返し予定を手元で展開するときに追加で取得する項目
+RECURRENCE_FIELDS = ["recurrence", "recurringEventId", "originalStartTime", "status"]
+# HTTPバッチのパス（APIのルートURLからの相対）
+CALENDAR_BATCH_PATH = "batch/calendar/v3"
+# fetch_batch の結果でカレンダー一覧を表すキー
+CALENDAR_LIST_KEY = "calendarList"
 
 
 def _get_flow(redirect_uri: str, client_id: str = None, client_secret: str = None):
@@ -77,7 +95,7 @@ def get_authorization_url(redirect_uri: str) -> Optional[str]:
     return auth_url
 
 
-def exchange_code_for_credentials(redirect_uri: str, code: str) -> Optional[Credentials]:
+def exchange_code_for_credentials(redirect_uri: str, code: str) -> Optional["Credentials"]:
     if not GOOGLE_API_AVAILABLE:
         return None
     flow = _get_flow(redirect_uri)
@@ -95,13 +113,29 @@ def credentials_to_dict(creds: "Credentials") -> Dict:
         "client_id": creds.client_id,
         "client_secret": creds.client_secret,
         "scopes": creds.scopes,
+        "expiry": creds.expiry.isoformat() if getattr(creds, "expiry", None) else None,
     }
 
 
+def credentials_account_key(d: Dict) -> str:
+    """連携アカウントを区別するキー（トークンそのものは保持しない）"""
+    import hashlib
+    secret = (d or {}).get("refresh_token") or (d or {}).get("token") or ""
+    return hashlib.sha1(secret.encode("utf-8")).hexdigest()[:16]
+
+
+def _account_key_of(credentials) -> str:
+    """Credentials から呼び出し制御用のアカウントキーを作る"""
+    return credentials_account_key({
+        "refresh_token": getattr(credentials, "refresh_token", None),
+        "token": getattr(credentials, "token", None),
+    })
+
+
 def dict_to_credentials(d: Dict) -> Optional["Credentials"]:
     if not GOOGLE_API_AVAILABLE or not d:
         return None
-    return Credentials(
+    creds = Credentials(
         token=d.get("token"),
         refresh_token=d.get("refresh_token"),
         token_uri=d.get("token_uri", "https://oauth2.googleapis.com/token"),
@@ -109,6 +143,13 @@ def dict_to_credentials(d: Dict) -> Optional["Credentials"]:
         client_secret=d.get("client_secret"),
         scopes=d.get("scopes", SCOPES),
     )
+    # 有効期限（UTC・タイムゾーンなし）を復元し、期限切れ前の更新に使う
+    if d.get("expiry"):
+        try:
+            creds.expiry = datetime.fromisoformat(d["expiry"]).replace(tzinfo=None)
+        except (ValueError, TypeError):
+            pass
+    return creds
 
 
 def refresh_credentials_if_needed(creds: "Credentials") -> tuple:
@@ -129,12 +170,96 @@ def refresh_credentials_if_needed(creds: "Credentials") -> tuple:
     return (creds, None)
 
 
+def is_excluded_event(api_event: Dict, exclude_titles=None) -> bool:
+    """タイトルなし、または除外タイトル（部分一致）に当たる予定なら True"""
+    summary = (api_event.get("summary") or "").strip()
+    if not summary:
+        return True
+    return any(exc in summary for exc in (exclude_titles or []))
+
+
+def convert_api_event(api_event: Dict, parse_event_name_fn, series_memo: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    1件を event_data に変換し、_id に予定IDを入れる。
+    手元で展開した繰り返し予定（_series あり）は、予定名・説明文の解析結果をシリーズごとに series_memo で使い回す。
+    """
+    series = api_event.get("_series")
+    if series and series_memo is not None:
+        key = tuple(series)
+        base = series_memo.get(key)
+        if base is None:
+            base = series_memo[key] = api_event_to_event_data(api_event, parse_event_name_fn)
+        ed = dict(base)
+        ed["date"], ed["time"] = _format_date_time(api_event.get("start", {}))
+    else:
+        ed = api_event_to_event_data(api_event, parse_event_name_fn)
+    ed["_id"] = api_event.get("id", "")
+    return ed
+
+
+def convert_api_events(api_events: List[Dict], parse_event_name_fn, exclude_titles=None) -> List[Dict[str, Any]]:
+    """APIの予定一覧を event_data のリストに変換する（除外対象は飛ばし、_id に予定IDを入れる）"""
+    series_memo: Dict = {}
+    return [
+        convert_api_event(ev, parse_event_name_fn, series_memo)
+        for ev in api_events
+        if not is_excluded_event(ev, exclude_titles)
+    ]
+
+
+# カレンダーAPIのクライアントを作った回数（負荷試験用）
+service_stats = {"builds": 0}
+
+
 def get_calendar_service(credentials: "Credentials"):
     if not GOOGLE_API_AVAILABLE:
         return None
+    service_stats["builds"] += 1
+    root_url = config.CALENDAR_API_ROOT_URL
+    if root_url:
+        return build(
+            "calendar", "v3", credentials=credentials,
+            client_options={"api_endpoint": root_url.rstrip("/") + "/calendar/v3/"},
+        )
     return build("calendar", "v3", credentials=credentials)
 
 
+def _new_batch(service):
+    """
+    空の BatchHttpRequest を作る。
+    接続先を差し替えている場合、service.new_batch_http_request() はディスカバリ文書の rootUrl（Google）を
+    向いたままなので、バッチのURLも同じ接続先にする。
+    """
+    root_url = config.CALENDAR_API_ROOT_URL
+    if root_url:
+        from googleapiclient.http import BatchHttpRequest
+        return BatchHttpRequest(batch_uri=root_url.rstrip("/") + "/" + CALENDAR_BATCH_PATH)
+    return service.new_batch_http_request()
+
+
+def events_fields_param(extra_fields=None) -> str:
+    """events.list の fields= パラメータ（必要な項目だけを返させる部分レスポンス）"""
+    fields = list(EVENT_FIELDS)
+    for f in extra_fields or []:
+        if f not in fields:
+            fields.append(f)
+    return f"nextPageToken,items({','.join(fields)})"
+
+
+def _with_gzip(request):
+    """
+    gzip 転送を要求する（Google API は Accept-Encoding と User-Agent の両方に gzip が必要）。
+    google-api-python-client も既定で付けるが、バージョンに依らないよう明示する。
+    """
+    headers = getattr(request, "headers", None)
+    if headers is not None:
+        headers["accept-encoding"] = "gzip"
+        ua = headers.get("user-agent", "")
+        if "gzip" not in ua:
+            headers["user-agent"] = f"{ua} (gzip)".strip()
+    return request
+
+
 def fetch_calendar_list(credentials: "Credentials") -> List[Dict]:
     """
     アクセス可能なカレンダー一覧を取得する。
@@ -146,10 +271,11 @@ def fetch_calendar_list(credentials: "Credentials") -> List[Dict]:
         service = get_calendar_service(credentials)
         if service is None:
             return []
-        result = service.calendarList().list().execute()
+        request = _with_gzip(service.calendarList().list(fields=CALENDAR_LIST_FIELDS))
+        result = execute_request(request, _account_key_of(credentials))
         items = result.get("items", [])
         return [{"id": it.get("id", ""), "summary": it.get("summary", it.get("id", ""))} for it in items]
-    except HttpError as e:
+    except (HttpError, CalendarApiError) as e:
         raise e
     except Exception:
         return []
@@ -160,7 +286,14 @@ def fetch_upcoming_events(
     calendar_id: str = "primary",
     max_results: int = 250,
     days_ahead: int = 31,
+    extra_fields: Optional[List[str]] = None,
+    expand_recurring_locally: bool = False,
 ) -> List[Dict]:
+    """
+    今から days_ahead 日分の予定を取得する。
+    取得する項目は EVENT_FIELDS のみ（部分レスポンス・gzip）。後段で他の項目が必要なら extra_fields で指定する。
+    expand_recurring_locally=True の場合は繰り返しの元予定と例外だけを取得し、手元で開催ごとに展開する。
+    """
     if not GOOGLE_API_AVAILABLE:
         return []
     try:
@@ -171,25 +304,197 @@ def fetch_upcoming_events(
         time_min = now.isoformat() + "Z"
         from datetime import timedelta
         time_max = (now + timedelta(days=days_ahead)).isoformat() + "Z"
-        events_result = (
-            service.events()
-            .list(
-                calendarId=calendar_id,
-                timeMin=time_min,
-                timeMax=time_max,
-                maxResults=max_results,
-                singleEvents=True,
-                orderBy="startTime",
+        if expand_recurring_locally:
+            return _fetch_and_expand_recurring(
+                service, credentials, calendar_id, time_min, time_max, max_results, extra_fields
             )
-            .execute()
+        request = service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            maxResults=max_results,
+            singleEvents=True,
+            orderBy="startTime",
+            fields=events_fields_param(extra_fields),
         )
+        events_result = execute_request(_with_gzip(request), _account_key_of(credentials))
         return events_result.get("items", [])
-    except HttpError as e:
+    except (HttpError, CalendarApiError) as e:
         raise e
     except Exception:
         return []
 
 
+def iter_event_pages(
+    credentials: "Credentials",
+    calendar_id: str = "primary",
+    page_size: int = 250,
+    days_ahead: int = 31,
+    extra_fields: Optional[List[str]] = None,
+) -> Iterator[List[Dict]]:
+    """
+    今から days_ahead 日分の予定を、1ページ（最大 page_size 件）ずつ返す（nextPageToken をたどる）。
+    次のページは前のページを受け取った側が次を求めたときに取得するので、後段の処理と並べて使える。
+    """
+    if not GOOGLE_API_AVAILABLE:
+        return
+    service = get_calendar_service(credentials)
+    if service is None:
+        return
+    time_min, time_max = _time_window(days_ahead)
+    account_key = _account_key_of(credentials)
+    page_token = None
+    while True:
+        request = service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            maxResults=page_size,
+            singleEvents=True,
+            orderBy="startTime",
+            pageToken=page_token,
+            fields=events_fields_param(extra_fields),
+        )
+        result = execute_request(_with_gzip(request), account_key)
+        yield result.get("items", [])
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def _time_window(days_ahead: int, days_from: int = 0) -> tuple:
+    """今から days_from 日後〜days_ahead 日後の timeMin / timeMax（RFC3339, UTC）"""
+    from datetime import timedelta
+    now = datetime.utcnow()
+    return (
+        (now + timedelta(days=days_from)).isoformat() + "Z",
+        (now + timedelta(days=days_ahead)).isoformat() + "Z",
+    )
+
+
+def fetch_batch(
+    credentials: "Credentials",
+    queries: Dict[str, Dict[str, Any]],
+    include_calendar_list: bool = False,
+    max_results: int = 250,
+    extra_fields: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    複数の events.list（と calendarList.list）を HTTPバッチ1往復にまとめて取得する。
+    queries は {キー: {"calendar_id": ..., "time_min": ..., "time_max": ...}}。
+    同じカレンダーを期間を分けて取る場合はキーを分ける。time_min / time_max を省略すると今から31日分。
+    次のページがある呼び出しは、まとめて次のバッチで取得する。
+
+    戻り値: {
+        "calendar_list": [{"id", "summary"}, ...] または None,
+        "events": {キー: events.list の items},
+        "errors": {キー（カレンダー一覧は CALENDAR_LIST_KEY）: 例外},
+    }
+    失敗した呼び出しは events に含めず errors に入れる（他の呼び出しの結果はそのまま返す）。
+    """
+    out: Dict[str, Any] = {"calendar_list": None, "events": {}, "errors": {}}
+    if not GOOGLE_API_AVAILABLE:
+        return out
+    service = get_calendar_service(credentials)
+    if service is None:
+        return out
+    account_key = _account_key_of(credentials)
+    fields = events_fields_param(extra_fields)
+    default_min, default_max = _time_window(31)
+
+    def events_request(query: Dict[str, Any], page_token: Optional[str]):
+        return _with_gzip(service.events().list(
+            calendarId=query.get("calendar_id", "primary"),
+            timeMin=query.get("time_min") or default_min,
+            timeMax=query.get("time_max") or default_max,
+            maxResults=max_results,
+            singleEvents=True,
+            orderBy="startTime",
+            pageToken=page_token,
+            fields=fields,
+        ))
+
+    requests = {key: events_request(q, None) for key, q in queries.items()}
+    if include_calendar_list:
+        requests[CALENDAR_LIST_KEY] = _with_gzip(service.calendarList().list(fields=CALENDAR_LIST_FIELDS))
+    for key in queries:
+        out["events"][key] = []
+
+    while requests:
+        results = execute_batch(lambda: _new_batch(service), requests, account_key)
+        requests = {}
+        for key, (response, error) in results.items():
+            if error is not None:
+                out["errors"][key] = error
+                out["events"].pop(key, None)
+                continue
+            response = response or {}
+            if key == CALENDAR_LIST_KEY:
+                out["calendar_list"] = [
+                    {"id": it.get("id", ""), "summary": it.get("summary", it.get("id", ""))}
+                    for it in response.get("items", [])
+                ]
+                continue
+            out["events"][key].extend(response.get("items", []))
+            if response.get("nextPageToken"):
+                requests[key] = events_request(queries[key], response["nextPageToken"])
+    return out
+
+
+def fetch_events_batch(
+    credentials: "Credentials",
+    calendar_ids: List[str],
+    max_results: int = 250,
+    days_ahead: int = 31,
+    include_calendar_list: bool = False,
+) -> Dict[str, Any]:
+    """複数カレンダーの days_ahead 日分の予定を1往復で取得する（キーはカレンダーID）"""
+    time_min, time_max = _time_window(days_ahead)
+    queries = {cid: {"calendar_id": cid, "time_min": time_min, "time_max": time_max} for cid in calendar_ids}
+    return fetch_batch(credentials, queries, include_calendar_list=include_calendar_list, max_results=max_results)
+
+
+def _fetch_and_expand_recurring(service, credentials, calendar_id, time_min, time_max, max_results, extra_fields):
+    """singleEvents=False で元予定・例外を取得し、recurrence.expand_recurring_events で展開する"""
+    from datetime import timezone
+    from recurrence import expand_recurring_events
+
+    account_key = _account_key_of(credentials)
+    fields = events_fields_param(list(extra_fields or []) + RECURRENCE_FIELDS)
+    items: List[Dict] = []
+    page_token = None
+    while True:
+        request = service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            maxResults=max_results,
+            singleEvents=False,
+            pageToken=page_token,
+            fields=fields,
+        )
+        result = execute_request(_with_gzip(request), account_key)
+        items.extend(result.get("items", []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            break
+
+    def server_instances(master: Dict) -> List[Dict]:
+        # 手元で展開できない規則はサーバーで展開した回を使う
+        request = service.events().instances(
+            calendarId=calendar_id,
+            eventId=master.get("id", ""),
+            timeMin=time_min,
+            timeMax=time_max,
+            fields=events_fields_param(extra_fields),
+        )
+        return execute_request(_with_gzip(request), account_key).get("items", [])
+
+    window_start = datetime.fromisoformat(time_min[:-1]).replace(tzinfo=timezone.utc)
+    window_end = datetime.fromisoformat(time_max[:-1]).replace(tzinfo=timezone.utc)
+    return expand_recurring_events(items, window_start, window_end, server_instances)
+
+
 def _extract_instagram_from_description(description: str) -> str:
     """InstagramのURLのみ抽出（Zoomリンクは含めない。Zoomリンクの手前で区切る）"""
     if not description:
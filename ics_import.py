@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+iCalendar（.ics）ファイルからの予定の取り込み
+
+Googleカレンダーなどから書き出した .ics を読み、APIの予定と同じ形の辞書にしてから
+google_calendar_client.convert_api_event（parse_event_name・説明文からのInstagram／講師名の抽出）で event_data にします。
+OAuth連携なしで、同じ月の予定から告知文を一括生成できます。
+
+- 行の折り返し（RFC 5545。CRLF＋空白/タブで続く行）はバイト列のまま戻してから UTF-8 として読むので、
+  複数バイトの文字の途中で折り返されていても文字化けしません
+- ファイルは1行ずつ読み、単発の予定はその場で変換して返します（何年分の書き出しでも、保持するのは今の1件だけ）
+- 繰り返し予定（RRULE）と、その変更・キャンセルされた回（RECURRENCE-ID）だけは最後まで読んでから
+  recurrence.expand_recurring_events で期間内の開催に展開します（保持するのは繰り返しの元予定と例外の数だけ）
+
+使い方:
+    python ics_import.py calendar.ics --from 2025-03-01 --days 31
+    python ics_import.py calendar.ics --from 2025-03-01 --days 31 --format bulk-csv --out 告知文一覧.csv
+    python ics_import.py calendar.ics --all > events.jsonl
+"""
+
+import argparse
+import json
+import sys
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import config
+from google_calendar_client import convert_api_event, is_excluded_event
+from parse_calendar import parse_event_name
+from recurrence import expand_recurring_events, instance_id, parse_ical_datetime, start_of, tz_from_name
+
+# VEVENT の中で使う項目（それ以外は読み飛ばす）
+_VEVENT_PROPS = frozenset([
+    "UID", "SUMMARY", "DESCRIPTION", "DTSTART", "STATUS", "RECURRENCE-ID", "SEQUENCE", "LAST-MODIFIED", "DTSTAMP",
+])
+# 繰り返しの規則・除外日（行のまま recurrence に渡す）
+_RECURRENCE_PROPS = frozenset(["RRULE", "EXDATE", "RDATE"])
+
+_TEXT_ESCAPES = {"n": "\n", "N": "\n", ",": ",", ";": ";", "\\": "\\"}
+
+
+def unfold_lines(lines: Iterable[Union[bytes, str]]) -> Iterator[str]:
+    """
+    折り返された行を1行に戻して返す（行末の改行は除く）。
+    バイト列の行（"rb" で開いたファイル・アップロードされたファイル）は戻してから UTF-8 で読む。
+    """
+    parts: List = []
+    first = True
+    for raw in lines:
+        line = raw.rstrip(b"\r\n") if isinstance(raw, bytes) else raw.rstrip("\r\n")
+        if first:
+            line = line.lstrip(b"\xef\xbb\xbf") if isinstance(line, bytes) else line.lstrip("\ufeff")
+            first = False
+        if line[:1] in (b" ", b"\t", " ", "\t") and parts:
+            parts.append(line[1:])
+            continue
+        if parts:
+            yield _join(parts)
+        parts = [line] if line else []
+    if parts:
+        yield _join(parts)
+
+
+def _join(parts: List) -> str:
+    if isinstance(parts[0], bytes):
+        return b"".join(parts).decode("utf-8", errors="replace")
+    return "".join(parts)
+
+
+def parse_property(line: str) -> Tuple[str, Dict[str, str], str]:
+    """
+    'DTSTART;TZID=Asia/Tokyo:20250304T210000' → ("DTSTART", {"TZID": "Asia/Tokyo"}, "20250304T210000")
+    引用符（"..."）で囲まれたパラメータ内の : と ; は区切りとみなさない。
+    """
+    colon = line.find(":")
+    if colon < 0:
+        return line.upper(), {}, ""
+    if '"' not in line[:colon]:
+        head, value = line[:colon], line[colon + 1:]
+        fields = head.split(";")
+    else:
+        fields, buf, quoted = [], [], False
+        for i, ch in enumerate(line):
+            if ch == '"':
+                quoted = not quoted
+            elif not quoted and ch in ";:":
+                fields.append("".join(buf))
+                buf = []
+                if ch == ":":
+                    value = line[i + 1:]
+                    break
+                continue
+            buf.append(ch)
+        else:
+            fields.append("".join(buf))
+            value = ""
+    params = {}
+    for field in fields[1:]:
+        key, _, v = field.partition("=")
+        params[key.upper()] = v.strip('"')
+    return fields[0].upper(), params, value
+
+
+def unescape_text(value: str) -> str:
+    """TEXT の値のエスケープ（\\n \\, \\; \\\\）を戻す"""
+    if "\\" not in value:
+        return value
+    out, i = [], 0
+    while i < len(value):
+        ch = value[i]
+        if ch == "\\" and i + 1 < len(value):
+            out.append(_TEXT_ESCAPES.get(value[i + 1], value[i + 1]))
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def iter_vevents(lines: Iterable[str], calendar_props: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    折り返しを戻した行から VEVENT を1件ずつ返す。
+    値は {項目名: (パラメータ, 値)}、繰り返しの規則・除外日は "_recurrence" に行のまま入れる。
+    VEVENT の外の項目（X-WR-TIMEZONE など）は calendar_props に入れる。VALARM などの中身は読み飛ばす。
+    """
+    event: Optional[Dict[str, Any]] = None
+    nested = 0
+    for line in lines:
+        name, params, value = parse_property(line)
+        if name == "BEGIN":
+            if event is not None:
+                nested += 1
+            elif value.upper() == "VEVENT":
+                event, nested = {"_recurrence": []}, 0
+            continue
+        if name == "END":
+            if event is not None:
+                if nested:
+                    nested -= 1
+                elif value.upper() == "VEVENT":
+                    yield event
+                    event = None
+            continue
+        if event is None:
+            if calendar_props is not None and name.startswith("X-WR-"):
+                calendar_props[name] = value
+        elif nested:
+            continue
+        elif name in _RECURRENCE_PROPS:
+            event["_recurrence"].append(line)
+        elif name in _VEVENT_PROPS and name not in event:
+            event[name] = (params, value)
+
+
+def _parse_dt(prop: Optional[Tuple[Dict[str, str], str]], tz) -> Union[datetime, date, None]:
+    """DTSTART / RECURRENCE-ID を日時にする。TZID がなければ tz、UTC（Z）は tz に直す"""
+    if not prop:
+        return None
+    params, value = prop
+    try:
+        dt = parse_ical_datetime(value, tz_from_name(params.get("TZID")) or tz)
+    except ValueError:
+        return None
+    if isinstance(dt, datetime) and dt.tzinfo is timezone.utc and tz is not None:
+        dt = dt.astimezone(tz)
+    return dt
+
+
+def _start_payload(start: Union[datetime, date]) -> Dict[str, str]:
+    """APIの start と同じ形（dateTime/timeZone または date）"""
+    if isinstance(start, datetime):
+        payload = {"dateTime": start.isoformat()}
+        tz_key = getattr(start.tzinfo, "key", None)
+        if tz_key:
+            payload["timeZone"] = tz_key
+        return payload
+    return {"date": start.isoformat()}
+
+
+def vevent_to_api_event(vevent: Dict[str, Any], tz=None) -> Optional[Dict[str, Any]]:
+    """VEVENT をAPIの予定と同じ形の辞書にする。開始日時が読めなければ None"""
+    start = _parse_dt(vevent.get("DTSTART"), tz)
+    if start is None:
+        return None
+    uid = vevent.get("UID", ({}, ""))[1]
+    sequence = vevent.get("SEQUENCE", ({}, "0"))[1]
+    modified = (vevent.get("LAST-MODIFIED") or vevent.get("DTSTAMP") or ({}, ""))[1]
+    api_event = {
+        "id": uid,
+        "etag": f"{sequence}-{modified}",
+        "summary": unescape_text(vevent.get("SUMMARY", ({}, ""))[1]),
+        "description": unescape_text(vevent.get("DESCRIPTION", ({}, ""))[1]),
+        "start": _start_payload(start),
+        "status": "cancelled" if vevent.get("STATUS", ({}, ""))[1].upper() == "CANCELLED" else "confirmed",
+    }
+    original = _parse_dt(vevent.get("RECURRENCE-ID"), tz)
+    if original is not None:
+        api_event["id"] = instance_id(uid, original)
+        api_event["recurringEventId"] = uid
+        api_event["originalStartTime"] = _start_payload(original)
+    elif any(r[:5].upper() == "RRULE" for r in vevent["_recurrence"]):
+        api_event["recurrence"] = list(vevent["_recurrence"])
+    return api_event
+
+
+def _as_aware(value: Union[datetime, date], tz) -> datetime:
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time.min)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz or timezone.utc)
+    return value
+
+
+def iter_ics_events(
+    lines: Iterable[Union[bytes, str]],
+    window_start: Optional[datetime] = None,
+    window_end: Optional[datetime] = None,
+    default_tz: str = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    .ics の行から、期間内（window_start 以上・window_end 未満。None なら制限なし）のAPI形式の予定を返す。
+    単発の予定はファイルの順にその場で返し、繰り返し予定は最後に展開して開始日時順に返す。
+    期間の終わりを指定しない場合、終わりのない繰り返しは recurrence の展開回数の上限まで展開する。
+    手元で展開できない繰り返し（BYSETPOS など）は返さず、stats の skipped と unexpanded（シリーズの数）に数える。
+    """
+    stats = stats if stats is not None else {}
+    for key in ("vevents", "events", "recurring", "skipped", "unexpanded"):
+        stats.setdefault(key, 0)
+    calendar_props: Dict[str, str] = {}
+    recurring: List[Dict[str, Any]] = []
+    tz = None
+    ws = we = None
+
+    def in_window(start) -> bool:
+        if start is None:
+            return False
+        s = _as_aware(start, tz)
+        return (ws is None or s >= ws) and (we is None or s < we)
+
+    for vevent in iter_vevents(unfold_lines(lines), calendar_props):
+        stats["vevents"] += 1
+        if tz is None:
+            # カレンダーのタイムゾーン（X-WR-TIMEZONE）は最初の VEVENT より前にある
+            tz = tz_from_name(calendar_props.get("X-WR-TIMEZONE") or default_tz or config.ICS_DEFAULT_TIMEZONE)
+            ws = _as_aware(window_start, tz) if window_start is not None else None
+            we = _as_aware(window_end, tz) if window_end is not None else None
+        api_event = vevent_to_api_event(vevent, tz)
+        if api_event is None:
+            stats["skipped"] += 1
+            continue
+        if "recurrence" in api_event or "recurringEventId" in api_event:
+            recurring.append(api_event)
+            continue
+        if api_event["status"] != "cancelled" and in_window(start_of(api_event["start"])):
+            stats["events"] += 1
+            yield api_event
+
+    stats["recurring"] = sum(1 for ev in recurring if "recurrence" in ev)
+    unexpanded: List[Dict[str, Any]] = []
+    expanded = expand_recurring_events(recurring, ws, we, unexpanded=unexpanded)
+    stats["unexpanded"] += len(unexpanded)
+    stats["skipped"] += len(unexpanded)
+    for api_event in expanded:
+        if in_window(start_of(api_event.get("start", {}) or {})):
+            stats["events"] += 1
+            yield api_event
+
+
+def iter_ics_event_data(
+    lines: Iterable[Union[bytes, str]],
+    window_start: Optional[datetime] = None,
+    window_end: Optional[datetime] = None,
+    exclude_titles=None,
+    default_tz: str = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """.ics の行から event_data を1件ずつ返す（除外タイトルは飛ばす。繰り返し予定の解析はシリーズごとに1回）"""
+    series_memo: Dict = {}
+    for api_event in iter_ics_events(lines, window_start, window_end, default_tz, stats):
+        if not is_excluded_event(api_event, exclude_titles):
+            yield convert_api_event(api_event, parse_event_name, series_memo)
+
+
+def _start_sort_key(api_event: Dict[str, Any]) -> tuple:
+    start = start_of(api_event.get("start", {}) or {})
+    if start is None:
+        return (1, 0.0)
+    return (0, _as_aware(start, timezone.utc).timestamp())
+
+
+def load_ics_events(
+    lines: Iterable[Union[bytes, str]],
+    window_start: Optional[datetime] = None,
+    window_end: Optional[datetime] = None,
+    exclude_titles=None,
+    default_tz: str = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """期間内の予定を開始日時順の event_data のリストにする（画面・一括生成用。期間分だけ保持する）"""
+    api_events = sorted(iter_ics_events(lines, window_start, window_end, default_tz, stats), key=_start_sort_key)
+    series_memo: Dict = {}
+    return [
+        convert_api_event(ev, parse_event_name, series_memo)
+        for ev in api_events
+        if not is_excluded_event(ev, exclude_titles)
+    ]
+
+
+def month_window(start_day: date, days: int, tz_name: str = None) -> Tuple[datetime, datetime]:
+    """start_day 0:00 から days 日分の期間（カレンダーのタイムゾーン）"""
+    tz = tz_from_name(tz_name or config.ICS_DEFAULT_TIMEZONE) or timezone.utc
+    ws = datetime.combine(start_day, time.min).replace(tzinfo=tz)
+    return ws, ws + timedelta(days=days)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="iCalendar（.ics）ファイルから予定を取り込む")
+    parser.add_argument("ics", help=".ics ファイルのパス（- で標準入力）")
+    parser.add_argument("--from", dest="date_from", help="期間の開始日（YYYY-MM-DD。省略時は今日）")
+    parser.add_argument("--days", type=int, default=31, help="期間の日数")
+    parser.add_argument("--all", action="store_true", help="期間で絞り込まない（繰り返し予定は展開回数の上限まで）")
+    parser.add_argument("--tz", help=f"X-WR-TIMEZONE がないときのタイムゾーン（既定: {config.ICS_DEFAULT_TIMEZONE}）")
+    parser.add_argument("--format", choices=["jsonl", "bulk-csv"], default="jsonl",
+                        help="jsonl: event_data を1行ずつ / bulk-csv: 一括生成の行（A〜D列）")
+    parser.add_argument("--out", help="出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    window: Tuple[Optional[datetime], Optional[datetime]] = (None, None)
+    if not args.all:
+        start_day = date.fromisoformat(args.date_from) if args.date_from else date.today()
+        window = month_window(start_day, args.days, args.tz)
+    stats: Dict[str, int] = {}
+    source = sys.stdin.buffer if args.ics == "-" else open(args.ics, "rb")
+    out = open(args.out, "w", encoding="utf-8-sig" if args.format == "bulk-csv" else "utf-8", newline="") \
+        if args.out else sys.stdout
+    try:
+        if args.format == "jsonl":
+            for ed in iter_ics_event_data(source, *window, config.CALENDAR_EXCLUDE_TITLES, args.tz, stats):
+                out.write(json.dumps(ed, ensure_ascii=False) + "\n")
+        else:
+            from bulk_export import build_bulk_rows, rows_to_csv
+            from generate_announcement import AnnouncementGenerator
+
+            events = load_ics_events(source, *window, config.CALENDAR_EXCLUDE_TITLES, args.tz, stats)
+            out.write(rows_to_csv(build_bulk_rows(events, AnnouncementGenerator())))
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"VEVENT {stats['vevents']}件 → 予定 {stats['events']}件（繰り返し {stats['recurring']}件、"
+          f"読めなかった予定 {stats['skipped']}件）", file=sys.stderr)
+    if stats["unexpanded"]:
+        print(f"警告: 展開できない繰り返し予定が {stats['unexpanded']}件あり、その開催は含まれていません"
+              f"（Googleカレンダーから連携して取得してください）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Streamlit アプリの負荷試験
+
+Streamlit の AppTest で app.py を画面なしで動かし、N 人のオペレーターが同時に
+「予定を取得」「一括生成」「月全体の案内文」「テンプレート編集」を押す状況を再現します。
+カレンダーはローカルのスタブ（calendar_stub.py）を使うので、Googleには接続しません。
+
+AppTest は再実行のたびに Runtime・secrets・設定などプロセス全体の状態を差し替え、スクリプトを compile し直すので、
+同じプロセスの複数スレッドで同時に再実行すると壊れます（Runtime hasn't been created! や
+SystemError: AST constructor recursion depth mismatch）。そのため各セッションの再実行は1回ずつ順番に行い、
+応答時間には順番待ちを含めません（待ち時間は別に報告）。事前生成ワーカー・トークン更新など裏のスレッドは並んで動きます。
+
+報告する内容:
+- 操作ごとの応答時間（p50 / p95 / 最大）
+- 1セッションあたりのメモリ（tracemalloc の増分 ÷ セッション数、セッション状態の大きさ。pickle できない項目は名前を報告）
+- 再実行1回あたりの無駄な処理（生成器・テンプレートの読み込み、APIクライアントの作成、API呼び出し）
+
+使い方:
+    python load_test.py --sessions 8 --rounds 3
+    python load_test.py --sessions 8 --shared-account --json result.json
+"""
+
+import argparse
+import json
+import os
+import pickle
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+import config
+
+try:
+    from streamlit.testing.v1 import AppTest
+    STREAMLIT_TESTING_AVAILABLE = True
+except ImportError:
+    STREAMLIT_TESTING_AVAILABLE = False
+
+FETCH_LABEL = "📅 予定を取得（1ヶ月分）"
+
+# AppTest の再実行はプロセスで1つずつ（モジュールの説明を参照）
+_RUN_LOCK = threading.Lock()
+
+
+class LoadStats:
+    """操作ごとの応答時間と再実行回数（スレッド間で共有）"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.waits: List[float] = []
+        self.reruns = 0
+        self.errors: List[str] = []
+        self._lock = threading.Lock()
+
+    def record(self, interaction: str, latency: float, wait: float, at) -> None:
+        with self._lock:
+            self.latencies.setdefault(interaction, []).append(latency)
+            self.waits.append(wait)
+            self.reruns += 1
+            for exc in getattr(at, "exception", []) or []:
+                self.errors.append(f"{interaction}: {getattr(exc, 'message', exc)}")
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for name, values in self.latencies.items():
+            values = sorted(values)
+            out[name] = {
+                "count": len(values),
+                "p50_ms": _percentile(values, 0.5) * 1e3,
+                "p95_ms": _percentile(values, 0.95) * 1e3,
+                "max_ms": values[-1] * 1e3,
+            }
+        return out
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def _fake_credentials(session_no: int, shared_account: bool) -> Dict[str, Any]:
+    """スタブ用の連携情報。期限を先にしておき、トークン更新（Googleへの接続）が起きないようにする"""
+    account = 0 if shared_account else session_no
+    return {
+        "token": f"stub-token-{account}",
+        "refresh_token": f"stub-refresh-{account}",
+        "token_uri": "http://127.0.0.1/token",
+        "client_id": "stub",
+        "client_secret": "stub",
+        "scopes": ["https://www.googleapis.com/auth/calendar.readonly"],
+        "expiry": (datetime.utcnow() + timedelta(days=1)).isoformat(),
+    }
+
+
+def _find_button(at, label: str = None, key: str = None):
+    for b in at.button:
+        if (key is not None and b.key == key) or (label is not None and b.label == label):
+            return b
+    raise LookupError(f"ボタンが見つかりません: {label or key}")
+
+
+def _timed(stats: LoadStats, name: str, at, action=None) -> None:
+    queued = time.perf_counter()
+    with _RUN_LOCK:
+        started = time.perf_counter()
+        if action is not None:
+            action()
+        at.run()
+        latency = time.perf_counter() - started
+    stats.record(name, latency, started - queued, at)
+
+
+def _pickled_size(name: str, value: Any, unpicklable: List[str]) -> int:
+    """value を pickle した大きさ。pickle できない辞書は項目ごとに測り、測れなかった項目の名前を unpicklable に足す"""
+    try:
+        return len(pickle.dumps(value))
+    except Exception as e:
+        if isinstance(value, dict):
+            return sum(_pickled_size(f"{name}.{k}", v, unpicklable) for k, v in value.items())
+        unpicklable.append(f"{name}（{type(e).__name__}）")
+        return 0
+
+
+def session_state_size(at) -> Tuple[int, List[str]]:
+    """セッション状態を pickle した大きさ（バイト）と、pickle できなかった項目の名前"""
+    size, unpicklable = 0, []
+    for key in sorted(at.session_state.keys(), key=str):
+        size += _pickled_size(str(key), at.session_state[key], unpicklable)
+    return size, unpicklable
+
+
+def run_session(session_no: int, rounds: int, stats: LoadStats, shared_account: bool,
+                timeout: float) -> Tuple[int, List[str]]:
+    """1セッション分の操作を行い、最後のセッション状態の大きさ（session_state_size）を返す"""
+    at = AppTest.from_file("app.py", default_timeout=timeout)
+    at.session_state["google_credentials"] = _fake_credentials(session_no, shared_account)
+    _timed(stats, "load", at)
+    for r in range(rounds):
+        _timed(stats, "fetch", at, lambda: _find_button(at, label=FETCH_LABEL).click())
+        _timed(stats, "bulk", at, lambda: _find_button(at, key="btn_bulk").click())
+        _timed(stats, "overview", at, lambda: _find_button(at, key="btn_monthly").click())
+        # テンプレート編集：1件目を開いて末尾に1行足して保存
+        _timed(stats, "template_open", at, lambda: _find_button(at, key="btn_edit_0").click())
+        body = at.text_area(key="edit_body_0")
+        _timed(stats, "template_save", at, lambda: (
+            body.set_value(f"{body.value}\n（負荷試験 {session_no}-{r}）"),
+            _find_button(at, key="save_edit_0").click(),
+        ))
+        _timed(stats, "bulk_after_edit", at, lambda: _find_button(at, key="btn_bulk").click())
+    return session_state_size(at)
+
+
+def _module_counters() -> Dict[str, int]:
+    """再実行のたびに増える処理の回数"""
+    import generate_announcement
+    import google_calendar_client
+    import template_pack
+    from calendar_requests import get_stats
+
+    api_calls = sum(s["calls"] for s in get_stats().values())
+    return {
+        **{f"templates.{k}": v for k, v in generate_announcement.load_stats.items()},
+        **{f"templates.{k}": v for k, v in template_pack.load_stats.items()},
+        "calendar.service_builds": google_calendar_client.service_stats["builds"],
+        "calendar.api_calls": api_calls,
+    }
+
+
+def run_load_test(sessions: int, rounds: int, shared_account: bool = False, timeout: float = 60,
+                  calendars: int = 1, per_day: int = 4, fail_every: int = 0) -> Dict[str, Any]:
+    from calendar_stub import CalendarStub, sample_events, serve
+
+    stub = CalendarStub({
+        ("primary" if i == 0 else f"stub-{i}@example.com"): {
+            "summary": "メイン" if i == 0 else f"サブ{i}",
+            "items": sample_events(31, per_day),
+        }
+        for i in range(calendars)
+    }, fail_every=fail_every)
+    server = serve(stub)
+    # アプリと同じプロセスで動くので、接続先・キャッシュの場所は設定を書き換えて差し替える
+    config.CALENDAR_API_ROOT_URL = f"http://127.0.0.1:{server.server_port}/"
+    cache_dir = tempfile.mkdtemp(prefix="load_test_")
+    config.EVENT_CACHE_PATH = f"{cache_dir}/events.sqlite3"
+    # テンプレートの編集・生成の履歴・出力の記録も、本番の置き場に書かないように差し替える
+    config.TEMPLATE_STORE_PATH = f"{cache_dir}/templates.sqlite3"
+    config.EXPORT_LEDGER_PATH = f"{cache_dir}/export_ledger.sqlite3"
+    config.ANNOUNCEMENT_ARCHIVE_PATH = f"{cache_dir}/announcement_archive.sqlite3"
+    # secrets.toml がなくても動くように、OAuthの戻り先は環境変数で渡す
+    os.environ.setdefault("REDIRECT_URI", "http://localhost:8501")
+
+    stats = LoadStats()
+    before = _module_counters()
+    tracemalloc.start()
+    mem_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [
+            pool.submit(run_session, i, rounds, stats, shared_account, timeout) for i in range(sessions)
+        ]
+        state_sizes = []
+        unpicklable = set()
+        for f in futures:
+            try:
+                size, keys = f.result()
+            except Exception as e:
+                stats.errors.append(f"session: {e}")
+                continue
+            state_sizes.append(size)
+            unpicklable.update(keys)
+    elapsed = time.perf_counter() - started
+    mem_after, mem_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    after = _module_counters()
+    server.shutdown()
+
+    reruns = max(stats.reruns, 1)
+    redundant = {k: after[k] - before.get(k, 0) for k in after}
+    return {
+        "sessions": sessions,
+        "rounds": rounds,
+        "shared_account": shared_account,
+        "elapsed_sec": elapsed,
+        "reruns": stats.reruns,
+        "latency": stats.summary(),
+        "memory": {
+            "per_session_kb": (mem_after - mem_before) / sessions / 1024,
+            "peak_mb": mem_peak / 1024 / 1024,
+            "session_state_kb": statistics.mean(state_sizes) / 1024 if state_sizes else None,
+            "session_state_unpicklable": sorted(unpicklable),
+        },
+        "run_wait": {
+            "p50_ms": _percentile(sorted(stats.waits), 0.5) * 1e3,
+            "max_ms": max(stats.waits, default=0.0) * 1e3,
+        },
+        "work": {k: {"total": v, "per_rerun": v / reruns} for k, v in redundant.items()},
+        "stub": dict(stub.stats),
+        "errors": stats.errors[:20],
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"セッション {result['sessions']} × {result['rounds']}周  再実行 {result['reruns']}回  "
+          f"{result['elapsed_sec']:.1f}秒")
+    print("\n操作ごとの応答時間（ms）")
+    print(f"  {'操作':<18}{'回数':>6}{'p50':>10}{'p95':>10}{'最大':>10}")
+    for name, s in result["latency"].items():
+        print(f"  {name:<18}{s['count']:>6}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    wait = result["run_wait"]
+    print(f"  （再実行の順番待ち p50 {wait['p50_ms']:.1f} / 最大 {wait['max_ms']:.1f} ms は含まない）")
+    mem = result["memory"]
+    state_kb = mem["session_state_kb"]
+    state_str = "計測できず（完了したセッションなし）" if state_kb is None else f"{state_kb:.0f} KB"
+    print(f"\nメモリ: 1セッションあたり {mem['per_session_kb']:.0f} KB（ピーク {mem['peak_mb']:.1f} MB）、"
+          f"セッション状態 {state_str}")
+    if mem["session_state_unpicklable"]:
+        print(f"  pickle できず大きさに含めていない項目: {', '.join(mem['session_state_unpicklable'])}")
+    print("\n再実行1回あたりの処理")
+    for name, w in result["work"].items():
+        print(f"  {name:<28}{w['total']:>8}{w['per_rerun']:>10.2f}")
+    stub = result["stub"]
+    print(f"\nスタブ: HTTP {stub['http_requests']}回（バッチ {stub['batch_requests']}回）、"
+          f"呼び出し {stub['calls']}回、429 {stub['failures']}回")
+    if result["errors"]:
+        print("\nエラー:")
+        for e in result["errors"]:
+            print(f"  {e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Streamlit アプリの負荷試験（AppTest + カレンダースタブ）")
+    parser.add_argument("--sessions", type=int, default=4, help="同時に動かすセッション数")
+    parser.add_argument("--rounds", type=int, default=2, help="1セッションで操作を繰り返す回数")
+    parser.add_argument("--shared-account", action="store_true", help="全セッションを同じ連携アカウントにする")
+    parser.add_argument("--calendars", type=int, default=1)
+    parser.add_argument("--per-day", type=int, default=4, help="スタブの1日あたりの予定数")
+    parser.add_argument("--fail-every", type=int, default=0, help="スタブが N 回に1回 429 を返す")
+    parser.add_argument("--timeout", type=float, default=60, help="1回の再実行の待ち時間の上限（秒）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+    if not STREAMLIT_TESTING_AVAILABLE:
+        print("streamlit（testing.v1.AppTest）がインストールされていません。", file=sys.stderr)
+        sys.exit(1)
+    result = run_load_test(
+        args.sessions, args.rounds, shared_account=args.shared_account, timeout=args.timeout,
+        calendars=args.calendars, per_day=args.per_day, fail_every=args.fail_every,
+    )
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ import re
 from datetime import datetime
 from typing import Dict, List, Any
 
+from event_registry import get_registry
+
 try:
     import config
     GENRE_EMOJI_MAP = getattr(config, "GENRE_EMOJI_MAP", {})
@@ -104,126 +106,98 @@ def _num(i: int) -> str:
     return "①②③④⑤⑥⑦⑧⑨⑩"[i - 1] if 1 <= i <= 10 else str(i)
 
 
+def guess_month_str(events: List[Dict[str, Any]]) -> str:
+    """先頭の予定の日付から「N月」を返す。日付がなければ今月"""
+    if events and events[0].get("date"):
+        try:
+            parts = str(events[0]["date"]).strip().split("/")
+            return f"{int(parts[0])}月"
+        except (ValueError, IndexError):
+            pass
+    return f"{datetime.now().month}月"
+
+
+def genre_group_key(genre: str) -> str:
+    """ジャンル特化グルコンをまとめるキー（育児・子育ては「育児」、ジャンルなしは「その他」）"""
+    g = genre or "その他"
+    g_key = _genre_base(g) or _EMOJI_STRIP_RE.sub("", str(g)).replace("ジャンル", "").strip()
+    return g_key or "その他"
+
+
+def _section_items(section: Dict[str, Any], group: List[Dict[str, Any]], year: int) -> List[str]:
+    """見出しの中の1件ずつ（開催日・講師名・Instagram）"""
+    fmt = _format_date_short if section.get("date_format") == "short" else _format_date_long
+    lines = []
+    for i, ev in enumerate(group, 1):
+        date_fmt = fmt(ev.get("date", ""), ev.get("time", ""), year)
+        lines.append(f"{_num(i)}開催日：{date_fmt}" if section.get("numbered") else f"開催日：{date_fmt}")
+        lines.append(f"{section.get('teacher_label', '')}{ev.get('teacher_name', '')}")
+        if ev.get("instagram_url"):
+            lines.append(ev["instagram_url"].rstrip("/"))
+        lines.append("")
+    return lines
+
+
 def build_monthly_overview(events: List[Dict[str, Any]], month_str: str) -> str:
     """
     イベント一覧から月全体の案内文を生成する。
-    順序: 特別講義（あれば）→ 講師対談 → 生徒対談 → ジャンル特化グルコン（ジャンルごと・日付順）
+    見出しの順序・書式と、どの種別をどの見出しに載せるかは templates/event_types.json の overview_sections / kinds による。
+    既定は 特別講義（あれば）→ 講師対談 → 生徒対談 → ジャンル特化グルコン（ジャンルごと・日付順）
+    events には列形式の EventTable も渡せる（事前告知の絞り込み・日時順の並べ替えを列で先に行う）。
     """
+    registry = get_registry()
     year = datetime.now().year
-    # 内部用キーを除いたコピーで、1イベント1件（事前告知のみ）
-    clean = []
+    if hasattr(events, "announce_only"):
+        events = events.announce_only().sort_by_start().to_records()
+    announce = f"（{registry.announce_variant}）"
+    # 内部用キーを除いたコピーで、1イベント1件（事前告知のみ）を見出しごとに分ける
+    by_section: Dict[str, List[Dict[str, Any]]] = {s["key"]: [] for s in registry.sections}
     for ed in events:
         ev = {k: v for k, v in ed.items() if not k.startswith("_")}
         et = ev.get("event_type", "")
-        if "（事前告知）" not in et:
+        if announce not in et:
             continue
-        clean.append(ev)
-
-    special = []       # 特別講義
-    instructor = []    # 講師対談
-    student = []      # 生徒対談
-    genre_events = []  # ジャンル特化グルコン
-
-    for ev in clean:
-        et = ev.get("event_type", "")
-        if "特別講義" in et:
-            special.append(ev)
-        elif "講師対談" in et:
-            instructor.append(ev)
-        elif "生徒対談" in et:
-            student.append(ev)
-        elif "ジャンル特化グルコン" in et:
-            genre_events.append(ev)
+        section = registry.overview_section(et)
+        if section is not None:
+            by_section[section].append(ev)
 
     def sort_by_date(lst):
         return sorted(lst, key=lambda e: _parse_date_for_sort(e.get("date", ""), e.get("time", ""), year))
 
-    instructor = sort_by_date(instructor)
-    student = sort_by_date(student)
-    genre_events = sort_by_date(genre_events)
-
     lines = [f"# {month_str}のイベント案内📢", ""]
 
-    # 特別講義（あれば）
-    if special:
-        special = sort_by_date(special)
-        lines.append("## 【特別講義】")
-        lines.append("")
-        for i, ev in enumerate(special, 1):
-            date_fmt = _format_date_long(ev.get("date", ""), ev.get("time", ""), year)
-            lines.append(f"{_num(i)}開催日：{date_fmt}")
-            lines.append(f"講師：{ev.get('teacher_name', '')}")
-            if ev.get("instagram_url"):
-                lines.append(ev["instagram_url"].rstrip("/"))
-            lines.append("")
-        lines.append("")
-
-    # 講師対談
-    lines.append("## 【講師対談】")
-    lines.append("")
-    if instructor:
-        for ev in instructor:
-            date_fmt = _format_date_long(ev.get("date", ""), ev.get("time", ""), year)
-            lines.append(f"開催日：{date_fmt}")
-            lines.append(f"講師：{ev.get('teacher_name', '')}")
-            if ev.get("instagram_url"):
-                lines.append(ev["instagram_url"].rstrip("/"))
-            lines.append("")
-    else:
-        lines.append("（今月の予定はありません）")
-        lines.append("")
-    lines.append("")
-
-    # 生徒対談
-    lines.append("## 【生徒対談】")
-    lines.append("")
-    if student:
-        for i, ev in enumerate(student, 1):
-            date_fmt = _format_date_long(ev.get("date", ""), ev.get("time", ""), year)
-            lines.append(f"{_num(i)}開催日：{date_fmt}")
-            lines.append(str(ev.get("teacher_name", "")))
-            if ev.get("instagram_url"):
-                lines.append(ev["instagram_url"].rstrip("/"))
-            lines.append("")
-    else:
-        lines.append("（今月の予定はありません）")
+    for section in registry.sections:
+        section_events = sort_by_date(by_section[section["key"]])
+        if not section_events and not section.get("show_empty"):
+            continue
+        lines.append(f"## 【{section['title']}】")
         lines.append("")
-    lines.append("")
-
-    # ジャンル特化グルコン（ジャンルごとにまとめ、日付順）
-    lines.append("## 【ジャンル特化グルコン】")
-    lines.append("")
-
-    if genre_events:
-        by_genre: Dict[str, List[Dict]] = {}
-        genre_order: List[str] = []  # 最初に出た順を保持（育児・子育ては「育児」に統一）
-        for ev in genre_events:
-            g = ev.get("genre", "") or "その他"
-            g_key = _genre_base(g) or _EMOJI_STRIP_RE.sub("", str(g)).replace("ジャンル", "").strip()
-            if not g_key:
-                g_key = "その他"
-            if g_key not in by_genre:
-                by_genre[g_key] = []
-                genre_order.append(g_key)
-            by_genre[g_key].append(ev)
-
-        for g_key in genre_order:
-            group = sort_by_date(by_genre[g_key])
-            raw_genre = group[0].get("genre", "") or g_key
-            emoji = _genre_emoji(raw_genre)
-            label = _genre_display_name(raw_genre) or f"{g_key}ジャンル"
-            lines.append(f"## {emoji}{label}")
+        if not section_events:
+            lines.append("（今月の予定はありません）")
             lines.append("")
-            for i, ev in enumerate(group, 1):
-                date_fmt = _format_date_short(ev.get("date", ""), ev.get("time", ""), year)
-                lines.append(f"{_num(i)}開催日：{date_fmt}")
-                lines.append(f"講師：{ev.get('teacher_name', '')}")
-                if ev.get("instagram_url"):
-                    lines.append(ev["instagram_url"].rstrip("/"))
+        elif section.get("group_by_genre"):
+            # ジャンルごとにまとめ、日付順
+            by_genre: Dict[str, List[Dict]] = {}
+            genre_order: List[str] = []  # 最初に出た順を保持（育児・子育ては「育児」に統一）
+            for ev in section_events:
+                g_key = genre_group_key(ev.get("genre", ""))
+                if g_key not in by_genre:
+                    by_genre[g_key] = []
+                    genre_order.append(g_key)
+                by_genre[g_key].append(ev)
+
+            for g_key in genre_order:
+                group = sort_by_date(by_genre[g_key])
+                raw_genre = group[0].get("genre", "") or g_key
+                emoji = _genre_emoji(raw_genre)
+                label = _genre_display_name(raw_genre) or f"{g_key}ジャンル"
+                lines.append(f"## {emoji}{label}")
                 lines.append("")
+                lines.extend(_section_items(section, group, year))
+                lines.append("")
+        else:
+            lines.extend(_section_items(section, section_events, year))
+        if not section.get("group_by_genre"):
             lines.append("")
-    else:
-        lines.append("（今月の予定はありません）")
-        lines.append("")
 
     return "\n".join(lines).strip()
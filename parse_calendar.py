@@ -5,23 +5,19 @@ import re
 import json
 import sys
 import argparse
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from event_registry import get_registry, make_event_type
 
 
 def parse_event_name(event_name: str) -> Dict[str, str]:
-    result = {}
-    if "万垢生限定オン会" in event_name or ("万垢" in event_name and "限定オン会" in event_name):
-        result["event_type"] = "万垢生限定オン会（事前告知）"
-    elif "ジャンル特化グルコン" in event_name:
-        result["event_type"] = "ジャンル特化グルコン（事前告知）"
-    elif "生徒対談" in event_name:
-        result["event_type"] = "生徒対談（事前告知）"
-    elif "講師対談" in event_name:
-        result["event_type"] = "講師対談（事前告知）"
-    elif "オン会" in event_name:
-        result["event_type"] = "オン会（事前告知）"
-    else:
-        result["event_type"] = "ジャンル特化グルコン（事前告知）"
+    """
+    予定名（タイトル）からイベント種別・ジャンル・講師名を取り出す。
+    種別の判定と講師名の取り出し方は templates/event_types.json の定義による。
+    """
+    registry = get_registry()
+    kind = registry.classify_title(event_name)
+    result = {"event_type": make_event_type(kind, registry.announce_variant)}
 
     # ジャンル: （〇〇）または (〇〇) から抽出（例: （スポット）/(スポット) → スポット）
     match_genre = re.search(r'（(.+?)）', event_name) or re.search(r'\((.+?)\)', event_name)
@@ -35,43 +31,33 @@ def parse_event_name(event_name: str) -> Dict[str, str]:
     else:
         result["genre"] = ""
 
-    # 講師名・ゲスト名: 予定名（タイトル）から抽出。ジャンル特化は「名前（ジャンル）」形式
-    if "ジャンル特化グルコン" in event_name:
-        # 【ジャンル特化グルコン】 カナノ⌇埼玉グルメ＆カフェ（スポット）または (スポット)
-        m = re.search(r'【ジャンル特化グルコン】\s*(.+?)（.+?）', event_name)
-        if not m:
-            m = re.search(r'【ジャンル特化グルコン】\s*(.+?)\(.+?\)', event_name)
-        if m:
-            result["teacher_name"] = m.group(1).strip()
-        else:
-            m = re.search(r'【ジャンル特化グルコン】\s*(.+)', event_name)
-            if m:
-                result["teacher_name"] = m.group(1).strip()
-    elif "講師対談" in event_name:
-        # 【講師対談】はるパパ⌇親子で楽しむ0歳カラダあそび
-        m = re.search(r'【講師対談】\s*(.+)', event_name)
-        if m:
-            result["teacher_name"] = m.group(1).strip()
-    elif "生徒対談" in event_name:
-        # 【生徒対談】ぽぽ⌇看護師・発酵料理士アドバイザー
-        m = re.search(r'【生徒対談】\s*(.+)', event_name)
-        if m:
-            result["teacher_name"] = m.group(1).strip()
+    # 講師名・ゲスト名: 予定名（タイトル）から抽出。
+    # 例: 【ジャンル特化グルコン】 カナノ⌇埼玉グルメ＆カフェ（スポット） / 【講師対談】はるパパ⌇親子で楽しむ0歳カラダあそび
+    teacher = registry.teacher_name(kind, event_name)
+    if teacher is not None:
+        result["teacher_name"] = teacher
 
     return result
 
 
+# 貼り付けテキストの解析用（事前コンパイル）
+_DATE_RE = re.compile(r'(\d+)月\s*(\d+)日')
+_CLOCK_RE = re.compile(r'^\d{1,2}:\d{2}')
+_TIME_RE = re.compile(r'(午前|午後)?\s*(\d{1,2}):(\d{2})')
+_INSTAGRAM_RE = re.compile(r'https?://(?:www\.)?instagram\.com/[^\s<>"/]+', re.I)
+
+
 def parse_date(date_str: str) -> str:
-    match = re.search(r'(\d+)月\s*(\d+)日', date_str)
+    match = _DATE_RE.search(date_str)
     if match:
         return f"{match.group(1)}/{match.group(2)}"
     return date_str if "/" in date_str else date_str
 
 
 def parse_time(time_str: str) -> str:
-    if re.match(r'^\d{1,2}:\d{2}', time_str):
+    if _CLOCK_RE.match(time_str):
         return time_str.split("～")[0].strip()
-    match = re.search(r'(午前|午後)?\s*(\d{1,2}):(\d{2})', time_str)
+    match = _TIME_RE.search(time_str)
     if match:
         hour = int(match.group(2))
         minute = match.group(3)
@@ -83,27 +69,123 @@ def parse_time(time_str: str) -> str:
     return time_str.split("～")[0].strip()
 
 
-def parse_calendar_text(text: str) -> Dict:
-    lines = [line.strip() for line in text.strip().split('\n') if line.strip()]
+def _is_title_line(line: str) -> bool:
+    return "【" in line and "】" in line
+
+
+def _is_date_line(line: str) -> bool:
+    return "月" in line and "日" in line
+
+
+def _is_time_line(line: str) -> bool:
+    # URL の「https:」を時刻と取り違えない
+    if "://" in line:
+        return False
+    return "午前" in line or "午後" in line or (":" in line and "時" not in line)
+
+
+def _is_when_line(line: str) -> bool:
+    return _is_date_line(line) or _is_time_line(line)
+
+
+def _parse_event_lines(lines) -> Dict:
+    """1件分の行（空行除去・strip済み）を1回の走査で解析する。各項目は最初に当てはまった行を使う"""
     result = {}
+    found_title = found_date = found_time = found_instagram = False
     for line in lines:
-        if "【" in line and "】" in line:
+        if not found_title and _is_title_line(line):
             result.update(parse_event_name(line))
-            break
-    for line in lines:
-        if "月" in line and "日" in line:
+            found_title = True
+        if not found_date and _is_date_line(line):
             result["date"] = parse_date(line)
-            break
-    for line in lines:
-        if "午前" in line or "午後" in line or (":" in line and "時" not in line):
+            found_date = True
+        if not found_time and _is_time_line(line):
             result["time"] = parse_time(line)
-            break
-    for line in lines:
-        if "instagram.com" in line.lower():
+            found_time = True
+        if not found_instagram and "instagram.com" in line.lower():
             # Zoomリンクの手前で区切り、InstagramのURLのみ抽出
             head = line.split("Zoomリンク")[0].split("Zoom ")[0].strip()
-            match = re.search(r'https?://(?:www\.)?instagram\.com/[^\s<>"/]+', head, re.I)
+            match = _INSTAGRAM_RE.search(head)
             if match:
                 result["instagram_url"] = match.group(0).rstrip("/").rstrip(")")
+            found_instagram = True
+        if found_title and found_date and found_time and found_instagram:
             break
     return result
+
+
+def parse_calendar_text(text: str) -> Dict:
+    lines = [line.strip() for line in text.strip().split('\n') if line.strip()]
+    return _parse_event_lines(lines)
+
+
+def _marked_lines(source: Iterable[str]) -> Iterator[Tuple[str, bool]]:
+    """空行を除いた各行（strip済み）と、その直前が空行だったかを返す"""
+    after_blank = False
+    for raw in source:
+        line = raw.strip()
+        if not line:
+            after_blank = True
+            continue
+        yield line, after_blank
+        after_blank = False
+
+
+def _candidate_blocks(source: Iterable[str]) -> Iterator[List[str]]:
+    """1行先読みしながら、区切りの候補ごとに行を分ける（split_event_blocks を参照）"""
+    lines = _marked_lines(source)
+    block: List[str] = []
+    has_title = has_date = False
+    current = next(lines, None)
+    while current is not None:
+        line, after_blank = current
+        following = next(lines, None)
+        is_title = _is_title_line(line)
+        # 説明文中の【講師プロフィール】などは予定名ではない。空行のあとか、次の行が日付・時刻のときだけ予定名とみなす
+        heads_event = after_blank or (following is not None and _is_when_line(following[0]))
+        starts_new = (is_title and has_title and heads_event) or (
+            after_blank and has_title and has_date and _is_date_line(line)
+        )
+        if starts_new and block:
+            yield block
+            block = []
+            has_title = has_date = False
+        block.append(line)
+        has_title = has_title or is_title
+        has_date = has_date or _is_date_line(line)
+        current = following
+    if block:
+        yield block
+
+
+def split_event_blocks(source: Union[str, Iterable[str]]) -> Iterator[List[str]]:
+    """
+    複数の予定を貼り付けたテキスト（または行のイテラブル・ファイル）を1件ずつの行リストに分ける。
+    1回の走査（1行先読み）で、次のいずれかで区切る:
+    - 【...】の予定名の行（今のブロックに既に予定名があり、空行のあとか次の行が日付・時刻の場合）
+    - 空行のあとの日付の行（今のブロックに既に予定名と日付がある場合。日付が予定名より先に来る形式用）
+    日付も時刻もないブロック（説明文中の見出しで区切れたもの）は予定にせず、前のブロックの続きとして扱う。
+    """
+    if isinstance(source, str):
+        source = source.splitlines()
+    previous: Optional[List[str]] = None
+    for block in _candidate_blocks(source):
+        if previous is not None and not any(_is_when_line(line) for line in block):
+            previous.extend(block)
+            continue
+        if previous is not None:
+            yield previous
+        previous = block
+    if previous is not None:
+        yield previous
+
+
+def iter_calendar_events(source: Union[str, Iterable[str]]) -> Iterator[Dict]:
+    """
+    複数の予定の貼り付けテキスト・テキストファイルから、予定ごとの解析結果を順に返す（必要な分だけ解析）。
+    予定名（【...】）のないブロックは飛ばす。
+    """
+    for block in split_event_blocks(source):
+        parsed = _parse_event_lines(block)
+        if parsed.get("event_type"):
+            yield parsed
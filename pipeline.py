@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+取得 → 変換 → 入力チェック・生成 → 出力 をページごとに流す非同期パイプライン
+
+各段は async generator で、段の間は上限つきのキュー（PIPELINE_QUEUE_SIZE ページ分）でつなぎます。
+- カレンダーの1ページ目を受け取った時点で変換・生成・出力が始まり、後のページの取得と並んで進む
+- 後段が詰まるとキューが埋まって前段が待つので、手元に溜まるのは「段の数 × キューの大きさ」ページ分まで
+- 取得・変換（SQLite のキャッシュを使う場合）はブロックする呼び出しなので、スレッドで実行する
+
+使い方（スタブで確認する場合）:
+  python calendar_stub.py --port 8765 &
+  CALENDAR_API_ROOT_URL=http://127.0.0.1:8765/ python pipeline.py --out 告知文一覧.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import inspect
+import sys
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List
+
+import config
+from bulk_export import BULK_CSV_HEADER, build_bulk_rows
+from google_calendar_client import convert_api_event, is_excluded_event
+
+# 段の終わり・失敗を後段に伝える印
+_DONE = object()
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def _pump(source: AsyncIterator, queue: "asyncio.Queue") -> None:
+    try:
+        async for item in source:
+            await queue.put(item)
+    except Exception as e:
+        await queue.put(_Failure(e))
+        return
+    await queue.put(_DONE)
+
+
+async def buffered(source: AsyncIterator, maxsize: int = None) -> AsyncIterator:
+    """
+    source を別のタスクで先読みし、最大 maxsize 件まで溜めて順に返す。
+    前段で起きた例外はここで送出し、途中でやめたときは前段も止める。
+    """
+    queue: "asyncio.Queue" = asyncio.Queue(maxsize or config.PIPELINE_QUEUE_SIZE)
+    task = asyncio.ensure_future(_pump(source, queue))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        if hasattr(source, "aclose"):
+            await source.aclose()
+
+
+async def fetch_pages(pages: Iterator[List[Dict]], stats: Dict[str, Any] = None) -> AsyncIterator[List[Dict]]:
+    """
+    同期のページ iterator（iter_event_pages など）を1ページずつスレッドで進める。
+    次のページは後段のキューに空きができてから取得する。
+    """
+    loop = asyncio.get_running_loop()
+    it = iter(pages)
+    while True:
+        page = await loop.run_in_executor(None, next, it, _DONE)
+        if page is _DONE:
+            return
+        if stats is not None:
+            stats["pages"] = stats.get("pages", 0) + 1
+            stats["api_events"] = stats.get("api_events", 0) + len(page)
+        yield page
+
+
+class PageConverter:
+    """
+    1ページ分のAPIの予定を event_data にする。繰り返し予定の解析結果はページをまたいで使い回す。
+    event_cache を渡すとキャッシュ済みの変換結果を使い、変換した予定を保存する（全ページ後に record_sync を呼ぶこと）。
+    変換した予定IDは ids に並び順で溜まる。
+    """
+
+    def __init__(self, parse_event_name_fn, exclude_titles=None, event_cache=None, calendar_id: str = None):
+        self.parse_event_name_fn = parse_event_name_fn
+        self.exclude_titles = exclude_titles
+        self.event_cache = event_cache
+        self.calendar_id = calendar_id
+        self.ids: List[str] = []
+        self._series_memo: Dict = {}
+
+    def __call__(self, page: List[Dict]) -> List[Dict[str, Any]]:
+        if self.event_cache is not None:
+            return self.event_cache.convert_page(
+                self.calendar_id, page, self.parse_event_name_fn, self.exclude_titles,
+                series_memo=self._series_memo, ids_out=self.ids,
+            )
+        converted = [
+            convert_api_event(ev, self.parse_event_name_fn, self._series_memo)
+            for ev in page if not is_excluded_event(ev, self.exclude_titles)
+        ]
+        self.ids.extend(ed["_id"] for ed in converted)
+        return converted
+
+
+async def convert_pages(pages: AsyncIterator[List[Dict]], convert: Callable[[List[Dict]], List[Dict[str, Any]]],
+                        stats: Dict[str, Any] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+    """ページごとに event_data に変換する（変換はスレッドで実行する）"""
+    loop = asyncio.get_running_loop()
+    async for page in pages:
+        events = await loop.run_in_executor(None, convert, page)
+        if stats is not None:
+            stats["events"] = stats.get("events", 0) + len(events)
+        yield events
+
+
+async def render_batches(batches: AsyncIterator[List[Dict[str, Any]]], generator,
+                         stats: Dict[str, Any] = None) -> AsyncIterator[Dict[str, List]]:
+    """ページごとに入力チェック・告知文の生成を行い、{"events": 予定, "rows": 一括生成の行} を返す"""
+    async for events in batches:
+        rows = build_bulk_rows(events, generator)
+        if stats is not None:
+            stats["rows"] = stats.get("rows", 0) + len(rows)
+        yield {"events": events, "rows": rows}
+
+
+async def run_bulk_pipeline(
+    pages: Iterator[List[Dict]],
+    generator,
+    convert: Callable[[List[Dict]], List[Dict[str, Any]]],
+    sinks: Iterable[Callable[[List[Dict[str, Any]]], Any]] = (),
+    queue_size: int = None,
+    stats: Dict[str, Any] = None,
+) -> AsyncIterator[Dict[str, List]]:
+    """
+    取得 → 変換 → 生成 をつなぎ、ページごとの {"events", "rows"} を出来た順に返す。
+    sinks（行のリストを受け取る関数。async 関数でもよい）には返す前に行を渡す（CSVへの書き出しなど）。
+    stats には pages / api_events / events / rows と、最初の行までの秒数 first_rows_sec・全体の秒数 total_sec が入る。
+    """
+    stats = stats if stats is not None else {}
+    started = time.monotonic()
+    stage = buffered(fetch_pages(pages, stats), queue_size)
+    stage = buffered(convert_pages(stage, convert, stats), queue_size)
+    stage = buffered(render_batches(stage, generator, stats), queue_size)
+    try:
+        async for batch in stage:
+            for sink in sinks:
+                result = sink(batch["rows"])
+                if inspect.isawaitable(result):
+                    await result
+            if "first_rows_sec" not in stats and batch["rows"]:
+                stats["first_rows_sec"] = time.monotonic() - started
+            yield batch
+    finally:
+        await stage.aclose()
+        stats["total_sec"] = time.monotonic() - started
+
+
+class CsvRowSink:
+    """一括生成の行を、届いた順にCSVへ書き足す（見出しは最初に1回だけ）"""
+
+    def __init__(self, out, header: List[str] = None):
+        self.header = header or BULK_CSV_HEADER
+        self._writer = csv.writer(out)
+        self._out = out
+        self._writer.writerow(self.header)
+
+    def __call__(self, rows: List[Dict[str, Any]]) -> None:
+        self._writer.writerows([r.get(col, "") for col in self.header] for r in rows)
+        self._out.flush()
+
+
+def main() -> None:
+    from generate_announcement import AnnouncementGenerator
+    from google_calendar_client import iter_event_pages
+    from parse_calendar import parse_event_name
+
+    parser = argparse.ArgumentParser(description="カレンダーの予定を取得しながら一括生成のCSVに書き出す")
+    parser.add_argument("--calendar", default="primary", help="カレンダーID")
+    parser.add_argument("--days", type=int, default=31, help="今日から何日分")
+    parser.add_argument("--page-size", type=int, default=config.PIPELINE_PAGE_SIZE, help="1ページの予定数")
+    parser.add_argument("--token", default="stub", help="アクセストークン（スタブで確認するときは任意の文字列）")
+    parser.add_argument("--out", help="出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    from google.oauth2.credentials import Credentials
+
+    creds = Credentials(token=args.token)
+    pages = iter_event_pages(creds, args.calendar, args.page_size, args.days)
+    convert = PageConverter(parse_event_name, config.CALENDAR_EXCLUDE_TITLES)
+    out = open(args.out, "w", encoding="utf-8-sig", newline="") if args.out else sys.stdout
+    stats: Dict[str, Any] = {}
+
+    async def _run() -> None:
+        async for _ in run_bulk_pipeline(pages, AnnouncementGenerator(), convert, [CsvRowSink(out)], stats=stats):
+            pass
+
+    try:
+        asyncio.run(_run())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{stats.get('pages', 0)}ページ・予定 {stats.get('events', 0)}件 → {stats.get('rows', 0)}行"
+          f"（最初の行まで {stats.get('first_rows_sec', 0):.2f}秒・全体 {stats['total_sec']:.2f}秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
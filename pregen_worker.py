@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+告知文の事前生成ワーカー
+
+選択中のカレンダーを定期的に同期し、一括生成の行（事前告知・間もなく開始）と
+月全体の案内文をあらかじめ作っておきます。ボタンを押したときは出来上がった結果を返すだけです。
+予定の内容・テンプレートが変わっていない行は再生成しません。
+テンプレートの編集時はカレンダーを取り直さず、影響を受ける行だけを作り直します。
+ワーカーは (連携アカウント, カレンダー) ごとに1つで、しばらく使われなければ止まります（APIの呼び出し枠を使い続けない）。
+"""
+
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Any
+
+import config
+from bulk_export import build_bulk_row, expand_variants
+from event_table import EventTable
+from generate_announcement import AnnouncementGenerator
+from google_calendar_client import convert_api_events
+from monthly_overview import build_monthly_overview, guess_month_str
+from parse_calendar import parse_event_name
+from template_index import TemplateIndex
+
+
+def _hash_json(obj: Any) -> str:
+    payload = json.dumps(obj, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def templates_key(templates_override: Optional[Dict[str, str]]) -> str:
+    """上書きテンプレートの内容を表すキー（ワーカーの結果が今のテンプレートで作られたかの判定用）"""
+    return _hash_json(templates_override or {})
+
+
+class PregenerationWorker:
+    """
+    バックグラウンドスレッドで定期同期・事前生成を行うワーカー。
+    fetch_fn(calendar_id) はAPIの予定一覧（events.list の items）を返す関数。
+    batch_fetch_fn(calendar_ids) を渡すと、複数カレンダーを同期するときは {カレンダーID: items} を1回で取得する。
+    """
+
+    def __init__(
+        self,
+        fetch_fn: Callable[[str], List[Dict]],
+        calendar_ids: List[str],
+        templates_override: Optional[Dict[str, str]] = None,
+        interval_sec: float = None,
+        event_cache=None,
+        batch_fetch_fn: Optional[Callable[[List[str]], Dict[str, List[Dict]]]] = None,
+        idle_intervals: int = None,
+    ):
+        self.fetch_fn = fetch_fn
+        self.batch_fetch_fn = batch_fetch_fn
+        self.calendar_ids = list(calendar_ids)
+        self.templates_override = dict(templates_override or {})
+        self.interval_sec = interval_sec if interval_sec is not None else config.PREGEN_INTERVAL_SEC
+        self.event_cache = event_cache
+        # get_worker・ready_for がこの周期数のあいだ呼ばれなければ止まる
+        self.idle_intervals = idle_intervals if idle_intervals is not None else config.PREGEN_IDLE_INTERVALS
+        self._last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._force_sync = False
+        self._rerender_pending = False
+        self._thread: Optional[threading.Thread] = None
+        # (予定ID, variant) -> (指紋, 行)
+        self._rendered: Dict[tuple, tuple] = {}
+        self._overview: tuple = ("", "")
+        self._events: List[Dict[str, Any]] = []
+        self._index = TemplateIndex()
+        self._result: Optional[Dict[str, Any]] = None
+        self.stats = {"syncs": 0, "rerenders": 0, "rendered": 0, "reused": 0, "invalidated": 0, "errors": 0}
+
+    # --- 設定の更新（UIスレッドから呼ぶ） ---
+
+    def set_fetch_fn(self, fetch_fn: Callable[[str], List[Dict]], batch_fetch_fn=None) -> None:
+        with self._lock:
+            self.fetch_fn = fetch_fn
+            self.batch_fetch_fn = batch_fetch_fn
+
+    def set_calendars(self, calendar_ids: List[str]) -> None:
+        with self._lock:
+            if list(calendar_ids) == self.calendar_ids:
+                return
+            self.calendar_ids = list(calendar_ids)
+        self.sync_now()
+
+    def set_templates(self, templates_override: Optional[Dict[str, str]]) -> None:
+        with self._lock:
+            if dict(templates_override or {}) == self.templates_override:
+                return
+            self.templates_override = dict(templates_override or {})
+            self._rerender_pending = True
+        self._wake.set()
+
+    # --- スレッド制御 ---
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="pregen-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def touch(self) -> None:
+        """使われたことを記録する（止まるまでの時間を延ばす）"""
+        with self._lock:
+            self._last_used = time.monotonic()
+
+    def _idle(self) -> bool:
+        with self._lock:
+            return time.monotonic() - self._last_used > self.idle_intervals * self.interval_sec
+
+    def sync_now(self) -> None:
+        """次の周期を待たずに同期する"""
+        with self._lock:
+            self._force_sync = True
+        self._wake.set()
+
+    def _loop(self) -> None:
+        next_sync = 0.0
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    force_sync, self._force_sync = self._force_sync, False
+                    rerender, self._rerender_pending = self._rerender_pending, False
+                if self._idle():
+                    self.stop()
+                    break
+                if force_sync or time.monotonic() >= next_sync:
+                    next_sync = time.monotonic() + self.interval_sec
+                    self.run_once()
+                elif rerender:
+                    self.rerender()
+            except Exception as e:
+                with self._lock:
+                    self.stats["errors"] += 1
+                    if self._result is not None:
+                        self._result = {**self._result, "error": str(e)}
+                    else:
+                        self._result = {"error": str(e)}
+            self._wake.wait(max(0.0, next_sync - time.monotonic()))
+            self._wake.clear()
+
+    # --- 同期・生成 ---
+
+    def run_once(self) -> Dict[str, Any]:
+        """1回分の同期と事前生成を行い、結果を返す"""
+        with self._lock:
+            fetch_fn = self.fetch_fn
+            batch_fetch_fn = self.batch_fetch_fn
+            calendar_ids = list(self.calendar_ids)
+            override = dict(self.templates_override)
+
+        if batch_fetch_fn is not None and len(calendar_ids) > 1:
+            fetched = batch_fetch_fn(calendar_ids)
+        else:
+            fetched = {calendar_id: fetch_fn(calendar_id) for calendar_id in calendar_ids}
+        events: List[Dict[str, Any]] = []
+        for calendar_id in calendar_ids:
+            api_events = fetched.get(calendar_id, [])
+            if self.event_cache is not None:
+                events.extend(self.event_cache.convert_events(
+                    calendar_id, api_events, parse_event_name, config.CALENDAR_EXCLUDE_TITLES
+                ))
+            else:
+                events.extend(convert_api_events(api_events, parse_event_name, config.CALENDAR_EXCLUDE_TITLES))
+
+        generator = AnnouncementGenerator(templates_override=override)
+        rows = self._render_rows(events, generator)
+        overview = self._render_overview(EventTable.from_event_data(events))
+        self._events = events
+        result = {
+            "calendar_ids": calendar_ids,
+            "templates_key": templates_key(override),
+            "events": events,
+            "rows": rows,
+            "overview": overview,
+            "synced_at": time.time(),
+            "error": None,
+        }
+        with self._lock:
+            self._result = result
+            self.stats["syncs"] += 1
+        return result
+
+    def rerender(self) -> Optional[Dict[str, Any]]:
+        """カレンダーを取り直さず、前回の予定一覧を今のテンプレートで作り直す（影響を受ける行のみ）"""
+        with self._lock:
+            override = dict(self.templates_override)
+            prev = self._result
+        if prev is None or "rows" not in prev:
+            return None
+        rows = self._render_rows(self._events, AnnouncementGenerator(templates_override=override))
+        result = {**prev, "rows": rows, "templates_key": templates_key(override), "error": None}
+        with self._lock:
+            self._result = result
+            self.stats["rerenders"] += 1
+        return result
+
+    def _render_rows(self, events: List[Dict[str, Any]], generator: AnnouncementGenerator) -> List[Dict[str, str]]:
+        """
+        予定の内容と、その種別のテンプレート・参照している固定Zoom項目が前回と同じ行は前回の結果を使う。
+        変更のあった種別で生成した行はインデックスから引いて作り直す。
+        """
+        changed_types = self._index.update(generator.templates, config.FIXED_ZOOM_INFO)
+        invalidated = self._index.affected_events(changed_types)
+        self.stats["invalidated"] += len(invalidated)
+        rendered: Dict[tuple, tuple] = {}
+        rows = []
+        for ed in events:
+            for variant, ev_row in expand_variants(ed):
+                row_type = ev_row.get("event_type", "").strip()
+                key = (ed.get("_id", ""), variant)
+                fingerprint = _hash_json([ev_row, self._index.dependency_fingerprint(row_type)])
+                prev = self._rendered.get(key)
+                if prev is not None and prev[0] == fingerprint and key not in invalidated:
+                    row = prev[1]
+                    self.stats["reused"] += 1
+                else:
+                    row = build_bulk_row(generator, ev_row.copy())
+                    row["_id"] = ed.get("_id", "")
+                    row["_variant"] = variant
+                    self._index.record_render(key, row_type, row["メッセージ"])
+                    self.stats["rendered"] += 1
+                rendered[key] = (fingerprint, row)
+                rows.append(row)
+        self._rendered = rendered
+        self._index.forget(rendered)
+        return rows
+
+    def _render_overview(self, table: EventTable) -> str:
+        """月全体の案内文は事前告知の予定だけで決まるので、それらが変わったときだけ作り直す"""
+        announced = table.announce_only().sort_by_start()
+        fingerprint = _hash_json([{k: v for k, v in ed.items() if not k.startswith("_")} for ed in announced])
+        if self._overview[0] == fingerprint:
+            return self._overview[1]
+        overview = build_monthly_overview(announced, guess_month_str(table.to_records()))
+        self._overview = (fingerprint, overview)
+        return overview
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """最新の事前生成結果（まだなければ None）"""
+        with self._lock:
+            return self._result
+
+    def ready_for(self, calendar_ids: List[str], templates_override: Optional[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+        """指定のカレンダー・テンプレートで作られた結果があれば返す"""
+        self.touch()
+        res = self.result()
+        if not res or res.get("error") or "rows" not in res:
+            return None
+        if res["calendar_ids"] != list(calendar_ids) or res["templates_key"] != templates_key(templates_override):
+            return None
+        return res
+
+
+_WORKERS: Dict[tuple, PregenerationWorker] = {}
+_WORKERS_LOCK = threading.Lock()
+
+
+def get_worker(
+    key: str,
+    fetch_fn: Callable[[str], List[Dict]],
+    calendar_ids: List[str],
+    templates_override: Optional[Dict[str, str]] = None,
+    event_cache=None,
+    batch_fetch_fn: Optional[Callable[[List[str]], Dict[str, List[Dict]]]] = None,
+) -> PregenerationWorker:
+    """
+    キー（連携アカウント）とカレンダーの組ごとに1つのワーカーを起動して返す。既にあれば設定だけ更新する。
+    同じアカウントの別セッションが別のカレンダーを見ていても、互いのワーカーを同期し直させない。
+    使われなくなって止まったワーカーはここで片付ける。
+    """
+    worker_key = (key, tuple(calendar_ids))
+    with _WORKERS_LOCK:
+        for k in [k for k, w in _WORKERS.items() if w.stopped]:
+            del _WORKERS[k]
+        worker = _WORKERS.get(worker_key)
+        if worker is None:
+            worker = PregenerationWorker(
+                fetch_fn, calendar_ids, templates_override, event_cache=event_cache, batch_fetch_fn=batch_fetch_fn
+            )
+            _WORKERS[worker_key] = worker
+            worker.start()
+            return worker
+    worker.touch()
+    worker.set_fetch_fn(fetch_fn, batch_fetch_fn)
+    worker.set_templates(templates_override)
+    return worker
+
+
+def stop_worker(key: str) -> None:
+    """連携アカウントのワーカーをすべて止める（連携解除のとき）"""
+    with _WORKERS_LOCK:
+        workers = [_WORKERS.pop(k) for k in [k for k in _WORKERS if k[0] == key]]
+    for worker in workers:
+        worker.stop()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+繰り返し予定（RRULE / EXDATE）の展開
+
+singleEvents=True で毎回の予定を説明文ごと取得する代わりに、繰り返しの元予定と例外だけを取得して
+手元で開催日ごとに展開します。展開した予定には _series（元予定ID, etag）が付き、
+変換時（google_calendar_client.convert_api_events など）は予定名・説明文の解析をシリーズごとに1回で済ませます。
+
+対応する規則: FREQ=DAILY/WEEKLY/MONTHLY/YEARLY, INTERVAL, COUNT, UNTIL, BYDAY, BYMONTHDAY, WKST=MO
+それ以外は UnsupportedRecurrence を送出する（呼び出し側でサーバー展開に切り替える）。
+"""
+
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8
+    ZoneInfo = None
+
+_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+_BYDAY_RE = re.compile(r"^([+-]?\d{1,2})?(MO|TU|WE|TH|FR|SA|SU)$")
+_SUPPORTED_PARTS = {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "BYMONTHDAY", "WKST"}
+# 展開する回数の上限（規則の誤りで無限に回らないように）。dtstart から数えるので、古い毎日の予定などは期間に届く前に上限になる
+_MAX_ITERATIONS = 5000
+
+
+class UnsupportedRecurrence(ValueError):
+    """手元では展開できない繰り返し規則"""
+
+
+def tz_from_name(name: Optional[str]):
+    """タイムゾーン名（Asia/Tokyo など）の tzinfo。読めない名前・zoneinfo がない環境では None"""
+    if name and ZoneInfo is not None:
+        try:
+            return ZoneInfo(name)
+        except Exception:
+            pass
+    return None
+
+
+def parse_ical_datetime(value: str, tzinfo=None):
+    """
+    iCalendar 形式の日時を返す。
+    "20250304T210000Z" → UTCの日時、"20250304T210000" → tzinfo の日時、"20250304" → date
+    """
+    value = value.strip()
+    if len(value) == 8:
+        return datetime.strptime(value, "%Y%m%d").date()
+    if value.endswith("Z"):
+        return datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+    dt = datetime.strptime(value, "%Y%m%dT%H%M%S")
+    return dt.replace(tzinfo=tzinfo) if tzinfo is not None else dt
+
+
+def parse_rrule(rule: str) -> Dict[str, str]:
+    """'RRULE:FREQ=WEEKLY;BYDAY=TU' または 'FREQ=WEEKLY;BYDAY=TU' を辞書にする"""
+    if rule.upper().startswith("RRULE:"):
+        rule = rule[6:]
+    parts = {}
+    for item in rule.strip().split(";"):
+        if "=" in item:
+            k, v = item.split("=", 1)
+            parts[k.strip().upper()] = v.strip().upper()
+    return parts
+
+
+def parse_exdates(lines: Iterable[str], default_tz=None) -> Set:
+    """'EXDATE;TZID=Asia/Tokyo:20250304T210000,20250311T210000' などから除外日時の集合を作る"""
+    result = set()
+    for line in lines:
+        if not line.upper().startswith("EXDATE"):
+            continue
+        head, _, values = line.partition(":")
+        tz = default_tz
+        for param in head.split(";")[1:]:
+            if param.upper().startswith("TZID="):
+                tz = tz_from_name(param[5:]) or default_tz
+        for v in values.split(","):
+            if v.strip():
+                result.add(parse_ical_datetime(v, tz))
+    return result
+
+
+def _same_instant(a, b) -> bool:
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        if (a.tzinfo is None) != (b.tzinfo is None):
+            return a.replace(tzinfo=None) == b.replace(tzinfo=None)
+        return a == b
+    if isinstance(a, datetime):
+        a = a.date()
+    if isinstance(b, datetime):
+        b = b.date()
+    return a == b
+
+
+def _as_comparable(value, ref):
+    """UNTIL・期間の比較用に ref（dtstart）と同じ種類に揃える"""
+    if isinstance(ref, datetime):
+        if isinstance(value, datetime):
+            if value.tzinfo is None and ref.tzinfo is not None:
+                return value.replace(tzinfo=ref.tzinfo)
+            if value.tzinfo is not None and ref.tzinfo is None:
+                return value.replace(tzinfo=None)
+            return value
+        return datetime(value.year, value.month, value.day, 23, 59, 59, tzinfo=ref.tzinfo)
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> Optional[int]:
+    """その月の第n（負なら後ろから）weekday の日付。なければ None"""
+    first = date(year, month, 1)
+    next_month = date(year + (month == 12), month % 12 + 1, 1)
+    days = [d for d in range((next_month - first).days) if (first.weekday() + d) % 7 == weekday]
+    try:
+        return days[n - 1 if n > 0 else n] + 1
+    except IndexError:
+        return None
+
+
+def _candidates(dtstart, parts: Dict[str, str]):
+    """規則どおりの開催日時を時系列順に返す（dtstart 以降。COUNT・UNTIL は呼び出し側で判定）"""
+    freq = parts.get("FREQ")
+    interval = int(parts.get("INTERVAL", "1") or 1)
+    byday = [b for b in parts.get("BYDAY", "").split(",") if b]
+    bymonthday = [int(x) for x in parts.get("BYMONTHDAY", "").split(",") if x]
+    parsed_byday = []
+    for b in byday:
+        m = _BYDAY_RE.match(b)
+        if not m:
+            raise UnsupportedRecurrence(f"BYDAY={b}")
+        parsed_byday.append((int(m.group(1)) if m.group(1) else None, _WEEKDAYS[m.group(2)]))
+
+    def at(d: date):
+        if isinstance(dtstart, datetime):
+            return dtstart.replace(year=d.year, month=d.month, day=d.day)
+        return d
+
+    start_day = dtstart.date() if isinstance(dtstart, datetime) else dtstart
+    if freq == "DAILY":
+        if byday or bymonthday:
+            raise UnsupportedRecurrence("DAILY with BY*")
+        k = 0
+        while True:
+            yield at(start_day + timedelta(days=k * interval))
+            k += 1
+    elif freq == "WEEKLY":
+        if bymonthday or any(n is not None for n, _ in parsed_byday):
+            raise UnsupportedRecurrence("WEEKLY with ordinal/BYMONTHDAY")
+        if parts.get("WKST", "MO") != "MO" and interval > 1:
+            raise UnsupportedRecurrence("WKST")
+        weekdays = sorted({wd for _, wd in parsed_byday}) or [start_day.weekday()]
+        week_start = start_day - timedelta(days=start_day.weekday())
+        w = 0
+        while True:
+            for wd in weekdays:
+                d = week_start + timedelta(weeks=w * interval, days=wd)
+                if d >= start_day:
+                    yield at(d)
+            w += 1
+    elif freq == "MONTHLY":
+        y, m = start_day.year, start_day.month
+        while True:
+            days = set()
+            for md in bymonthday:
+                last = (date(y + (m == 12), m % 12 + 1, 1) - timedelta(days=1)).day
+                day = md if md > 0 else last + md + 1
+                if 1 <= day <= last:
+                    days.add(day)
+            for n, wd in parsed_byday:
+                if n is None:
+                    raise UnsupportedRecurrence("MONTHLY BYDAY without ordinal")
+                day = _nth_weekday(y, m, wd, n)
+                if day:
+                    days.add(day)
+            if not bymonthday and not parsed_byday:
+                days.add(start_day.day)
+            for day in sorted(days):
+                try:
+                    d = date(y, m, day)
+                except ValueError:
+                    continue  # 31日がない月などは飛ばす（RFC 5545）
+                if d >= start_day:
+                    yield at(d)
+            m += interval
+            y += (m - 1) // 12
+            m = (m - 1) % 12 + 1
+    elif freq == "YEARLY":
+        if byday or bymonthday:
+            raise UnsupportedRecurrence("YEARLY with BY*")
+        k = 0
+        while True:
+            try:
+                yield at(start_day.replace(year=start_day.year + k * interval))
+            except ValueError:
+                pass  # 2/29 は閏年のみ
+            k += 1
+    else:
+        raise UnsupportedRecurrence(f"FREQ={freq}")
+
+
+def expand_rrule(dtstart, rule: str, window_start=None, window_end=None, exdates: Iterable = ()) -> List:
+    """
+    dtstart（datetime または date）と RRULE から開催日時のリストを返す。
+    window_start 以上・window_end 未満のものだけ。EXDATE は除く（COUNT は除外前の回数で数える）。
+    期間の終わりまでに _MAX_ITERATIONS 回を超える場合は、途中で打ち切らずに UnsupportedRecurrence を送出する
+    （window_end を指定しない場合は、それまでに期間内の開催があれば上限までで止める）。
+    """
+    parts = parse_rrule(rule)
+    unknown = set(parts) - _SUPPORTED_PARTS
+    if unknown:
+        raise UnsupportedRecurrence(",".join(sorted(unknown)))
+    count = int(parts["COUNT"]) if parts.get("COUNT") else None
+    until = None
+    if parts.get("UNTIL"):
+        until = _as_comparable(parse_ical_datetime(parts["UNTIL"], getattr(dtstart, "tzinfo", None)), dtstart)
+    ws = _as_comparable(window_start, dtstart) if window_start is not None else None
+    we = _as_comparable(window_end, dtstart) if window_end is not None else None
+    exdates = list(exdates)
+    result = []
+    for i, occ in enumerate(_candidates(dtstart, parts)):
+        if i >= _MAX_ITERATIONS:
+            if we is not None or not result:
+                raise UnsupportedRecurrence(f"{_MAX_ITERATIONS}回を超える展開")
+            break
+        if count is not None and i >= count:
+            break
+        if until is not None and occ > until:
+            break
+        if we is not None and occ >= we:
+            break
+        if ws is not None and occ < ws:
+            continue
+        if any(_same_instant(occ, ex) for ex in exdates):
+            continue
+        result.append(occ)
+    return result
+
+
+def start_of(start: Dict):
+    """APIの start（dateTime/timeZone または date）を datetime/date にする"""
+    if "dateTime" in start:
+        dt = datetime.fromisoformat(start["dateTime"].replace("Z", "+00:00"))
+        tz = tz_from_name(start.get("timeZone"))
+        return dt.astimezone(tz) if tz is not None else dt
+    if "date" in start:
+        return datetime.strptime(start["date"], "%Y-%m-%d").date()
+    return None
+
+
+def _start_payload(occ) -> Dict:
+    if isinstance(occ, datetime):
+        return {"dateTime": occ.isoformat()}
+    return {"date": occ.isoformat()}
+
+
+def instance_id(master_id: str, occ) -> str:
+    """Googleカレンダーのインスタンスと同じ形式のID（元予定ID_開始日時UTC）"""
+    if isinstance(occ, datetime):
+        utc = occ.astimezone(timezone.utc) if occ.tzinfo else occ
+        return f"{master_id}_{utc.strftime('%Y%m%dT%H%M%SZ')}"
+    return f"{master_id}_{occ.strftime('%Y%m%d')}"
+
+
+def expand_recurring_events(
+    items: List[Dict],
+    window_start: datetime,
+    window_end: datetime,
+    fallback_instances=None,
+    unexpanded: List[Dict] = None,
+) -> List[Dict]:
+    """
+    singleEvents=False の events.list の結果（元予定・例外・単発予定）を開催ごとの予定に展開する。
+    - 元予定は RRULE/EXDATE で展開し、_series=(元予定ID, etag) を付ける（予定名・説明文は共通）
+    - 変更された回（recurringEventId あり）はその予定で置き換え、キャンセルされた回は除く
+    - 展開できない規則は fallback_instances(元予定) でサーバー展開した予定を使う。
+      サーバー展開の結果には変更された回も含まれるので、そのシリーズの例外は足さない
+    - fallback_instances がなければ、展開できなかった元予定は unexpanded（リストを渡した場合）に入れて飛ばす
+    戻り値は開始日時順。
+    """
+    masters, exceptions, singles = [], [], []
+    for it in items:
+        if it.get("recurrence"):
+            masters.append(it)
+        elif it.get("recurringEventId"):
+            exceptions.append(it)
+        elif it.get("status") != "cancelled":
+            singles.append(it)
+
+    # 元予定ID → 置き換え・キャンセルされた回の元の開始日時
+    overridden: Dict[str, list] = {}
+    for ex in exceptions:
+        original = start_of(ex.get("originalStartTime", {}) or {})
+        if original is not None:
+            overridden.setdefault(ex["recurringEventId"], []).append(original)
+
+    expanded: List[Dict] = []
+    fell_back: Set[str] = set()
+
+    def fall_back(master: Dict) -> None:
+        if fallback_instances is not None:
+            expanded.extend(fallback_instances(master))
+            fell_back.add(master.get("id", ""))
+        elif unexpanded is not None:
+            unexpanded.append(master)
+
+    for master in masters:
+        start = master.get("start", {}) or {}
+        dtstart = start_of(start)
+        rules = [r for r in master.get("recurrence", []) if r.upper().startswith("RRULE")]
+        if dtstart is None or len(rules) != 1:
+            fall_back(master)
+            continue
+        exdates = parse_exdates(master.get("recurrence", []), getattr(dtstart, "tzinfo", None))
+        exdates.update(overridden.get(master.get("id", ""), []))
+        try:
+            occurrences = expand_rrule(dtstart, rules[0], window_start, window_end, exdates)
+        except UnsupportedRecurrence:
+            fall_back(master)
+            continue
+        series = (master.get("id", ""), master.get("etag", ""))
+        for occ in occurrences:
+            ev = {k: v for k, v in master.items() if k not in ("recurrence", "start")}
+            ev["id"] = instance_id(master.get("id", ""), occ)
+            ev["start"] = _start_payload(occ)
+            ev["recurringEventId"] = master.get("id", "")
+            ev["_series"] = series
+            expanded.append(ev)
+
+    expanded.extend(
+        ex for ex in exceptions
+        if ex.get("status") != "cancelled" and ex["recurringEventId"] not in fell_back
+    )
+    expanded.extend(singles)
+
+    def sort_key(ev):
+        s = start_of(ev.get("start", {}) or {})
+        if s is None:
+            return (1, 0.0)
+        if isinstance(s, datetime):
+            return (0, s.timestamp() if s.tzinfo else s.replace(tzinfo=timezone.utc).timestamp())
+        return (0, datetime(s.year, s.month, s.day, tzinfo=timezone.utc).timestamp())
+    return sorted(expanded, key=sort_key)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+一括生成の行をスプレッドシートに送る
+
+CSVをダウンロードしてスプレッドシートに手で取り込む代わりに、行をまとめて追加・更新します。
+- シートの列は A=メッセージ, B=日付, C=時間, D=チャンネル名 に、E=予定ID, F=段階 を足したもの
+- (予定ID, 段階) が同じ行がすでにあれば上書きし、内容が同じなら送らない（何度送っても行が増えない）
+- 予定IDのない行（予定ID の列がないCSVなど）は、別の予定と見分けられないので送らずにエラーにする
+- 追加・更新はそれぞれ行数と大きさの上限ごとにまとめて1回の呼び出しで送る
+- 送り先は GoogleSheetsBackend（Sheets API）と CsvSheetBackend（ローカルのCSV。動作確認用）を差し替えられる
+
+使い方:
+  python sheet_push.py 告知文一覧.csv --local sheet.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import config
+from bulk_export import (
+    BULK_CSV_HEADER, CANCELLED_MESSAGE, CHANGE_CANCELLED, CHANGE_COLUMN, SKIPPED_MESSAGE, row_key,
+)
+
+try:
+    from googleapiclient.discovery import build
+    GOOGLE_API_AVAILABLE = True
+except ImportError:
+    GOOGLE_API_AVAILABLE = False
+
+SHEET_HEADER = BULK_CSV_HEADER + ["予定ID", "段階"]
+# 1行を送るときの区切り・範囲指定などの分（大きさの見積もり用）
+_ROW_OVERHEAD_BYTES = 64
+
+
+class SheetPushError(Exception):
+    """スプレッドシートへの送信に失敗した"""
+
+
+def sheet_values(row: Dict[str, Any]) -> List[str]:
+    """一括生成の行をシートの1行（SHEET_HEADER の列順）にする。予定IDのない行は SheetPushError"""
+    try:
+        event_id, variant = row_key(row)
+    except ValueError as e:
+        raise SheetPushError(f"{e}。予定ID・段階の列があるCSVか、アプリの一括生成から送ってください。") from e
+    return [str(row.get(col, "")) for col in BULK_CSV_HEADER] + [event_id, variant]
+
+
+def _pad(values: List[str]) -> List[str]:
+    """シートから読んだ行（末尾の空のセルは返ってこない）を列数にそろえる"""
+    values = [str(v) for v in values[:len(SHEET_HEADER)]]
+    return values + [""] * (len(SHEET_HEADER) - len(values))
+
+
+def _payload_bytes(values: List[str]) -> int:
+    return len(json.dumps(values, ensure_ascii=False).encode("utf-8")) + _ROW_OVERHEAD_BYTES
+
+
+def chunk_by_size(items: List[Any], max_rows: int, max_bytes: int, size_of) -> Iterator[List[Any]]:
+    """行数が max_rows、大きさ（size_of の合計）が max_bytes を超えないように分ける。1行で上限を超える行は単独で送る"""
+    chunk, chunk_bytes = [], 0
+    for item in items:
+        size = size_of(item)
+        if chunk and (len(chunk) >= max_rows or chunk_bytes + size > max_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(item)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+class SheetBackend:
+    """
+    送り先の共通の形。行番号はシートの行番号（1始まり、1行目が見出し）。
+    read_rows・append・update はそれぞれ1回の呼び出しで行う。
+    """
+
+    def read_rows(self) -> List[List[str]]:
+        """見出しを含むシートの全行"""
+        raise NotImplementedError
+
+    def append(self, rows: List[List[str]]) -> None:
+        """シートの末尾に行を追加する"""
+        raise NotImplementedError
+
+    def update(self, updates: List[Tuple[int, List[str]]]) -> None:
+        """(行番号, 値) の行を上書きする"""
+        raise NotImplementedError
+
+
+class GoogleSheetsBackend(SheetBackend):
+    """Google スプレッドシート（Sheets API v4）。シート（タブ）は先に作っておく"""
+
+    def __init__(self, credentials, spreadsheet_id: str, sheet_name: str = None, account_key: str = "default"):
+        if not GOOGLE_API_AVAILABLE:
+            raise SheetPushError("google-api-python-client がインストールされていません。")
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name or config.SHEET_PUSH_SHEET_NAME
+        # 呼び出し枠・再試行はカレンダーとは別のアカウント枠で数える
+        self.account_key = f"sheets:{account_key}"
+        root_url = config.SHEETS_API_ROOT_URL
+        if root_url:
+            self._service = build("sheets", "v4", credentials=credentials,
+                                  client_options={"api_endpoint": root_url.rstrip("/") + "/"})
+        else:
+            self._service = build("sheets", "v4", credentials=credentials)
+
+    def _range(self, a1: str) -> str:
+        return "'{}'!{}".format(self.sheet_name.replace("'", "''"), a1)
+
+    def _execute(self, request) -> Dict:
+        from calendar_requests import execute
+        try:
+            return execute(request, account_key=self.account_key)
+        except Exception as e:
+            raise SheetPushError(f"スプレッドシートに送れませんでした: {e}") from e
+
+    def read_rows(self) -> List[List[str]]:
+        last_col = chr(ord("A") + len(SHEET_HEADER) - 1)
+        response = self._execute(self._service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id, range=self._range(f"A:{last_col}"),
+        ))
+        return response.get("values", [])
+
+    def append(self, rows: List[List[str]]) -> None:
+        self._execute(self._service.spreadsheets().values().append(
+            spreadsheetId=self.spreadsheet_id, range=self._range("A1"),
+            valueInputOption="RAW", insertDataOption="INSERT_ROWS", body={"values": rows},
+        ))
+
+    def update(self, updates: List[Tuple[int, List[str]]]) -> None:
+        last_col = chr(ord("A") + len(SHEET_HEADER) - 1)
+        self._execute(self._service.spreadsheets().values().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body={
+                "valueInputOption": "RAW",
+                "data": [{"range": self._range(f"A{n}:{last_col}{n}"), "values": [values]} for n, values in updates],
+            },
+        ))
+
+
+class CsvSheetBackend(SheetBackend):
+    """スプレッドシートの代わりのローカルのCSV（動作確認用）。呼び出し回数を calls に数える"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.calls = {"read": 0, "append": 0, "update": 0}
+
+    def read_rows(self) -> List[List[str]]:
+        self.calls["read"] += 1
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8-sig", newline="") as f:
+            return list(csv.reader(f))
+
+    def append(self, rows: List[List[str]]) -> None:
+        self.calls["append"] += 1
+        with open(self.path, "a", encoding="utf-8-sig", newline="") as f:
+            csv.writer(f).writerows(rows)
+
+    def update(self, updates: List[Tuple[int, List[str]]]) -> None:
+        self.calls["update"] += 1
+        with open(self.path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+        for n, values in updates:
+            rows[n - 1] = values
+        # 書きかけのファイルを読まれないよう、別のファイルに書いてから置き換える
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8-sig", newline="") as f:
+            csv.writer(f).writerows(rows)
+        os.replace(tmp, self.path)
+
+
+def make_backend(credentials=None, account_key: str = "default") -> Optional[SheetBackend]:
+    """設定の送り先（SHEET_PUSH_SPREADSHEET_ID → SHEET_PUSH_LOCAL_PATH の順）。送り先がなければ None"""
+    if config.SHEET_PUSH_SPREADSHEET_ID and credentials is not None:
+        return GoogleSheetsBackend(credentials, config.SHEET_PUSH_SPREADSHEET_ID, account_key=account_key)
+    if config.SHEET_PUSH_LOCAL_PATH:
+        return CsvSheetBackend(config.SHEET_PUSH_LOCAL_PATH)
+    return None
+
+
+def plan_push(existing: List[List[str]], rows: Iterable[Dict[str, Any]]) -> Tuple[List[List[str]], List[Tuple[int, List[str]]], Dict[str, int]]:
+    """
+    シートの今の行と一括生成の行から、(追加する行, 上書きする (行番号, 値), 件数) を決める。
+    スキップの行は送らない。取消の行はシートにあるときだけ上書きする。
+    予定IDのない行や、(予定ID, 段階) が同じ行が2つある場合は、どちらかを黙って捨てないよう SheetPushError にする。
+    """
+    counts = {"appended": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    key_col, variant_col = len(BULK_CSV_HEADER), len(BULK_CSV_HEADER) + 1
+    index: Dict[Tuple[str, str], int] = {}
+    current: Dict[int, List[str]] = {}
+    for n, values in enumerate(existing[1:], start=2):
+        values = _pad(values)
+        if values[key_col]:
+            index[(values[key_col], values[variant_col])] = n
+            current[n] = values
+    appends: Dict[Tuple[str, str], List[str]] = {}
+    updates: Dict[int, List[str]] = {}
+    seen = set()
+    for row in rows:
+        message = row.get("メッセージ", "")
+        if not message or message == SKIPPED_MESSAGE:
+            counts["skipped"] += 1
+            continue
+        values = sheet_values(row)
+        key = (values[key_col], values[variant_col])
+        if key in seen:
+            raise SheetPushError(f"同じ予定ID・段階の行が2つあります（{key[0]} / {key[1]}）。送る行を確認してください。")
+        seen.add(key)
+        n = index.get(key)
+        if n is None:
+            if row.get(CHANGE_COLUMN) == CHANGE_CANCELLED or message == CANCELLED_MESSAGE:
+                counts["skipped"] += 1
+            else:
+                appends[key] = values
+        elif current[n] == values:
+            counts["unchanged"] += 1
+        else:
+            updates[n] = values
+    counts["appended"] = len(appends)
+    counts["updated"] = len(updates)
+    return list(appends.values()), sorted(updates.items()), counts
+
+
+def push_rows(backend: SheetBackend, rows: Iterable[Dict[str, Any]], max_rows: int = None,
+              max_bytes: int = None) -> Dict[str, int]:
+    """
+    一括生成の行をシートに送る（シートが空なら見出しも付ける）。
+    戻り値は件数（appended / updated / unchanged / skipped）と呼び出し回数（calls）。
+    """
+    max_rows = max_rows or config.SHEET_PUSH_MAX_ROWS
+    max_bytes = max_bytes or config.SHEET_PUSH_MAX_BYTES
+    existing = backend.read_rows()
+    appends, updates, counts = plan_push(existing, rows)
+    calls = 1
+    if not existing and appends:
+        appends.insert(0, list(SHEET_HEADER))
+    # 上書きを先に送る（追加で行番号がずれることはないが、途中で失敗しても既存の行が先に最新になる）
+    for chunk in chunk_by_size(updates, max_rows, max_bytes, lambda u: _payload_bytes(u[1])):
+        backend.update(chunk)
+        calls += 1
+    for chunk in chunk_by_size(appends, max_rows, max_bytes, _payload_bytes):
+        backend.append(chunk)
+        calls += 1
+    counts["calls"] = calls
+    return counts
+
+
+def _read_bulk_csv(path: str) -> List[Dict[str, Any]]:
+    """ダウンロードした一括生成のCSV（予定ID・段階の列があればそれも）を行にする"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = []
+        for r in csv.DictReader(f):
+            row = {col: r.get(col, "") for col in BULK_CSV_HEADER}
+            if r.get(CHANGE_COLUMN):
+                row[CHANGE_COLUMN] = r[CHANGE_COLUMN]
+            if r.get("予定ID"):
+                row["_id"] = r["予定ID"]
+            row["_variant"] = r.get("段階", "")
+            rows.append(row)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="一括生成のCSVをスプレッドシート（またはローカルのCSV）に送る")
+    parser.add_argument("csv", help="一括生成のCSV（告知文一覧.csv）")
+    parser.add_argument("--local", help="送り先のローカルCSV（省略時は SHEET_PUSH_LOCAL_PATH）")
+    parser.add_argument("--max-rows", type=int, help=f"1回に送る行数の上限（既定: {config.SHEET_PUSH_MAX_ROWS}）")
+    parser.add_argument("--max-bytes", type=int, help=f"1回に送る大きさの上限（既定: {config.SHEET_PUSH_MAX_BYTES}）")
+    args = parser.parse_args()
+
+    path = args.local or config.SHEET_PUSH_LOCAL_PATH
+    if not path:
+        parser.error("--local か SHEET_PUSH_LOCAL_PATH で送り先を指定してください")
+    try:
+        result = push_rows(CsvSheetBackend(path), _read_bulk_csv(args.csv), args.max_rows, args.max_bytes)
+    except SheetPushError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"追加 {result['appended']}件・更新 {result['updated']}件・変更なし {result['unchanged']}件・"
+          f"送らない {result['skipped']}件（呼び出し {result['calls']}回）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+テンプレートの依存関係インデックス
+
+イベント種別 → テンプレート（ハッシュ）→ 参照している変数、と
+予定（予定ID・variant）→ 生成結果のハッシュ を記録します。
+テンプレートや固定Zoom情報（config.FIXED_ZOOM_INFO）を1件変えたときに、
+影響を受ける告知文だけを作り直すために使います。
+"""
+
+import hashlib
+import json
+import re
+from typing import Dict, Iterable, Optional, Set, Any
+
+# テンプレート中の {{変数名}}
+VARIABLE_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+def _sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def template_variables(template: str) -> frozenset:
+    """テンプレートが参照している変数名の集合"""
+    return frozenset(VARIABLE_RE.findall(template or ""))
+
+
+class TemplateIndex:
+    """イベント種別ごとのテンプレート・参照変数・固定Zoom情報の依存関係"""
+
+    def __init__(self, templates: Optional[Dict[str, str]] = None, zoom_info: Optional[Dict[str, Dict]] = None):
+        self._templates: Dict[str, tuple] = {}   # event_type -> (テンプレートのハッシュ, 参照変数)
+        self._zoom: Dict[str, Dict] = {}         # event_type -> 固定Zoom情報
+        self._renders: Dict[Any, tuple] = {}     # 予定キー -> (event_type, 生成結果のハッシュ)
+        self.update(templates or {}, zoom_info or {})
+
+    def update(self, templates: Dict[str, str], zoom_info: Dict[str, Dict]) -> Set[str]:
+        """
+        テンプレート・固定Zoom情報を差し替え、影響を受けるイベント種別の集合を返す。
+        固定Zoom情報は、テンプレートが参照している項目が変わったときだけ影響ありとする
+        （固定Zoomの有無そのものが変わった場合は入力チェックが変わるので影響あり）。
+        """
+        new_templates = {
+            et: (_sha1(body), template_variables(body)) for et, body in templates.items()
+        }
+        new_zoom = {et: dict(info) for et, info in zoom_info.items()}
+        changed = set()
+        for et in set(self._templates) | set(new_templates):
+            if self._templates.get(et) != new_templates.get(et):
+                changed.add(et)
+        for et in set(self._zoom) | set(new_zoom):
+            old, new = self._zoom.get(et), new_zoom.get(et)
+            if old == new:
+                continue
+            if (old is None) != (new is None):
+                changed.add(et)
+                continue
+            variables = new_templates.get(et, ("", frozenset()))[1]
+            if any(old.get(v) != new.get(v) for v in variables):
+                changed.add(et)
+        self._templates = new_templates
+        self._zoom = new_zoom
+        return changed
+
+    def variables_for(self, event_type: str) -> frozenset:
+        return self._templates.get(event_type, ("", frozenset()))[1]
+
+    def template_hash(self, event_type: str) -> str:
+        return self._templates.get(event_type, ("", frozenset()))[0]
+
+    def dependency_fingerprint(self, event_type: str) -> str:
+        """
+        この種別の生成結果が依存するもの（テンプレート本文と、参照している固定Zoom項目）のハッシュ。
+        参照していない固定Zoom項目を変えても値は変わらない。
+        """
+        template_hash, variables = self._templates.get(event_type, ("", frozenset()))
+        zoom = self._zoom.get(event_type)
+        zoom_deps = None if zoom is None else {v: zoom.get(v) for v in sorted(variables) if v in zoom}
+        return _sha1(json.dumps([template_hash, zoom_deps], ensure_ascii=False, sort_keys=True))
+
+    def record_render(self, event_key: Any, event_type: str, output: str) -> bool:
+        """生成結果を記録する。前回と内容が変わっていれば True"""
+        output_hash = _sha1(output or "")
+        prev = self._renders.get(event_key)
+        self._renders[event_key] = (event_type, output_hash)
+        return prev is None or prev[1] != output_hash
+
+    def output_hash(self, event_key: Any) -> Optional[str]:
+        entry = self._renders.get(event_key)
+        return entry[1] if entry else None
+
+    def affected_events(self, event_types: Iterable[str]) -> Set[Any]:
+        """指定のイベント種別で生成された予定キーの集合"""
+        targets = set(event_types)
+        return {key for key, (et, _) in self._renders.items() if et in targets}
+
+    def forget(self, keep_keys: Iterable[Any]) -> None:
+        """今の予定一覧にない予定キーの記録を消す"""
+        keep = set(keep_keys)
+        self._renders = {k: v for k, v in self._renders.items() if k in keep}
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+テンプレートのコンパイル済みパック
+
+templates/templates.csv と config.FIXED_ZOOM_INFO から、次の内容を1ファイル（templates.pack）にまとめます。
+- テンプレート本文と、{{変数}} の位置で分割済みのセグメント（文字列部分と変数名の並び）
+- イベント種別ごとの参照変数の一覧
+- 元データ（CSVの中身・固定Zoom情報・対応変数）の内容ハッシュ
+
+AnnouncementGenerator はパックを1回の読み込みで使い、CSVの再解析を省きます。
+内容ハッシュが今のCSV・設定と合わない（古い）パックは使わず、CSVから読み込みます。
+marshal 形式は Python のバージョンごとに異なるため、作ったときと違うバージョンのパックも古いとみなします。
+パックを作るのは下のコマンド（デプロイ時のビルド手順）だけで、アプリの読み込みでは作りません。
+CSVを編集したらパックも作り直してください（作り直すまではCSVから読み込みます）。
+
+使い方:
+    python template_pack.py            # templates/templates.csv → templates/templates.pack
+    python template_pack.py --check    # パックが最新かどうかだけ確認
+"""
+
+import argparse
+import hashlib
+import json
+import marshal
+import os
+import struct
+import sys
+from typing import Dict, Optional, Tuple
+
+import config
+
+PACK_MAGIC = b"DATPACK\x00"
+# パックの構造を変えたら上げる
+PACK_FORMAT_VERSION = 1
+# マジック・形式バージョン・marshal バージョン・Python のメジャー/マイナー
+_HEADER = struct.Struct("<8sHHBB")
+
+
+class TemplatePackError(Exception):
+    """テンプレートのコンパイルに失敗した（対応していない変数など）"""
+
+
+def pack_path_for(csv_path: str) -> str:
+    """CSVに対応するパックの場所（同じディレクトリ・拡張子 .pack）"""
+    return os.path.splitext(csv_path)[0] + ".pack"
+
+
+def split_segments(template: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    テンプレートを (文字列部分, 変数名) に分ける。文字列部分は変数名より1つ多い。
+    対応していない {{変数}} はそのまま文字列として残す（差し込みと同じ扱い）。
+    """
+    from template_index import VARIABLE_RE
+
+    supported = set(config.SUPPORTED_VARIABLES)
+    literals, names = [], []
+    pos = 0
+    buf = ""
+    for m in VARIABLE_RE.finditer(template):
+        if m.group(1) not in supported:
+            continue
+        buf += template[pos:m.start()]
+        literals.append(buf)
+        names.append(m.group(1))
+        buf = ""
+        pos = m.end()
+    literals.append(buf + template[pos:])
+    return tuple(literals), tuple(names)
+
+
+def render_segments(segments: Tuple[Tuple[str, ...], Tuple[str, ...]], values: Dict[str, str]) -> str:
+    """分割済みのテンプレートに値を差し込む"""
+    literals, names = segments
+    parts = [literals[0]]
+    for name, literal in zip(names, literals[1:]):
+        parts.append(values.get(name, ""))
+        parts.append(literal)
+    return "".join(parts)
+
+
+def source_hash(csv_bytes: bytes, zoom_info: Dict = None) -> str:
+    """パックの元データ（CSVの中身・固定Zoom情報・対応変数・形式バージョン）の内容ハッシュ"""
+    zoom_info = config.FIXED_ZOOM_INFO if zoom_info is None else zoom_info
+    h = hashlib.sha1()
+    h.update(str(PACK_FORMAT_VERSION).encode("ascii"))
+    h.update(b"\0")
+    h.update(csv_bytes)
+    h.update(b"\0")
+    h.update(json.dumps(zoom_info, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(list(config.SUPPORTED_VARIABLES)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _read_bytes(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def compile_templates(csv_path: str, strict: bool = True) -> Dict:
+    """
+    CSVを読み込んでパックの中身（辞書）を作る。
+    strict=True のとき、対応していない変数を使っているテンプレートがあれば TemplatePackError。
+    """
+    from generate_announcement import _load_templates_from_path
+    from template_index import template_variables
+
+    csv_bytes = _read_bytes(csv_path)
+    if csv_bytes is None:
+        raise TemplatePackError(f"テンプレートCSVが見つかりません: {csv_path}")
+    templates = _load_templates_from_path(csv_path)
+    if not templates:
+        raise TemplatePackError(f"テンプレートを読み込めませんでした: {csv_path}")
+    supported = set(config.SUPPORTED_VARIABLES)
+    unknown = {et: sorted(template_variables(body) - supported) for et, body in templates.items()}
+    unknown = {et: names for et, names in unknown.items() if names}
+    if strict and unknown:
+        detail = "、".join(f"{et}: {', '.join(names)}" for et, names in unknown.items())
+        raise TemplatePackError(f"対応していない変数があります（{detail}）")
+    return {
+        "format": PACK_FORMAT_VERSION,
+        "source_hash": source_hash(csv_bytes),
+        "templates": templates,
+        "template_hashes": {et: hashlib.sha1(body.encode("utf-8")).hexdigest() for et, body in templates.items()},
+        "segments": {et: split_segments(body) for et, body in templates.items()},
+        "variables": {et: tuple(sorted(template_variables(body) & supported)) for et, body in templates.items()},
+        "zoom": {et: dict(info) for et, info in config.FIXED_ZOOM_INFO.items()},
+    }
+
+
+def write_pack(pack: Dict, path: str) -> None:
+    """パックを書き出す（一時ファイルに書いてから置き換える）"""
+    header = _HEADER.pack(PACK_MAGIC, PACK_FORMAT_VERSION, marshal.version, *sys.version_info[:2])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header + marshal.dumps(pack))
+    os.replace(tmp, path)
+
+
+def build_pack(csv_path: str = None, pack_path: str = None, strict: bool = True) -> str:
+    """CSVからパックを作って書き出し、パックのパスを返す"""
+    csv_path = csv_path or config.TEMPLATES_CSV_PATH
+    pack_path = pack_path or pack_path_for(csv_path)
+    write_pack(compile_templates(csv_path, strict=strict), pack_path)
+    return pack_path
+
+
+# パックファイルを実際に読んだ回数（負荷試験用）
+load_stats = {"pack_reads": 0}
+
+
+def read_pack(path: str) -> Optional[Dict]:
+    """パックを1回で読み込む。壊れている・形式や Python のバージョンが違う場合は None"""
+    data = _read_bytes(path)
+    if data is not None:
+        load_stats["pack_reads"] += 1
+    if data is None or len(data) < _HEADER.size:
+        return None
+    magic, fmt, marshal_version, major, minor = _HEADER.unpack_from(data)
+    if (magic, fmt, marshal_version, (major, minor)) != (
+        PACK_MAGIC, PACK_FORMAT_VERSION, marshal.version, tuple(sys.version_info[:2])
+    ):
+        return None
+    try:
+        pack = marshal.loads(data[_HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+        return None
+    return pack if isinstance(pack, dict) and pack.get("format") == PACK_FORMAT_VERSION else None
+
+
+# (パックのパス, CSVのパス) -> ((パックの更新時刻・サイズ, CSVの更新時刻・サイズ), パック)
+_LOADED: Dict[Tuple[str, str], Tuple[tuple, Dict]] = {}
+
+
+def _stat_key(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_fresh_pack(csv_path: str, pack_path: str = None) -> Optional[Dict]:
+    """
+    CSV・固定Zoom情報と内容ハッシュが一致するパックだけを返す（古ければ None）。
+    確認済みのパックは、パック・CSVのどちらも更新されていなければ読み直さない。
+    """
+    pack_path = pack_path or pack_path_for(csv_path)
+    stamp = (_stat_key(pack_path), _stat_key(csv_path))
+    loaded = _LOADED.get((pack_path, csv_path))
+    if loaded is not None and loaded[0] == stamp:
+        return loaded[1]
+    pack = read_pack(pack_path)
+    if pack is None:
+        return None
+    csv_bytes = _read_bytes(csv_path)
+    if csv_bytes is None or pack.get("source_hash") != source_hash(csv_bytes):
+        return None
+    _LOADED[(pack_path, csv_path)] = (stamp, pack)
+    return pack
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="テンプレートCSVをパックにコンパイルする")
+    parser.add_argument("--csv", default=config.TEMPLATES_CSV_PATH)
+    parser.add_argument("--out", help="出力先（省略時はCSVと同じ場所の .pack）")
+    parser.add_argument("--check", action="store_true", help="パックが最新かどうかだけ確認する")
+    args = parser.parse_args()
+    pack_path = args.out or pack_path_for(args.csv)
+    if args.check:
+        if load_fresh_pack(args.csv, pack_path) is None:
+            print(f"古いか、ありません: {pack_path}")
+            sys.exit(1)
+        print(f"最新です: {pack_path}")
+        return
+    try:
+        build_pack(args.csv, pack_path)
+    except TemplatePackError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"作成しました: {pack_path}")
+
+
+if __name__ == "__main__":
+    main()
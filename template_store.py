@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+共有のテンプレート置き場（版管理つき）
+
+テンプレート管理での追加・編集を全セッション共通の SQLite に保存します。
+編集するたびに「標準のテンプレート（templates/templates.csv）への上書き一式」を新しい版として追加し、
+追加した版は書き換えません（変更しなかったテンプレートの本文は前の版と共有する）。
+
+読む側は最新の版番号を1回引くだけで、その版の上書き一式は読み込み済みのものを使い回します。
+生成器も版ごとに1回だけ作れば、新しい版ができるまで全セッションで共有できます。
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    parent_id INTEGER,
+    note TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_entries (
+    snapshot_id INTEGER NOT NULL,
+    event_type TEXT NOT NULL,
+    body_hash TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, event_type)
+);
+CREATE TABLE IF NOT EXISTS template_bodies (
+    body_hash TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+"""
+
+
+def _body_hash(body: str) -> str:
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+class TemplateSnapshot:
+    """1つの版（標準のテンプレートへの上書き一式）。作ったあとは変更しない"""
+
+    __slots__ = ("id", "parent_id", "note", "created_at", "overrides")
+
+    def __init__(self, snapshot_id: int, parent_id: Optional[int], note: str, created_at: float,
+                 overrides: Dict[str, str]):
+        self.id = snapshot_id
+        self.parent_id = parent_id
+        self.note = note
+        self.created_at = created_at
+        self.overrides: Mapping[str, str] = MappingProxyType(dict(overrides))
+
+
+# まだ何も保存していない状態（版番号 0・上書きなし）
+EMPTY_SNAPSHOT = TemplateSnapshot(0, None, "", 0.0, {})
+
+
+class TemplateStore:
+    """
+    テンプレートの版の置き場（SQLite）。
+    版は増えるだけなので、読み込んだ版はプロセス内で覚えておき、二度と読み直さない。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or config.TEMPLATE_STORE_PATH
+        self._write_lock = threading.Lock()
+        self._snapshots: Dict[int, TemplateSnapshot] = {0: EMPTY_SNAPSHOT}
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    # --- 読む側 ---
+
+    def latest_id(self) -> int:
+        """最新の版番号（まだ版がなければ 0）"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT MAX(id) FROM snapshots").fetchone()
+        return row[0] or 0
+
+    def snapshot(self, snapshot_id: int) -> TemplateSnapshot:
+        """版番号の上書き一式。ない版番号は KeyError"""
+        snap = self._snapshots.get(snapshot_id)
+        if snap is not None:
+            return snap
+        with self._connect() as conn:
+            snap = self._read(conn, snapshot_id)
+        if snap is None:
+            raise KeyError(snapshot_id)
+        # 同じ版を別スレッドが先に読んでいても中身は同じなので、どちらを残してもよい
+        return self._snapshots.setdefault(snapshot_id, snap)
+
+    def latest(self) -> TemplateSnapshot:
+        return self.snapshot(self.latest_id())
+
+    def history(self, limit: int = 20) -> List[TemplateSnapshot]:
+        """新しい順の版一覧"""
+        with self._connect() as conn:
+            ids = [r[0] for r in conn.execute("SELECT id FROM snapshots ORDER BY id DESC LIMIT ?", (limit,))]
+        return [self.snapshot(i) for i in ids]
+
+    @staticmethod
+    def _read(conn: sqlite3.Connection, snapshot_id: int) -> Optional[TemplateSnapshot]:
+        row = conn.execute(
+            "SELECT parent_id, note, created_at FROM snapshots WHERE id = ?", (snapshot_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        overrides = dict(conn.execute(
+            "SELECT e.event_type, b.body FROM snapshot_entries e "
+            "JOIN template_bodies b ON b.body_hash = e.body_hash WHERE e.snapshot_id = ?",
+            (snapshot_id,),
+        ))
+        return TemplateSnapshot(snapshot_id, row[0], row[1], row[2], overrides)
+
+    # --- 書く側 ---
+
+    def publish(self, changes: Dict[str, Optional[str]], note: str = "") -> TemplateSnapshot:
+        """
+        最新の版に changes（{イベント種別名: 本文}。本文が None なら上書きをやめて標準に戻す）を当てた版を追加する。
+        別のセッションが先に版を追加していても、その版に重ねるので、触っていない種別の編集は消えない。
+        """
+        with self._write_lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            parent_id = conn.execute("SELECT MAX(id) FROM snapshots").fetchone()[0]
+            cur = conn.execute(
+                "INSERT INTO snapshots (parent_id, note, created_at) VALUES (?, ?, ?)",
+                (parent_id, note, time.time()),
+            )
+            new_id = cur.lastrowid
+            if parent_id is not None:
+                # 変えない種別は本文のハッシュだけ写す（本文そのものは前の版と共有）
+                conn.execute(
+                    "INSERT INTO snapshot_entries SELECT ?, event_type, body_hash FROM snapshot_entries "
+                    "WHERE snapshot_id = ?",
+                    (new_id, parent_id),
+                )
+            for event_type, body in changes.items():
+                conn.execute(
+                    "DELETE FROM snapshot_entries WHERE snapshot_id = ? AND event_type = ?", (new_id, event_type)
+                )
+                if body is None:
+                    continue
+                h = _body_hash(body)
+                conn.execute("INSERT OR IGNORE INTO template_bodies VALUES (?, ?)", (h, body))
+                conn.execute("INSERT INTO snapshot_entries VALUES (?, ?, ?)", (new_id, event_type, h))
+            snap = self._read(conn, new_id)
+        self._snapshots[new_id] = snap
+        return snap
+
+    def restore(self, snapshot_id: int, note: str = None) -> TemplateSnapshot:
+        """過去の版と同じ上書き一式を、新しい版として追加する（過去の版は書き換えない）"""
+        old = self.snapshot(snapshot_id)
+        current = self.latest()
+        changes: Dict[str, Optional[str]] = {et: None for et in current.overrides if et not in old.overrides}
+        changes.update(old.overrides)
+        return self.publish(changes, note if note is not None else f"版{snapshot_id}に戻す")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+OAuthトークンの管理
+
+連携アカウントごとに Credentials を1つだけ持ち、全セッションで共有します。
+有効期限が近づいたらバックグラウンドで先に更新するので、予定取得のたびにトークン更新を待つことはありません。
+同じアカウントの更新が同時に要求されても、実際の更新は1回だけ行います。
+更新に失敗した場合は握りつぶさず、last_error() と TokenRefreshError で呼び出し側に伝えます。
+取り消された・期限切れのリフレッシュトークン（invalid_grant）は再連携するまで更新しません。
+それ以外の失敗は間隔を倍々に空けて再試行します（TOKEN_RETRY_MAX_SEC まで）。
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import config
+from google_calendar_client import (
+    GOOGLE_API_AVAILABLE,
+    credentials_account_key,
+    credentials_to_dict,
+    dict_to_credentials,
+)
+
+
+class TokenRefreshError(Exception):
+    """トークンの更新に失敗した（再連携が必要な場合がある）"""
+
+
+class _Entry:
+    def __init__(self, creds):
+        self.creds = creds
+        self.lock = threading.Lock()   # 更新を1回にまとめるためのロック
+        self.error: Optional[str] = None
+        # 期限が不明なトークン（古い保存形式）は一度更新して期限を確定させる
+        self.expiry_known = getattr(creds, "expiry", None) is not None
+        # 続けて失敗した回数と、次に裏で更新を試みてよい時刻（time.monotonic()）
+        self.failures = 0
+        self.retry_at = 0.0
+        # リフレッシュトークンが使えなくなった（再連携が必要）
+        self.revoked = False
+
+
+class TokenManager:
+    """アカウントごとの Credentials を保持し、期限切れ前に更新する"""
+
+    def __init__(self, lead_time_sec: float = None, check_interval_sec: float = None, retry_max_sec: float = None):
+        self.lead_time = timedelta(seconds=lead_time_sec if lead_time_sec is not None else config.TOKEN_REFRESH_LEAD_SEC)
+        self.check_interval_sec = check_interval_sec if check_interval_sec is not None else config.TOKEN_CHECK_INTERVAL_SEC
+        self.retry_max_sec = retry_max_sec if retry_max_sec is not None else config.TOKEN_RETRY_MAX_SEC
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"refreshes": 0, "failures": 0}
+
+    def get(self, creds_dict: Dict):
+        """
+        セッションに保存された辞書から、共有の Credentials を返す。
+        通常は期限切れ前にバックグラウンドで更新済みなので、ここで通信は発生しない。
+        既に期限切れの場合だけその場で更新し、失敗したら TokenRefreshError を送出する。
+        リフレッシュトークンが使えなくなっている場合も、再連携する（新しいトークンを渡す）まで TokenRefreshError。
+        """
+        if not GOOGLE_API_AVAILABLE or not creds_dict:
+            return None
+        key = credentials_account_key(creds_dict)
+        with self._lock:
+            entry = self._entries.get(key)
+            relinked = entry is not None and entry.revoked and (
+                creds_dict.get("refresh_token") != getattr(entry.creds, "refresh_token", None)
+            )
+            if entry is None or relinked:
+                entry = self._entries[key] = _Entry(dict_to_credentials(creds_dict))
+        self._ensure_thread()
+        if entry.revoked:
+            raise TokenRefreshError(entry.error)
+        if entry.creds is not None and self._is_expired(entry.creds):
+            self._refresh(entry, force=False)
+            if entry.error:
+                raise TokenRefreshError(entry.error)
+        return entry.creds
+
+    def credentials_dict(self, creds_dict: Dict) -> Optional[Dict]:
+        """共有の Credentials の最新状態を辞書で返す（セッションに保存し直す用）"""
+        entry = self._entries.get(credentials_account_key(creds_dict))
+        if entry is None or entry.creds is None:
+            return None
+        return credentials_to_dict(entry.creds)
+
+    def last_error(self, creds_dict: Dict) -> Optional[str]:
+        entry = self._entries.get(credentials_account_key(creds_dict))
+        return entry.error if entry else None
+
+    def forget(self, creds_dict: Dict) -> None:
+        """連携解除時に保持している Credentials を捨てる"""
+        with self._lock:
+            self._entries.pop(credentials_account_key(creds_dict), None)
+
+    # --- 内部処理 ---
+
+    def _is_expired(self, creds) -> bool:
+        return bool(getattr(creds, "expired", False))
+
+    def _expires_soon(self, entry: _Entry) -> bool:
+        expiry = getattr(entry.creds, "expiry", None)
+        if expiry is None or not entry.expiry_known:
+            return True
+        return expiry - self.lead_time <= datetime.utcnow()
+
+    def _refresh(self, entry: _Entry, force: bool) -> None:
+        """同じアカウントの更新は1回にまとめる（ロック取得後に期限を見直す）"""
+        with entry.lock:
+            creds = entry.creds
+            if creds is None or not getattr(creds, "refresh_token", None):
+                return
+            if not force and not self._is_expired(creds):
+                return
+            if force and not self._expires_soon(entry):
+                return
+            try:
+                from google.auth.transport.requests import Request
+                creds.refresh(Request())
+                entry.expiry_known = True
+                entry.error = None
+                entry.failures = 0
+                entry.retry_at = 0.0
+                self.stats["refreshes"] += 1
+            except Exception as e:
+                entry.error = f"トークンの更新に失敗しました: {e}"
+                entry.failures += 1
+                entry.retry_at = time.monotonic() + min(
+                    self.check_interval_sec * 2 ** entry.failures, self.retry_max_sec
+                )
+                entry.revoked = "invalid_grant" in str(e)
+                self.stats["failures"] += 1
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="token-refresher", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            with self._lock:
+                entries = list(self._entries.values())
+            now = time.monotonic()
+            for entry in entries:
+                # 再連携が必要なもの・失敗して間を空けているものは、期限が不明でも裏では試さない
+                if entry.revoked or now < entry.retry_at:
+                    continue
+                if entry.creds is not None and self._expires_soon(entry):
+                    self._refresh(entry, force=True)
+            self._stop.wait(self.check_interval_sec)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_MANAGER: Optional[TokenManager] = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_token_manager() -> TokenManager:
+    """プロセス全体で共有する TokenManager"""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = TokenManager()
+        return _MANAGER